@@ -0,0 +1,273 @@
+"""Precomputed aggregates behind the "Data insights" page.
+
+``AggregateCube`` holds the sum, count, min and max of Sales, Discount and
+Profit per (dimension, Discount, Sub-Category) for every insight dimension.
+It is built in a single pass over the rows: the rows are grouped once on the
+finest grain and each dimension's cuboid is rolled up from that result.
+Charts then roll those small cuboids up further, so every mean is derived
+from sums and counts in time proportional to the number of groups.
+
+``category_means`` serves the "Categorical Variables" page: it reads the
+columns in place and reduces them with ``np.bincount`` over the categorical
+codes, without copying the frame.
+"""
+import functools
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+import filters
+import instrument
+import loader
+import parallel
+import shared
+import streaming
+
+DIMENSIONS = ['Ship Mode', 'Segment', 'Region', 'Category', 'City', 'State']
+CUBE_KEYS = ['Discount', 'Sub-Category']
+METRICS = ['Sales', 'Discount', 'Profit']
+STATS = ['sum', 'count', 'min', 'max']
+CUBE_SUFFIX = '.cube.pkl'
+# Columns the cube is built from (Discount is both a key and a metric).
+CUBE_COLUMNS = list(dict.fromkeys(DIMENSIONS + CUBE_KEYS + METRICS))
+
+
+def _rollup(cuboid, levels):
+    grouped = cuboid.groupby(level=levels, observed=True)
+    return pd.concat([grouped.sum()[['sum', 'count']],
+                      grouped.min()[['min']],
+                      grouped.max()[['max']]], axis=1)
+
+
+def _codes(column):
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return column.cat.codes.to_numpy(), column.cat.categories
+    return pd.factorize(column, sort=True)
+
+
+def category_means(df, columns, metrics=('Sales', 'Profit', 'Discount'), positions=None):
+    """Mean of ``metrics`` per category for each of ``columns``.
+
+    Equivalent to ``df.groupby(col)[metrics].mean()`` for every column, but
+    each column is factorized once (categoricals reuse their codes) and the
+    metrics are reduced with ``np.bincount``. ``positions`` restricts it to
+    those rows (e.g. a filter's selection) without copying the frame.
+    Returns ``{column: frame}`` with a ``count`` column next to the means.
+    """
+    values = {metric: df[metric].to_numpy(dtype='float64') for metric in metrics}
+    if positions is not None:
+        values = {metric: vals[positions] for metric, vals in values.items()}
+    result = {}
+    for col in columns:
+        codes, uniques = _codes(df[col])
+        if positions is not None:
+            codes = codes[positions]
+        weights = values
+        if (codes < 0).any():
+            # Missing values have code -1 and are left out, as in groupby.
+            valid = codes >= 0
+            codes = codes[valid]
+            weights = {metric: vals[valid] for metric, vals in values.items()}
+        # bincount works on intp; convert once instead of on every call.
+        codes = codes.astype(np.intp, copy=False)
+        counts = np.bincount(codes, minlength=len(uniques))
+        observed = counts > 0
+        table = {}
+        for metric, vals in weights.items():
+            sums = np.bincount(codes, weights=vals, minlength=len(uniques))
+            table[metric] = sums[observed] / counts[observed]
+        table['count'] = counts[observed]
+        result[col] = pd.DataFrame(table, index=pd.Index(uniques[observed], name=col))
+    return result
+
+
+def _align_levels(frames):
+    # Give categorical index levels the union of all frames' categories so
+    # concatenating them keeps the levels categorical.
+    frames = [frame.copy(deep=False) for frame in frames]
+    for i, level in enumerate(frames[0].index.levels):
+        if not isinstance(level, pd.CategoricalIndex):
+            continue
+        categories = level.categories
+        for frame in frames[1:]:
+            categories = categories.union(frame.index.levels[i].categories)
+        categories = categories.sort_values()
+        for frame in frames:
+            frame.index = frame.index.set_levels(
+                frame.index.levels[i].set_categories(categories), level=i)
+    return frames
+
+
+class AggregateCube:
+    """Per-dimension cuboids with (stat, metric) columns."""
+
+    def __init__(self, cuboids):
+        self.cuboids = cuboids
+
+    @classmethod
+    def from_frame(cls, df):
+        df = df.astype({metric: 'float64' for metric in METRICS})
+        base = (df.groupby(DIMENSIONS + CUBE_KEYS, observed=True, sort=False)[METRICS]
+                  .agg(STATS)
+                  .swaplevel(axis=1))
+        cuboids = {dim: _rollup(base, [dim] + CUBE_KEYS) for dim in DIMENSIONS}
+        return cls(cuboids)
+
+    @classmethod
+    def from_chunks(cls, chunks):
+        """Build the cube from an iterable of row chunks, one chunk in memory at a time."""
+        cube = None
+        for chunk in chunks:
+            part = cls.from_frame(chunk)
+            cube = part if cube is None else cube.merge(part)
+        return cube
+
+    def merge(self, other):
+        """Combine with the cube of another set of rows, in O(groups)."""
+        cuboids = {}
+        for dim, cuboid in self.cuboids.items():
+            combined = pd.concat(_align_levels([cuboid, other.cuboids[dim]]))
+            cuboids[dim] = _rollup(combined, [dim] + CUBE_KEYS)
+        return AggregateCube(cuboids)
+
+    def _cuboid(self, keys):
+        for key in keys:
+            if key in self.cuboids:
+                return self.cuboids[key]
+        # Only Discount/Sub-Category requested: any cuboid can answer, so
+        # roll up the smallest one.
+        return min(self.cuboids.values(), key=len)
+
+    def rollup(self, keys):
+        keys = list(keys)
+        return _rollup(self._cuboid(keys), keys)
+
+    def sum(self, keys, metrics=METRICS):
+        return self.rollup(keys)['sum'][metrics]
+
+    def mean(self, keys, metrics=METRICS):
+        table = self.rollup(keys)
+        return table['sum'][metrics] / table['count'][metrics]
+
+    def min(self, keys, metrics=METRICS):
+        return self.rollup(keys)['min'][metrics]
+
+    def max(self, keys, metrics=METRICS):
+        return self.rollup(keys)['max'][metrics]
+
+    def count(self, keys):
+        """Number of rows per group, like ``groupby(keys).size()``."""
+        return self.rollup(keys)['count']['Sales'].rename('count')
+
+    def value_counts(self, key):
+        """Equivalent of ``df[key].value_counts()``."""
+        return self.count([key]).sort_values(ascending=False, kind='stable')
+
+    def values(self, key):
+        return self.rollup([key]).index
+
+    def save(self, path, version):
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump({'version': version, 'cuboids': self.cuboids}, f)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path, version):
+        """Read a saved cube, or return None if it belongs to another version
+        or cannot be read."""
+        try:
+            with open(path, 'rb') as f:
+                saved = pickle.load(f)
+            if saved.get('version') != version:
+                return None
+            return cls(saved['cuboids'])
+        except Exception:
+            # Missing, truncated, or pickled by other pandas or numpy
+            # versions (AttributeError, ModuleNotFoundError, TypeError, ...):
+            # the caller rebuilds it.
+            return None
+
+
+_cubes = shared.SharedStore(int(os.environ.get('SHARED_CUBES_MB', 256)) << 20)
+
+
+def cube_path(path=loader.DATA_PATH):
+    return os.path.splitext(path)[0] + CUBE_SUFFIX
+
+
+def _build_filtered(path, where):
+    # Cubes of filtered rows are kept in memory only.
+    with instrument.span('build_cube', 'aggregate', filtered=True):
+        if parallel.enabled():
+            return parallel.map_reduce(AggregateCube.from_chunks, path, CUBE_COLUMNS,
+                                       functools.partial(filters.filter_chunk, where, None))
+        if streaming.out_of_core(path):
+            chunks = streaming.iter_chunks(path, CUBE_COLUMNS)
+            return AggregateCube.from_chunks(filters.filter_chunk(where, None, chunk) for chunk in chunks)
+        return AggregateCube.from_frame(filters.apply(loader.load_dataset(path, CUBE_COLUMNS), where, path))
+
+
+def _load_or_build(path, version):
+    saved = cube_path(path)
+    with instrument.span('load_cube', 'load'):
+        cube = AggregateCube.load(saved, version)
+    if cube is None:
+        with instrument.span('build_cube', 'aggregate'):
+            if parallel.enabled():
+                cube = parallel.map_reduce(AggregateCube.from_chunks, path, CUBE_COLUMNS)
+            elif streaming.out_of_core(path):
+                cube = AggregateCube.from_chunks(streaming.iter_chunks(path, CUBE_COLUMNS))
+            else:
+                cube = AggregateCube.from_frame(loader.load_dataset(path))
+        try:
+            cube.save(saved, version)
+        except OSError:
+            pass
+    return cube
+
+
+def get_cube(path=loader.DATA_PATH, where=filters.NO_FILTER):
+    """Return the cube for the current version of ``path``, of the rows passing ``where``.
+
+    Cubes are shared by every session in the process (sessions asking for a
+    cube that is being built wait for that build) and persisted next to the
+    dataset, so a restart does not need to touch the rows at all. Datasets
+    too large for memory are streamed in chunks (see ``streaming``), and with
+    the parallel backend on the cube is built from partitions in a pool.
+    """
+    path = os.path.abspath(path)
+    version = loader.dataset_version(path)
+    if where.active:
+        return _cubes.get_or_compute((path, version, where), lambda: _build_filtered(path, where))
+    return _cubes.get_or_compute((path, version), lambda: _load_or_build(path, version))
+
+
+def append_rows(rows, path=loader.DATA_PATH):
+    """Append new order rows to the dataset and fold them into its cube.
+
+    Only the appended rows are aggregated; the cached cube (and any cached
+    streaming statistics) are merged with them, so the cost depends on the
+    batch and the number of groups rather than on the size of the history.
+    """
+    path = os.path.abspath(path)
+    rows, old_version, new_version = loader.append_rows(rows, path)
+    for key, cached in _cubes.items():
+        if key[:2] != (path, old_version):
+            continue
+        # Cubes of filtered rows take the appended rows that pass their filter.
+        batch = rows if len(key) == 2 else filters.filter_chunk(key[2], None, rows)
+        cube = cached.merge(AggregateCube.from_frame(batch)) if len(batch) else cached
+        _cubes.put((path, new_version) + key[2:], cube)
+        if len(key) == 2:
+            try:
+                cube.save(cube_path(path), new_version)
+            except OSError:
+                pass
+    streaming.append_rows(rows, old_version, new_version, path)
+    # Imported here because ranking builds on this module.
+    import ranking
+    ranking.append_rows(rows, old_version, new_version, path)
+    return new_version
@@ -0,0 +1,172 @@
+"""Local HTTP/JSON query API over the aggregate store.
+
+    python api.py [--port 8502] [--host 127.0.0.1]
+
+serves the dataset at ``SUPERSTORE_DATA`` (GET only):
+
+- ``/version``: the dataset version being served;
+- ``/aggregate?by=Region,Discount&metrics=Profit&stat=mean``: ``stat``
+  (mean, sum, count, min or max) of ``metrics`` (default: all but those in
+  ``by``) per group of ``by``, as ``{"version", "by", "stat", "rows": [{column: value}, ...]}``;
+- ``/rollup?keys=Region``: every statistic per group, which ``StoreCube``
+  reads (``AGGREGATE_STORE=http://...`` points the dashboard here).
+
+Queries are answered by ``store`` from its SQLite file; the first one for a
+dataset version writes it. Encoded responses are cached per version and
+query (``API_CACHE_MB``, default 64) and carry an ETag of both, so repeated
+requests are served without touching the store and clients that send
+``If-None-Match`` get a 304. ``query`` and ``fetch_rollup`` are the client
+side, for batch jobs.
+"""
+import argparse
+import hashlib
+import json
+import os
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+import aggregates
+import loader
+import shared
+import store
+
+PORT = int(os.environ.get('API_PORT', 8502))
+TIMEOUT = 300
+
+_responses = shared.SharedStore(int(os.environ.get('API_CACHE_MB', 64)) << 20)
+
+
+def _list(value):
+    return [item for item in value.split(',') if item] if value else []
+
+
+def _version(path, params):
+    return {}
+
+
+def _aggregate(path, params):
+    by = _list(params.get('by'))
+    stat = params.get('stat', 'mean')
+    # A metric grouped on (Discount) is its own key: it is not repeated.
+    metrics = [metric for metric in _list(params.get('metrics')) or aggregates.METRICS if metric not in by]
+    table = store.query(by, metrics, stat, path)
+    return {'by': by, 'stat': stat, 'rows': json.loads(table.reset_index().to_json(orient='records'))}
+
+
+def _rollup(path, params):
+    keys = _list(params.get('keys'))
+    table = store.rollup(keys, path)
+    return {'keys': keys, 'columns': [list(column) for column in table.columns],
+            'index': [list(key) if isinstance(key, tuple) else [key] for key in table.index],
+            'data': table.to_numpy().tolist()}
+
+
+ROUTES = {'/version': _version, '/aggregate': _aggregate, '/rollup': _rollup}
+
+
+def respond(path, route, params):
+    """The encoded response to ``route`` with query ``params`` and its ETag; cached."""
+    path = os.path.abspath(path)
+    version = loader.dataset_version(path)
+    query = tuple(sorted(params.items()))
+
+    def encode():
+        body = dict(ROUTES[route](path, params), version=version)
+        return json.dumps(body, separators=(',', ':')).encode()
+    body = _responses.get_or_compute((path, version, route, query), encode)
+    etag = '"' + hashlib.sha1(repr((version, route, query)).encode()).hexdigest()[:20] + '"'
+    return body, etag
+
+
+class Handler(BaseHTTPRequestHandler):
+    server_version = 'SuperstoreAPI/1.0'
+    # Keep connections open between a client's requests.
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path not in ROUTES:
+            return self._send(404, json.dumps({'error': f'unknown path {url.path}'}).encode())
+        params = {key: values[-1] for key, values in urllib.parse.parse_qs(url.query).items()}
+        try:
+            body, etag = respond(self.server.data_path, url.path, params)
+        except ValueError as exc:
+            return self._send(400, json.dumps({'error': str(exc)}).encode())
+        if self.headers.get('If-None-Match') == etag:
+            return self._send(304, b'', etag)
+        self._send(200, body, etag)
+
+    def _send(self, status, body, etag=None):
+        self.send_response(status)
+        if status != 304:
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if etag:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def make_server(path=loader.DATA_PATH, host='127.0.0.1', port=PORT, verbose=False):
+    """A threading server for ``path`` (port 0 picks a free one); call ``serve_forever()``."""
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    server.data_path = os.path.abspath(path)
+    server.verbose = verbose
+    return server
+
+
+def fetch(url, route, **params):
+    """GET ``route`` from the API at ``url`` and decode its JSON."""
+    query = urllib.parse.urlencode({key: ','.join(value) if isinstance(value, (list, tuple)) else value
+                                    for key, value in params.items() if value is not None})
+    with urllib.request.urlopen(f'{url.rstrip("/")}{route}?{query}', timeout=TIMEOUT) as response:
+        return json.load(response)
+
+
+def query(url, by, metrics=None, stat='mean'):
+    """``store.query`` through the API at ``url``, as a frame indexed by ``by``."""
+    body = fetch(url, '/aggregate', by=list(by), metrics=metrics, stat=stat)
+    return pd.DataFrame(body['rows']).set_index(body['by'])
+
+
+def fetch_rollup(url, keys):
+    """``store.rollup(keys)`` through the API at ``url``."""
+    body = fetch(url, '/rollup', keys=list(keys))
+    index = pd.MultiIndex.from_tuples([tuple(key) for key in body['index']], names=body['keys'])
+    if len(body['keys']) == 1:
+        index = index.get_level_values(0)
+    table = pd.DataFrame(body['data'], index=index,
+                         columns=pd.MultiIndex.from_tuples([tuple(column) for column in body['columns']]))
+    table['count'] = table['count'].astype(np.int64)
+    return table
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve the aggregate store over HTTP.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--verbose', action='store_true', help='log every request')
+    args = parser.parse_args(argv)
+    server = make_server(loader.DATA_PATH, args.host, args.port, args.verbose)
+    # Write the store before the first request rather than during it.
+    store.materialize(loader.DATA_PATH)
+    print(f'Serving {server.data_path} on http://{args.host}:{server.server_port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,21 +1,227 @@
 # Import necessary libraries
+import importlib
+import io
+import os
+import threading
+import time
 import streamlit as st
+from streamlit.errors import StreamlitAPIException
 import numpy as np
 import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
-import matplotlib.pyplot as plt
-import seaborn as sns
-from PIL import Image
+
+from loader import DATA_PATH, dataset_version
+from pages import (INSIGHTS, PAGES, approximate_cardinality, approximate_median, approximate_top_counts,
+                   category_means, city_ranking, filter_options, from_partials, numerical_summary, order_trends,
+                   out_of_core, page_cube, page_preview, per_product_points, row_count, state_category_profit,
+                   streamed_median)
+from ranking import METRICS as RANKING_METRICS
+from sketches import Quantiles
+from timeseries import DIMENSIONS as TREND_DIMENSIONS, FREQUENCIES as TREND_FREQUENCIES
+import filters
+from figcache import figure_cache
+import instrument
+from geo import state_totals
+from drilldown import render_states
+from pairplots import asset_bytes as pairplot_asset
+
+
+class DeferredModule:
+    # Module imported on first attribute access, so a process only pays for
+    # the plotting libraries once it draws a figure that is not cached.
+    # `setup` runs once on the module, before any other use of it.
+
+    def __init__(self, name, setup=None):
+        self._name = name
+        self._setup = setup
+        self._module = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    module = importlib.import_module(self._name)
+                    if self._setup is not None:
+                        self._setup(module)
+                    self._module = module
+        return self._module
+
+    def __getattr__(self, name):
+        return getattr(self.load(), name)
+
 
 # Get matplotlib graphs with dark background
-plt.style.use('dark_background')
+plt = DeferredModule('matplotlib.pyplot', setup=lambda plt: plt.style.use('dark_background'))
+sns = DeferredModule('seaborn')
+px = DeferredModule('plotly.express')
+go = DeferredModule('plotly.graph_objects')
+pio = DeferredModule('plotly.io')
+PLOTTING_MODULES = [plt, sns, px, go, pio]
 
 # Remove unnecessary warnings
 import warnings
 warnings.filterwarnings("ignore")
-st.set_option('deprecation.showPyplotGlobalUse', False)
+try:
+    st.set_option('deprecation.showPyplotGlobalUse', False)
+except StreamlitAPIException:
+    # Newer Streamlit releases dropped the option along with the warning
+    pass
+
+# Timing panel in the sidebar, for maintainers
+ADMIN_PANEL = os.environ.get('ADMIN_PANEL') == '1'
+
+# Initial state of the 'Approximate results' toggle
+APPROXIMATE = os.environ.get('APPROXIMATE') == '1'
+
+# Views of the dashboard, in sidebar order
+NAV = ['Home', 'Dataset', 'Technologies Used']
+HOME_PAGES = ['Retail Data', 'Numerical Variables', 'Categorical Variables', 'Data insights', 'Conclusion']
+INSIGHT_VIEWS = ['Ship Mode', 'Segment', 'Region', 'City', 'State', 'Category', 'Sub-Category', 'Trends']
+# Trend charts: (title, metric, statistic)
+TREND_CHARTS = [('Sales', 'Sales', 'sum'), ('Profit', 'Profit', 'sum'), ('Deals', 'Sales', 'count')]
+
+
+# Row filter of the rerun in progress, per session thread
+_rerun = threading.local()
+
+
+def figure_key(*parts):
+    # Rendered figures are only valid for the dataset version and row filter they were drawn from
+    where = getattr(_rerun, 'where', filters.NO_FILTER)
+    return parts + (dataset_version(DATA_PATH),) + ((where,) if where.active else ())
+
+
+def filter_sidebar():
+    # Row filters for the data pages; no values chosen keeps every row
+    st.sidebar.subheader('Filters')
+    options = filter_options()
+    values = {col: st.sidebar.multiselect(col, options[col]) for col in filters.VALUE_COLUMNS}
+    levels = [float(level) for level in options['Discount']]
+    discount = None
+    if levels[0] < levels[-1]:
+        low, high = st.sidebar.slider('Discount', levels[0], levels[-1], (levels[0], levels[-1]), step=0.05)
+        if low > levels[0] or high < levels[-1]:
+            discount = (low, high)
+    return filters.make(values, {'Discount': discount})
+
+
+# pyplot's current figure is process-wide, so sessions draw one figure at a
+# time: from the miss in show_cached_pyplot until show_pyplot rasterizes it
+_pyplot_lock = threading.Lock()
+_drawing = threading.local()
+
+
+def approximate_toggle():
+    # Sketches instead of exact distinct counts, medians and deal rankings; clear it for exact results
+    return st.sidebar.checkbox('Approximate results', value=APPROXIMATE,
+                               help='HyperLogLog distinct counts, KLL medians and count-min rankings, '
+                                    'shown with their error bounds.')
+
+
+def _release_pyplot():
+    if getattr(_drawing, 'held', False):
+        _drawing.held = False
+        _pyplot_lock.release()
+
+
+def end_rerun():
+    # A rerun that stopped halfway must not keep other sessions waiting
+    _release_pyplot()
+    figure_cache.release_claims()
+
+
+def hold_pyplot():
+    # Take pyplot for this session until show_pyplot rasterizes its figure
+    _pyplot_lock.acquire()
+    _drawing.held = True
+    # pandas' .plot() imports pyplot itself: style it first
+    plt.load()
+
+
+def show_cached_pyplot(key, hold=True):
+    # Display a cached matplotlib figure; False means it has to be drawn.
+    # Waits while another session draws the same figure. With hold=False the
+    # caller computes its data first and calls hold_pyplot() before drawing.
+    png = figure_cache.get_or_claim(key, 'png')
+    if png is None:
+        if hold:
+            hold_pyplot()
+        return False
+    st.image(png, width='stretch')
+    return True
+
+
+def show_pyplot(key):
+    # Rasterize the current matplotlib figure once, cache and display it
+    try:
+        with instrument.span('rasterize', 'render', chart=key[1]):
+            buffer = io.BytesIO()
+            plt.savefig(buffer, format='png', bbox_inches='tight')
+            plt.close('all')
+            png = buffer.getvalue()
+    finally:
+        _release_pyplot()
+    figure_cache.put(key, 'png', png)
+    st.image(png, width='stretch')
+
+
+def show_cached_plotly(key):
+    fig_json = figure_cache.get_or_claim(key, 'plotly')
+    if fig_json is None:
+        return False
+    st.plotly_chart(pio.from_json(fig_json), width='stretch')
+    return True
+
+
+def show_plotly(key, fig):
+    with instrument.span('serialize', 'render', chart=key[1]):
+        fig_json = fig.to_json()
+    figure_cache.put(key, 'plotly', fig_json.encode())
+    with instrument.span('plotly_chart', 'render', chart=key[1]):
+        st.plotly_chart(fig, width='stretch')
+
+
+def show_pairplot(hue):
+    # Pairplot asset built for the current dataset version, served as encoded bytes.
+    # Assets are drawn from every row, whatever the filter.
+    key = ('Pairplot', hue, dataset_version(DATA_PATH))
+    image = figure_cache.get_or_claim(key, 'image')
+    if image is None:
+        # Only the drawing takes pyplot; sampling and encoding run beside other sessions
+        with instrument.span('pairplot', 'render', chart=hue):
+            image = pairplot_asset(hue, lock=_pyplot_lock)
+        figure_cache.put(key, 'image', image)
+    st.image(image, width='stretch')
+    if getattr(_rerun, 'where', filters.NO_FILTER).active:
+        st.caption('The pairplot shows every row; the filters apply to the charts below.')
+
+
+def show_admin_panel(view):
+    # Instrumentation switch, the timings of this view and their export.
+    # Recording is process-wide: it covers every session while it is on.
+    with st.sidebar.expander('Performance'):
+        record = st.checkbox('Record timings', value=instrument.enabled())
+        memory = st.checkbox('Trace memory (slower)', value=instrument.tracing_memory())
+        if record:
+            instrument.enable(memory)
+        else:
+            instrument.disable()
+        summary = instrument.summary(view)
+        if summary.empty:
+            st.caption('No timings recorded for this view yet.')
+        else:
+            st.dataframe(summary.round(2))
+        st.download_button('Trace events (JSON)', instrument.trace_json(), 'trace.json', 'application/json')
+        st.download_button('Span log (JSON lines)', instrument.to_jsonl(), 'spans.jsonl', 'application/x-ndjson')
+        if st.button('Clear timings'):
+            instrument.clear()
+
+
+def lazy_section(label, expanded=False):
+    # Expander whose body is only computed while it is open: check `.open`
+    # (on_change and `.open` need streamlit 1.55)
+    return st.expander(label, expanded=expanded, on_change='rerun')
+
 
 def main():
 
@@ -31,13 +237,20 @@ def main():
     st.sidebar.title('Exploratory Data Analysis - Retail')
 
 
-    # Read data
-    df = pd.read_csv('SampleSuperstore.csv')
-
-    nav = st.sidebar.radio('',['Home',"Dataset","Technologies Used"])
+    nav = st.sidebar.radio('',NAV)
+    instrument.set_view(nav)
+    where = _rerun.where = filters.NO_FILTER
     if nav == 'Home':
-        choice = st.sidebar.radio('Choose any parameter',['Retail Data','Numerical Variables','Categorical Variables','Data insights','Conclusion'])
+        choice = st.sidebar.radio('Choose any parameter',HOME_PAGES)
+        instrument.set_view(choice)
+        if choice != 'Conclusion':
+            where = _rerun.where = filter_sidebar()
+            if where.active and row_count(where=where) == 0:
+                st.warning('No rows match the filters.')
+                # Nothing to show: skip the page
+                choice = None
         if choice == 'Retail Data':
+                    df = page_preview(PAGES[choice], where=where)
                     st.title('Exploratory Data Analysis - Retail')
                     st.write('### Perform ‘Exploratory Data Analysis’ on dataset ‘SampleSuperstore’:')
                     st.write('As a business manager, try to ﬁnd out the weak areas where you can work to make more proﬁt.')
@@ -47,11 +260,13 @@ def main():
                     
                     # Display dataset
                     st.dataframe(df)
+                    if out_of_core():
+                        st.caption(f'First {len(df)} rows; the dataset is too large to display in full.')
                     
                     # Shape of data
                     st.write('')
                     st.write('#### Shape of Dataset')
-                    records, attributes = df.shape
+                    records, attributes = row_count(where=where), len(df.columns)
                     st.write(f'There are {records} records and {attributes} attributes')
 
                     # Data dictionary
@@ -97,40 +312,73 @@ def main():
         
         if choice == 'Numerical Variables':
             st.title('Numerical Variables')
+            df = page_preview(PAGES[choice], where=where)
+            # Streamed or parallel: charts come from partial aggregates, not the rows
+            streamed = from_partials()
+            approximate = approximate_toggle()
+            sketched = ('approximate',) if approximate else ()
 
             # List of numerical variables
-            numerical_features = [feature for feature in df.columns if df[feature].dtypes != 'O']
+            numerical_features = [feature for feature in df.columns if pd.api.types.is_numeric_dtype(df[feature])]
 
             st.write('Number of numerical variables: ', len(numerical_features))
             st.subheader(numerical_features)
 
             # Visualise the numerical variables
             st.dataframe(df[numerical_features])
+            # Correlation and histograms come from one-pass statistics, not the
+            # columns, computed on first use by a section that shows them
+            summary_data = {}
+            def summary():
+                if not summary_data:
+                    summary_data.update(numerical_summary(numerical_features, where=where))
+                return summary_data
 
             st.write('')
             # Correlation
-            fig, ax = plt.subplots(figsize=(10,8))   
-            sns.heatmap(df.corr(),cmap='rocket_r',annot=True, ax=ax)
-            plt.title('Heatmap of correlation matrix', fontsize = 20)
-            st.pyplot()
+            with lazy_section('Heatmap of correlation matrix') as section:
+                if section.open:
+                    key = figure_key('Numerical Variables', 'Heatmap of correlation matrix')
+                    if not show_cached_pyplot(key, hold=False):
+                        corr = summary()['moments'].corr()
+                        hold_pyplot()
+                        fig, ax = plt.subplots(figsize=(10,8))   
+                        sns.heatmap(corr,cmap='rocket_r',annot=True, ax=ax)
+                        plt.title('Heatmap of correlation matrix', fontsize = 20)
+                        show_pyplot(key)
 
             st.write('')
             # Discrete Variables
             st.header('Discrete Variables')
-            discrete_feature=[feature for feature in numerical_features if len(df[feature].unique())<25]
+            if approximate:
+                cardinality = approximate_cardinality(numerical_features, where=where)
+                discrete_feature = cardinality.below_limit()
+            elif streamed:
+                discrete_feature = summary()['distinct'].below_limit()
+            else:
+                discrete_feature=[feature for feature in numerical_features if len(df[feature].unique())<25]
             st.write("Discrete Variables Count: ",len(discrete_feature))
+            if approximate:
+                st.caption(f'Distinct values estimated with HyperLogLog, within ±{cardinality.relative_error():.1%} at 95% confidence.')
             st.subheader(discrete_feature)
             st.dataframe(df[discrete_feature])
 
-            # Set plotly for visualizing pandas dataframe
-            pd.options.plotting.backend = "plotly"
 
             # Lets Find the realtionship between them and Sales
-            for feature in discrete_feature:
-                data=df.copy()
-                fig = data.groupby(feature)['Sales'].median().plot(kind='bar')
-                fig.update_layout(xaxis_title=feature, yaxis_title='Sales', title=f'Relation between {feature} and Sales', template='plotly_dark')
-                st.plotly_chart(fig, user_container_width=True)
+            with lazy_section('Relation between discrete variables and Sales') as section:
+                if section.open:
+                    for feature in discrete_feature:
+                        key = figure_key('Numerical Variables', f'Relation between {feature} and Sales', *sketched)
+                        if not show_cached_plotly(key):
+                            if approximate:
+                                median = approximate_median(feature, 'Sales', where=where).median()
+                            else:
+                                median = streamed_median(feature, 'Sales', where=where) if streamed else df.groupby(feature)['Sales'].median()
+                            fig = median.plot(backend='plotly', kind='bar')
+                            fig.update_layout(xaxis_title=feature, yaxis_title='Sales', title=f'Relation between {feature} and Sales', template='plotly_dark')
+                            show_plotly(key, fig)
+                    if approximate and discrete_feature:
+                        st.caption(f'Medians from KLL sketches, within ±{Quantiles().rank_error():.1%} of the median rank at 99% confidence.')
 
             st.write('')
             # Continuous Variable
@@ -141,407 +389,458 @@ def main():
             st.dataframe(df[continuous_feature])
 
             # Histogram of Continuous Variables
-            for feature in continuous_feature:
-                data = df.copy()
-                fig = px.histogram(data[feature], x=feature, title=f'{feature} Histogram', template='plotly_dark', nbins=50)
-                st.plotly_chart(fig, user_container_width=True)         
+            with lazy_section('Histograms of continuous variables') as section:
+                if section.open:
+                    for feature in continuous_feature:
+                        key = figure_key('Numerical Variables', f'{feature} Histogram')
+                        if not show_cached_plotly(key):
+                            # Only the bin edges and counts are sent to the browser
+                            edges, counts = summary()['histograms'][feature].dense(50)
+                            fig = go.Figure(go.Bar(x=edges[:-1], y=counts, width=np.diff(edges), offset=0))
+                            fig.update_layout(xaxis_title=feature, yaxis_title='count', title=f'{feature} Histogram', template='plotly_dark', bargap=0)
+                            show_plotly(key, fig)
 
         if choice == 'Categorical Variables':
             st.title('Categorical Variables')
+            df = page_preview(PAGES[choice], where=where)
+            approximate = approximate_toggle()
 
-            categorical_features=[feature for feature in df.columns if df[feature].dtypes=='O']
+            categorical_features=[feature for feature in df.columns if not pd.api.types.is_numeric_dtype(df[feature])]
             st.write('Number of categorical variables: ', len(categorical_features))
             st.subheader(categorical_features)
             st.dataframe(df[categorical_features])
 
+            # Mean Sales, Profit and Discount per category of every feature, in one pass on first use
+            category_data = {}
+            def means(feature):
+                if not category_data:
+                    category_data.update(category_means(categorical_features, where=where))
+                return category_data[feature]
+
             st.write('')
             st.write('### No. of categories in each categorical feature: ')
             
             # Types of categories
-            for feature in categorical_features:
-                st.write('The feature is {} and number of categories are {}'.format(feature,len(df[feature].unique())))
+            if approximate:
+                cardinality = approximate_cardinality(categorical_features, where=where)
+                for feature in categorical_features:
+                    st.write('The feature is {} and number of categories are about {}'.format(feature,round(cardinality.estimate(feature))))
+                st.caption(f'Estimated with HyperLogLog, within ±{cardinality.relative_error():.1%} at 95% confidence.')
+            else:
+                for feature in categorical_features:
+                    st.write('The feature is {} and number of categories are {}'.format(feature,len(means(feature))))
 
-            pd.options.plotting.backend = "plotly"
 
             st.write('### Relationship between each categorical variable and  Sales')
             # Find out the relationship between categorical variable and Sales
-            for feature in categorical_features:
-                data=df.copy()
-                fig = data.groupby(feature)['Sales'].mean().plot.bar()
-                fig.update_layout(xaxis_title=feature, yaxis_title='Sales', title=f'Relation between {feature} and Sales', template='plotly_dark')
-                st.plotly_chart(fig, user_container_width=True) 
+            with lazy_section('Sales by category') as section:
+                if section.open:
+                    for feature in categorical_features:
+                        key = figure_key('Categorical Variables', f'Relation between {feature} and Sales')
+                        if not show_cached_plotly(key):
+                            fig = means(feature)['Sales'].plot.bar(backend='plotly')
+                            fig.update_layout(xaxis_title=feature, yaxis_title='Sales', title=f'Relation between {feature} and Sales', template='plotly_dark')
+                            show_plotly(key, fig)
 
             st.write('### Relationship between each categorical variable and  Profit')
             # Find out the relationship between categorical variable and Profit
-            for feature in categorical_features:
-                data=df.copy()
-                fig = data.groupby(feature)['Profit'].mean().plot.bar()
-                fig.update_layout(xaxis_title=feature, yaxis_title='Overall Profit', title=f'Relation between {feature} and Profit', template='plotly_dark')
-                st.plotly_chart(fig, user_container_width=True)
+            with lazy_section('Profit by category') as section:
+                if section.open:
+                    for feature in categorical_features:
+                        key = figure_key('Categorical Variables', f'Relation between {feature} and Profit')
+                        if not show_cached_plotly(key):
+                            fig = means(feature)['Profit'].plot.bar(backend='plotly')
+                            fig.update_layout(xaxis_title=feature, yaxis_title='Overall Profit', title=f'Relation between {feature} and Profit', template='plotly_dark')
+                            show_plotly(key, fig)
 
             st.write('### Relationship between each categorical variable and  Discount')
             # Find out the relationship between categorical variable and Discount
-            for feature in categorical_features:
-                data=df.copy()
-                fig = data.groupby(feature)['Discount'].mean().plot.bar()
-                fig.update_layout(xaxis_title=feature, yaxis_title='Discount', title=f'Relation between {feature} and Discount', template='plotly_dark')
-                st.plotly_chart(fig, user_container_width=True)
+            with lazy_section('Discount by category') as section:
+                if section.open:
+                    for feature in categorical_features:
+                        key = figure_key('Categorical Variables', f'Relation between {feature} and Discount')
+                        if not show_cached_plotly(key):
+                            fig = means(feature)['Discount'].plot.bar(backend='plotly')
+                            fig.update_layout(xaxis_title=feature, yaxis_title='Discount', title=f'Relation between {feature} and Discount', template='plotly_dark')
+                            show_plotly(key, fig)
 
         if choice == 'Data insights':
             st.title('Data insights')
-            ch = st.sidebar.radio('Based on: ',['Ship Mode','Segment','Region','City','State','Category','Sub-Category'])
+            ch = st.sidebar.radio('Based on: ',INSIGHT_VIEWS)
+            instrument.set_view(f'{choice} / {ch}')
+            cube = page_cube(INSIGHTS[ch], where=where) if INSIGHTS[ch].cube else None
             if ch == 'Ship Mode':
                     st.header('Ship Mode')
-                    image = Image.open('Pairplot_ShipMode.png')
-                    st.image(image,use_column_width=True)
+                    show_pairplot('Ship Mode')
 
                     st.subheader('Ship Mode wise analysis of Sale, Discount, profit')
-                    pd.options.plotting.backend = "matplotlib"
-                    df_ShipMode= df.groupby(['Ship Mode'])[['Sales', 'Discount', 'Profit']].mean()
-                    df_ShipMode.plot.pie(subplots=True, 
-                                        autopct='%1.1f%%',
-                                        figsize=(18, 20),
-                                        startangle=90,     # start angle 90° (Africa)
-                                        shadow=True,
-                                        labels = df_ShipMode.index,
-                                        colors=['r','b','g','m'])
-                    plt.title('Ship Mode wise analysis of Sale, Discount, profit', fontsize = 20)
-                    st.pyplot()
+                    key = figure_key('Data insights', 'Ship Mode wise analysis of Sale, Discount, profit')
+                    if not show_cached_pyplot(key):
+                        df_ShipMode= cube.mean(['Ship Mode'])
+                        df_ShipMode.plot.pie(backend='matplotlib', subplots=True, 
+                                            autopct='%1.1f%%',
+                                            figsize=(18, 20),
+                                            startangle=90,     # start angle 90° (Africa)
+                                            shadow=True,
+                                            labels = df_ShipMode.index,
+                                            colors=['r','b','g','m'])
+                        plt.title('Ship Mode wise analysis of Sale, Discount, profit', fontsize = 20)
+                        show_pyplot(key)
 
                     st.subheader('Profit w.r.t Ship Mode and Discount')
-                    pd.options.plotting.backend = "matplotlib"
-                    plt.figure(figsize=(10,6))
-                    df.groupby(['Ship Mode', 'Discount']).Profit.mean().plot(kind = 'bar')
-                    plt.title('Profit w.r.t Ship Mode and Discount', fontsize = 20)
-                    plt.ylabel('Profit')
-                    st.pyplot()
+                    key = figure_key('Data insights', 'Profit w.r.t Ship Mode and Discount')
+                    if not show_cached_pyplot(key):
+                        plt.figure(figsize=(10,6))
+                        cube.mean(['Ship Mode', 'Discount'])['Profit'].plot(backend='matplotlib', kind = 'bar')
+                        plt.title('Profit w.r.t Ship Mode and Discount', fontsize = 20)
+                        plt.ylabel('Profit')
+                        show_pyplot(key)
 
                     st.subheader('Sales w.r.t Ship Mode and Sub-Category')
-                    pd.options.plotting.backend = "matplotlib"
-                    plt.figure(figsize=(15,9))
-                    color1 = ['r']*len(df['Sub-Category'].unique())
-                    color2 = ['g']*len(df['Sub-Category'].unique())
-                    color3 = ['b']*len(df['Sub-Category'].unique())
-                    color4 = ['m']*len(df['Sub-Category'].unique())
-                    color = color1 + color2 + color3 + color4
-                    df.groupby(['Ship Mode', 'Sub-Category']).Sales.mean().plot(kind = 'bar', color=color)
-                    plt.title('Sales w.r.t Ship Mode and Sub-Category', fontsize = 20)
-                    plt.ylabel('Sales')
-                    st.pyplot()
+                    key = figure_key('Data insights', 'Sales w.r.t Ship Mode and Sub-Category')
+                    if not show_cached_pyplot(key):
+                        plt.figure(figsize=(15,9))
+                        color1 = ['r']*len(cube.values('Sub-Category'))
+                        color2 = ['g']*len(cube.values('Sub-Category'))
+                        color3 = ['b']*len(cube.values('Sub-Category'))
+                        color4 = ['m']*len(cube.values('Sub-Category'))
+                        color = color1 + color2 + color3 + color4
+                        cube.mean(['Ship Mode', 'Sub-Category'])['Sales'].plot(backend='matplotlib', kind = 'bar', color=color)
+                        plt.title('Sales w.r.t Ship Mode and Sub-Category', fontsize = 20)
+                        plt.ylabel('Sales')
+                        show_pyplot(key)
 
             if ch == 'Segment':
                     st.header('Segment')
-                    image = Image.open('Pairplot_Segment.png')
-                    st.image(image,use_column_width=True)
+                    show_pairplot('Segment')
 
                     st.subheader('Segment wise analysis of Sale, Discount, profit')
-                    pd.options.plotting.backend = "matplotlib"
-                    df_segment= df.groupby(['Segment'])[['Sales', 'Discount', 'Profit']].mean()
-                    df_segment.plot.pie(subplots=True, 
-                                        autopct='%1.1f%%',
-                                        figsize=(18, 20),
-                                        startangle=90,     # start angle 90° (Africa)
-                                        shadow=True,
-                                        labels = df_segment.index,
-                                        colors=['r','b','g'])
-                    plt.title('Segment wise analysis of Sale, Discount, profit', fontsize = 20)
-                    st.pyplot()
+                    key = figure_key('Data insights', 'Segment wise analysis of Sale, Discount, profit')
+                    if not show_cached_pyplot(key):
+                        df_segment= cube.mean(['Segment'])
+                        df_segment.plot.pie(backend='matplotlib', subplots=True, 
+                                            autopct='%1.1f%%',
+                                            figsize=(18, 20),
+                                            startangle=90,     # start angle 90° (Africa)
+                                            shadow=True,
+                                            labels = df_segment.index,
+                                            colors=['r','b','g'])
+                        plt.title('Segment wise analysis of Sale, Discount, profit', fontsize = 20)
+                        show_pyplot(key)
 
                     st.subheader('Profit w.r.t Segment and Discount')
-                    pd.options.plotting.backend = "matplotlib"
-                    plt.figure(figsize=(10,6))
-                    color1 = ['g']*4
-                    color2 = ['r']*8
-                    color = color1 + color2
-                    df.groupby(['Segment', 'Discount']).Profit.mean().plot(kind = 'bar',color=color)
-                    plt.title('Profit w.r.t Segment and Discount', fontsize = 20)
-                    plt.ylabel('Profit')
-                    st.pyplot()
+                    key = figure_key('Data insights', 'Profit w.r.t Segment and Discount')
+                    if not show_cached_pyplot(key):
+                        plt.figure(figsize=(10,6))
+                        color1 = ['g']*4
+                        color2 = ['r']*8
+                        color = color1 + color2
+                        cube.mean(['Segment', 'Discount'])['Profit'].plot(backend='matplotlib', kind = 'bar',color=color)
+                        plt.title('Profit w.r.t Segment and Discount', fontsize = 20)
+                        plt.ylabel('Profit')
+                        show_pyplot(key)
 
                     st.subheader('Sales w.r.t Segment and Sub-Category')
-                    pd.options.plotting.backend = "matplotlib"
-                    plt.figure(figsize=(15,9))
-                    color1 = ['r']*len(df['Sub-Category'].unique())
-                    color2 = ['g']*len(df['Sub-Category'].unique())
-                    color3 = ['b']*len(df['Sub-Category'].unique())
-                    color = color1 + color2+ color3
-                    df.groupby(['Segment', 'Sub-Category']).Sales.mean().plot(kind = 'bar', color=color)
-                    plt.title('Sales w.r.t Segment and Sub-Category', fontsize = 20)
-                    plt.ylabel('Sales')
-                    st.pyplot()
+                    key = figure_key('Data insights', 'Sales w.r.t Segment and Sub-Category')
+                    if not show_cached_pyplot(key):
+                        plt.figure(figsize=(15,9))
+                        color1 = ['r']*len(cube.values('Sub-Category'))
+                        color2 = ['g']*len(cube.values('Sub-Category'))
+                        color3 = ['b']*len(cube.values('Sub-Category'))
+                        color = color1 + color2+ color3
+                        cube.mean(['Segment', 'Sub-Category'])['Sales'].plot(backend='matplotlib', kind = 'bar', color=color)
+                        plt.title('Sales w.r.t Segment and Sub-Category', fontsize = 20)
+                        plt.ylabel('Sales')
+                        show_pyplot(key)
 
             if ch == 'Region':
                     st.header('Region')
-                    image = Image.open('Pairplot_Region.png')
-                    st.image(image,use_column_width=True)
+                    show_pairplot('Region')
 
                     st.subheader('Region wise analysis of Profit, Discount and sell')
-                    pd.options.plotting.backend = "matplotlib"
-                    df_region= df.groupby(['Region'])[['Sales', 'Discount', 'Profit']].mean()
-                    df_region.plot.pie(subplots=True, 
-                                        autopct='%1.1f%%',
-                                        figsize=(18, 20),
-                                        startangle=90,     # start angle 90° (Africa)
-                                        shadow=True,
-                                        labels = df_region.index,
-                                        colors=['r','b','g','m'])
-                    plt.title('Region wise analysis of Sale, Discount, profit', fontsize = 20)
-                    st.pyplot()
+                    key = figure_key('Data insights', 'Region wise analysis of Sale, Discount, profit')
+                    if not show_cached_pyplot(key):
+                        df_region= cube.mean(['Region'])
+                        df_region.plot.pie(backend='matplotlib', subplots=True, 
+                                            autopct='%1.1f%%',
+                                            figsize=(18, 20),
+                                            startangle=90,     # start angle 90° (Africa)
+                                            shadow=True,
+                                            labels = df_region.index,
+                                            colors=['r','b','g','m'])
+                        plt.title('Region wise analysis of Sale, Discount, profit', fontsize = 20)
+                        show_pyplot(key)
 
                     st.subheader('Profit w.r.t Region and Discount')
-                    pd.options.plotting.backend = "matplotlib"
-                    plt.figure(figsize=(10,6))
-                    df.groupby(['Region', 'Discount']).Profit.mean().plot(kind = 'bar')
-                    plt.title('Profit w.r.t Region and Discount', fontsize = 20)
-                    plt.ylabel('Profit')
-                    st.pyplot()
+                    key = figure_key('Data insights', 'Profit w.r.t Region and Discount')
+                    if not show_cached_pyplot(key):
+                        plt.figure(figsize=(10,6))
+                        cube.mean(['Region', 'Discount'])['Profit'].plot(backend='matplotlib', kind = 'bar')
+                        plt.title('Profit w.r.t Region and Discount', fontsize = 20)
+                        plt.ylabel('Profit')
+                        show_pyplot(key)
 
                     st.subheader('Sales w.r.t Region and Sub-Category')
-                    pd.options.plotting.backend = "matplotlib"
-                    plt.figure(figsize=(15,9))
-                    color1 = ['r']*len(df['Sub-Category'].unique())
-                    color2 = ['g']*len(df['Sub-Category'].unique())
-                    color3 = ['b']*len(df['Sub-Category'].unique())
-                    color4 = ['m']*len(df['Sub-Category'].unique())
-                    color = color1 + color2 + color3 + color4
-                    df.groupby(['Region', 'Sub-Category']).Sales.mean().plot(kind = 'bar', color=color)
-                    plt.title('Sales w.r.t Region and Sub-Category', fontsize = 20)
-                    plt.ylabel('Sales')
-                    st.pyplot()
+                    key = figure_key('Data insights', 'Sales w.r.t Region and Sub-Category')
+                    if not show_cached_pyplot(key):
+                        plt.figure(figsize=(15,9))
+                        color1 = ['r']*len(cube.values('Sub-Category'))
+                        color2 = ['g']*len(cube.values('Sub-Category'))
+                        color3 = ['b']*len(cube.values('Sub-Category'))
+                        color4 = ['m']*len(cube.values('Sub-Category'))
+                        color = color1 + color2 + color3 + color4
+                        cube.mean(['Region', 'Sub-Category'])['Sales'].plot(backend='matplotlib', kind = 'bar', color=color)
+                        plt.title('Sales w.r.t Region and Sub-Category', fontsize = 20)
+                        plt.ylabel('Sales')
+                        show_pyplot(key)
 
             if ch == 'City':
                     st.header('City')
 
+                    # Top and bottom cities are selected without sorting every city
+                    ranks = city_ranking(where=where)
+
                     st.subheader('City Wise Deal Analysis (Top 50)')
-                    pd.options.plotting.backend = "matplotlib"
-                    df2 = df['City'].value_counts()
-                    df2.head(50).plot(kind='bar',figsize=(15,5))
-                    plt.ylabel('Frequency / Number of deals')
-                    plt.xlabel('City')
-                    plt.title('City Wise Dealings', fontsize = 20)
-                    st.pyplot()
+                    # Approximate: deals counted by a count-min sketch rather than taken from the city totals
+                    counts = approximate_top_counts('City', where=where) if approximate_toggle() else None
+                    key = figure_key('Data insights', 'City Wise Dealings', *(('approximate',) if counts is not None else ()))
+                    if not show_cached_pyplot(key):
+                        df2 = counts.top(50) if counts is not None else ranks.top('Deals', 50)
+                        df2.plot(backend='matplotlib', kind='bar',figsize=(15,5))
+                        plt.ylabel('Frequency / Number of deals')
+                        plt.xlabel('City')
+                        plt.title('City Wise Dealings', fontsize = 20)
+                        show_pyplot(key)
+                    if counts is not None:
+                        overcount, confidence = counts.error()
+                        st.caption(f'Approximate counts: each bar is at most {overcount:,.0f} deals too high, with {confidence:.0%} confidence.')
 
                     st.subheader('Citywise Profit Analysis')
-                    pd.options.plotting.backend = "matplotlib"
-                    # Top 30 Cities with low profits
-                    df_city= df.groupby(['City'])[['Sales', 'Discount', 'Profit']].mean()
-                    df_city = df_city.sort_values('Profit')
-                    df_city['Profit'].head(30).plot(kind='bar',figsize=(15,5), color = 'r')
-                    plt.title('Top 30 Cities with Loss', fontsize = 20)
-                    plt.ylabel('Loss')
-                    st.pyplot()
-
-                    # Top 30 Cities with high profits
-                    df_city['Profit'].tail(30).plot(kind='bar',figsize=(15,5), color = 'g')
-                    plt.title('Top 30 Cities with Profit', fontsize = 20)
-                    plt.ylabel('Profit')
-                    st.pyplot()
+                    metric = st.sidebar.selectbox('Rank cities by', list(RANKING_METRICS))
+                    k = st.sidebar.slider('Cities per chart', 10, 100, 30, step=5)
+                    if metric == 'Mean Profit':
+                        worst, best, worst_label, best_label = f'Top {k} Cities with Loss', f'Top {k} Cities with Profit', 'Loss', 'Profit'
+                    else:
+                        worst, best, worst_label, best_label = f'Bottom {k} Cities by {metric}', f'Top {k} Cities by {metric}', metric, metric
+                    # Top k Cities with low profits
+                    key = figure_key('Data insights', worst)
+                    if not show_cached_pyplot(key):
+                        ranks.bottom(metric, k).plot(backend='matplotlib', kind='bar',figsize=(15,5), color = 'r')
+                        plt.title(worst, fontsize = 20)
+                        plt.ylabel(worst_label)
+                        show_pyplot(key)
+
+                    key = figure_key('Data insights', best)
+                    if not show_cached_pyplot(key):
+                        # Top k Cities with high profits, in ascending order
+                        ranks.top(metric, k).iloc[::-1].plot(backend='matplotlib', kind='bar',figsize=(15,5), color = 'g')
+                        plt.title(best, fontsize = 20)
+                        plt.ylabel(best_label)
+                        show_pyplot(key)
 
             if ch == 'State':
                     st.header('State')
 
-                    state_code = {
-                        'Alabama': 'AL',
-                        'Alaska': 'AK',
-                        'American Samoa': 'AS',
-                        'Arizona': 'AZ',
-                        'Arkansas': 'AR',
-                        'California': 'CA',
-                        'Colorado': 'CO',
-                        'Connecticut': 'CT',
-                        'Delaware': 'DE',
-                        'District of Columbia': 'DC',
-                        'Florida': 'FL',
-                        'Georgia': 'GA',
-                        'Guam': 'GU',
-                        'Hawaii': 'HI',
-                        'Idaho': 'ID',
-                        'Illinois': 'IL',
-                        'Indiana': 'IN',
-                        'Iowa': 'IA',
-                        'Kansas': 'KS',
-                        'Kentucky': 'KY',
-                        'Louisiana': 'LA',
-                        'Maine': 'ME',
-                        'Maryland': 'MD',
-                        'Massachusetts': 'MA',
-                        'Michigan': 'MI',
-                        'Minnesota': 'MN',
-                        'Mississippi': 'MS',
-                        'Missouri': 'MO',
-                        'Montana': 'MT',
-                        'Nebraska': 'NE',
-                        'Nevada': 'NV',
-                        'New Hampshire': 'NH',
-                        'New Jersey': 'NJ',
-                        'New Mexico': 'NM',
-                        'New York': 'NY',
-                        'North Carolina': 'NC',
-                        'North Dakota': 'ND',
-                        'Northern Mariana Islands':'MP',
-                        'Ohio': 'OH',
-                        'Oklahoma': 'OK',
-                        'Oregon': 'OR',
-                        'Pennsylvania': 'PA',
-                        'Puerto Rico': 'PR',
-                        'Rhode Island': 'RI',
-                        'South Carolina': 'SC',
-                        'South Dakota': 'SD',
-                        'Tennessee': 'TN',
-                        'Texas': 'TX',
-                        'Utah': 'UT',
-                        'Vermont': 'VT',
-                        'Virgin Islands': 'VI',
-                        'Virginia': 'VA',
-                        'Washington': 'WA',
-                        'West Virginia': 'WV',
-                        'Wisconsin': 'WI',
-                        'Wyoming': 'WY'
-                    }
-                    df['state_code'] =df.State.apply(lambda x: state_code[x])
-
-                    state_data = df[['Sales', 'Profit', 'state_code']].groupby(['state_code']).sum()
-                    fig = go.Figure(data=go.Choropleth(
-                        locations=state_data.index, 
-                        z = state_data.Sales, 
-                        locationmode = 'USA-states', 
-                        colorscale = 'Reds',
-                        colorbar_title = 'Sales in USD',
-                    ))
-                    fig.update_layout(
-                        title_text = 'Total State-Wise Sales',
-                        geo_scope='usa',
-                        height=800,
-                        template='plotly_dark'
-                    )
-                    st.plotly_chart(fig, user_container_width=True)
-
-                    fig = go.Figure(data=go.Choropleth(
-                        locations=state_data.index, # Spatial coordinates
-                        z = state_data.Profit, # Data to be color-coded
-                        locationmode = 'USA-states', # set of locations match entries in `locations`
-                        colorscale = [[0, 'rgb(255,0,0)'], [0.25, 'rgb(255,255,255)'], [0.45, 'rgb(124,208,247)'], [0.6, 'rgb(97,255,140)'], [1, 'rgb(8,181,0)']],
-                        colorbar_title = 'Profits in USD',
-                    ))
-
-                    fig.update_layout(
-                        title_text = 'Total State-Wise Profit/Loss',
-                        geo_scope='usa', # limite map scope to USA
-                        height=600,
-                        template='plotly_dark'
-                    )
-                    st.plotly_chart(fig, user_container_width=True)
+                    # Sales and Profit totals per state code, from the cached cube
+                    state_data = state_totals(cube)
+                    key = figure_key('Data insights', 'Total State-Wise Sales')
+                    if not show_cached_plotly(key):
+                        fig = go.Figure(data=go.Choropleth(
+                            locations=state_data.index, 
+                            z = state_data.Sales, 
+                            locationmode = 'USA-states', 
+                            colorscale = 'Reds',
+                            colorbar_title = 'Sales in USD',
+                        ))
+                        fig.update_layout(
+                            title_text = 'Total State-Wise Sales',
+                            geo_scope='usa',
+                            height=800,
+                            template='plotly_dark'
+                        )
+                        show_plotly(key, fig)
+
+                    key = figure_key('Data insights', 'Total State-Wise Profit/Loss')
+                    if not show_cached_plotly(key):
+                        fig = go.Figure(data=go.Choropleth(
+                            locations=state_data.index, # Spatial coordinates
+                            z = state_data.Profit, # Data to be color-coded
+                            locationmode = 'USA-states', # set of locations match entries in `locations`
+                            colorscale = [[0, 'rgb(255,0,0)'], [0.25, 'rgb(255,255,255)'], [0.45, 'rgb(124,208,247)'], [0.6, 'rgb(97,255,140)'], [1, 'rgb(8,181,0)']],
+                            colorbar_title = 'Profits in USD',
+                        ))
+
+                        fig.update_layout(
+                            title_text = 'Total State-Wise Profit/Loss',
+                            geo_scope='usa', # limite map scope to USA
+                            height=600,
+                            template='plotly_dark'
+                        )
+                        show_plotly(key, fig)
 
                     st.subheader('State Wise Dealings')
-                    pd.options.plotting.backend = "matplotlib"
-                    df1 = df['State'].value_counts()
-                    df1.plot(kind='bar',figsize=(15,5))
-                    plt.ylabel('Frequency / Number of deals')
-                    plt.xlabel('States')
-                    plt.title('State Wise Dealings', fontsize = 20)
-                    st.pyplot()
-
-                    state_data = df[['Sales', 'Profit', 'state_code']].groupby(['state_code']).sum()
+                    key = figure_key('Data insights', 'State Wise Dealings')
+                    if not show_cached_pyplot(key):
+                        df1 = cube.value_counts('State')
+                        df1.plot(backend='matplotlib', kind='bar',figsize=(15,5))
+                        plt.ylabel('Frequency / Number of deals')
+                        plt.xlabel('States')
+                        plt.title('State Wise Dealings', fontsize = 20)
+                        show_pyplot(key)
+
                     # Plots the turnover generated by different product categories and sub-categories for the list of given states
                     def state_data_viewer(states):
-                        product_data = df.groupby(['State'])
+                        keys = {state: figure_key('Data insights', 'State turnover', state) for state in states}
+                        images = {state: figure_cache.get(keys[state], 'png') for state in states}
+                        missing = [state for state in states if images[state] is None]
+
+                        def render(states):
+                            rendered = render_states(state_category_profit(where=where), states)
+                            for state, png in rendered.items():
+                                figure_cache.put(keys[state], 'png', png)
+                            images.update(rendered)
+                        # Render the states no other session is drawing, then wait for the rest
+                        claimed = {state for state in missing if figure_cache.claim(keys[state])}
+                        if claimed:
+                            render([state for state in missing if state in claimed])
+                        for state in missing:
+                            if state not in claimed:
+                                images[state] = figure_cache.get_or_claim(keys[state], 'png')
+                        late = [state for state in missing if images[state] is None]
+                        if late:
+                            render(late)
                         for state in states:
-                            data = product_data.get_group(state).groupby(['Category'])
-                            fig,ax =plt.subplots(1, 3, figsize= (30,4))
-                            fig.suptitle(state, fontsize=20)
-                            ax_index =0
-                            for cat in ['Furniture', 'Office Supplies', 'Technology']:
-                                cat_data = data.get_group(cat).groupby(['Sub-Category']).sum()
-                                sns.barplot(x=cat_data.Profit, y= cat_data.index, ax =ax[ax_index])
-                                ax[ax_index].set_ylabel(cat)
-                                ax_index+=1
-                            st.pyplot()
+                            st.image(images[state], width='stretch')
                     st.subheader('Turnover generated by different product categories and sub-categories for the list of given states')
-                    states =['California', 'Mississippi', 'Texas','Washington','Arizona']
-                    st.write(states)
-                    state_data_viewer(states)
+                    all_states = list(cube.values('State'))
+                    with lazy_section('State drill-down') as section:
+                        if section.open:
+                            states = st.multiselect('States', all_states, default=all_states)
+                            state_data_viewer(states)
 
             if ch == 'Category':
                     st.header('Category')
-                    image = Image.open('Pairplot_Category.png')
-                    st.image(image,use_column_width=True)
+                    show_pairplot('Category')
 
                     st.subheader('Category wise analysis of Profit, Discount and sell')
-                    pd.options.plotting.backend = "matplotlib"
-                    df_cat= df.groupby(['Category'])[['Sales', 'Discount', 'Profit']].mean()
-                    df_cat.plot.pie(subplots=True, 
-                                        autopct='%1.1f%%',
-                                        figsize=(18, 20),
-                                        startangle=90,     # start angle 90° (Africa)
-                                        shadow=True,
-                                        labels = df_cat.index,
-                                        colors=['r','b','g'])
-                    plt.title('Category wise analysis of Sale, Discount, profit', fontsize = 20)
-                    st.pyplot()
+                    key = figure_key('Data insights', 'Category wise analysis of Sale, Discount, profit')
+                    if not show_cached_pyplot(key):
+                        df_cat= cube.mean(['Category'])
+                        df_cat.plot.pie(backend='matplotlib', subplots=True, 
+                                            autopct='%1.1f%%',
+                                            figsize=(18, 20),
+                                            startangle=90,     # start angle 90° (Africa)
+                                            shadow=True,
+                                            labels = df_cat.index,
+                                            colors=['r','b','g'])
+                        plt.title('Category wise analysis of Sale, Discount, profit', fontsize = 20)
+                        show_pyplot(key)
 
                     st.subheader('Profit w.r.t Category and Discount')
-                    pd.options.plotting.backend = "matplotlib"
-                    plt.figure(figsize=(10,6))
-                    df.groupby(['Category', 'Discount']).Profit.mean().plot(kind = 'bar')
-                    plt.title('Profit w.r.t Category and Discount', fontsize = 20)
-                    plt.ylabel('Profit')
-                    st.pyplot()
+                    key = figure_key('Data insights', 'Profit w.r.t Category and Discount')
+                    if not show_cached_pyplot(key):
+                        plt.figure(figsize=(10,6))
+                        cube.mean(['Category', 'Discount'])['Profit'].plot(backend='matplotlib', kind = 'bar')
+                        plt.title('Profit w.r.t Category and Discount', fontsize = 20)
+                        plt.ylabel('Profit')
+                        show_pyplot(key)
 
                     st.subheader('Sales w.r.t Category and Sub-Category')
-                    pd.options.plotting.backend = "matplotlib"
-                    plt.figure(figsize=(15,9))
-                    color1 = ['r']*4
-                    color2 = ['g']*9
-                    color3 = ['b']*4
-                    color = color1 + color2+ color3
-                    df.groupby(['Category', 'Sub-Category']).Sales.mean().plot(kind = 'bar', color=color)
-                    plt.title('Sales w.r.t Category and Sub-Category', fontsize = 20)
-                    plt.ylabel('Sales')
-                    st.pyplot()
+                    key = figure_key('Data insights', 'Sales w.r.t Category and Sub-Category')
+                    if not show_cached_pyplot(key):
+                        plt.figure(figsize=(15,9))
+                        color1 = ['r']*4
+                        color2 = ['g']*9
+                        color3 = ['b']*4
+                        color = color1 + color2+ color3
+                        cube.mean(['Category', 'Sub-Category'])['Sales'].plot(backend='matplotlib', kind = 'bar', color=color)
+                        plt.title('Sales w.r.t Category and Sub-Category', fontsize = 20)
+                        plt.ylabel('Sales')
+                        show_pyplot(key)
 
             if ch == 'Sub-Category':
                     st.header('Sub-Category')
 
                     st.subheader('Sub-Category: Sales and Profit Analysis')
-                    pd.options.plotting.backend = "matplotlib"
-                    df_sub_category= df.groupby(['Sub-Category'])[['Sales', 'Discount', 'Profit']].mean()
-                    df_sub_category.sort_values('Profit')[['Sales','Profit']].plot(kind='bar', figsize=(15,10))
-                    plt.title('Sales and Profit w.r.t Sub-Category', fontsize = 20)
-                    plt.ylabel('Values')
-                    st.pyplot()
-
-                    df['price_per_product'] = df.Sales / df.Quantity
-                    df['profit_per_product'] = df.Profit / df.Quantity 
-
-                    data = df.groupby(['Category'])
-
-                    st.subheader('Prices of products across each product category')
-                    for cat, df in data:
-                        sizes = np.absolute(df.price_per_product)
-                        fig = px.scatter(df, x = 'price_per_product', title = cat.upper(), 
+                    key = figure_key('Data insights', 'Sales and Profit w.r.t Sub-Category')
+                    if not show_cached_pyplot(key):
+                        df_sub_category= cube.mean(['Sub-Category'])
+                        df_sub_category.sort_values('Profit')[['Sales','Profit']].plot(backend='matplotlib', kind='bar', figsize=(15,10))
+                        plt.title('Sales and Profit w.r.t Sub-Category', fontsize = 20)
+                        plt.ylabel('Values')
+                        show_pyplot(key)
+
+                    # Scatter plots send a bounded number of points to the browser
+                    detail_modes = {'Binned density': 'bins', 'Quantiles': 'quantiles', 'Sample': 'sample', 'All rows': 'full'}
+                    if out_of_core():
+                        # Streamed data is only available as per-group histograms
+                        detail_modes = {'Binned density': 'bins'}
+                    detail = st.sidebar.selectbox('Scatter detail', list(detail_modes))
+                    budget = st.sidebar.slider('Points per chart', 200, 20000, 2000, step=200)
+                    mode = detail_modes[detail]
+
+                    def sub_category_scatter(cat, measure, axis_title):
+                        key = figure_key('Data insights', axis_title, cat, mode, budget)
+                        if show_cached_plotly(key):
+                            return
+                        start = time.perf_counter()
+                        points = per_product_points(cat, measure, axis_title, mode, budget, where=where)
+                        fig = px.scatter(points, x = axis_title, title = cat.upper(), 
+                                        y = 'Sub-Category' if mode in ('bins', 'quantiles') else None,
                                         color = 'Sub-Category',
-                                        size = sizes, hover_data=['Sub-Category'])
+                                        size = 'size', hover_data=['Sub-Category', 'rows'])
                         fig.update_layout(
                             height = 500,
-                            xaxis = dict(title='Price Per Product'),
+                            xaxis = dict(title=axis_title),
                             yaxis = dict(title=''),
                             template='plotly_dark'
                         )
-                        st.plotly_chart(fig, user_container_width=True)
+                        show_plotly(key, fig)
+                        payload = len(figure_cache.get(key, 'plotly') or b'')
+                        st.caption(f'{len(points)} points, {payload / 1024:.0f} KB, built in {(time.perf_counter() - start) * 1000:.0f} ms')
+
+                    st.subheader('Prices of products across each product category')
+                    with lazy_section('Price per product scatter plots') as section:
+                        if section.open:
+                            for cat in cube.values('Category'):
+                                sub_category_scatter(cat, 'Sales', 'Price Per Product')
                     
                     st.subheader('Profit of products across each product category')
-                    for cat, df in data:
-                        sizes = np.absolute(df.profit_per_product)
-                        fig = px.scatter(df, x = 'profit_per_product', title = cat.upper(), 
-                                        color = 'Sub-Category',
-                                        size = sizes, hover_data=['Sub-Category'])
-                        fig.update_layout(
-                            height = 500,
-                            xaxis = dict(title='Profit Per Product'),
-                            yaxis = dict(title=''),
-                            template='plotly_dark'
-                        )
-                        st.plotly_chart(fig, user_container_width=True)
+                    with lazy_section('Profit per product scatter plots') as section:
+                        if section.open:
+                            for cat in cube.values('Category'):
+                                sub_category_scatter(cat, 'Profit', 'Profit Per Product')
+
+            if ch == 'Trends':
+                    st.header('Trends')
+
+                    # Day, week and month totals come from rollups built once per dataset version and filter
+                    rollup = order_trends(where=where)
+                    span = rollup.span() if rollup is not None else None
+                    if span is None:
+                        st.info('The dataset has no order dates, so there are no trends to show.')
+                    else:
+                        dimension = st.sidebar.selectbox('Trend by', ['All'] + TREND_DIMENSIONS)
+                        frequency = st.sidebar.radio('Per', TREND_FREQUENCIES, index=TREND_FREQUENCIES.index('Month'))
+                        first, last = span[0].date(), span[1].date()
+                        start, end = st.sidebar.slider('Order dates', first, last, (first, last))
+                        by = None if dimension == 'All' else dimension
+
+                        for title, metric, stat in TREND_CHARTS:
+                            key = figure_key('Data insights', f'{title} per {frequency}', dimension, start, end)
+                            if not show_cached_plotly(key):
+                                data = rollup.trend(by, frequency, metric, stat, start, end)
+                                fig = px.line(data, title=f'{title} per {frequency.lower()}')
+                                fig.update_layout(
+                                    xaxis = dict(title='Order Date'),
+                                    yaxis = dict(title=title),
+                                    legend_title_text = dimension,
+                                    template='plotly_dark'
+                                )
+                                show_plotly(key, fig)
+
+                        st.subheader(f'Totals from {start} to {end}')
+                        st.dataframe(rollup.totals(by, start, end).rename(columns={'count': 'Deals'}))
 
         if choice == 'Conclusion':
             st.title('Conclusion')
@@ -602,5 +901,12 @@ def main():
     st.sidebar.markdown(html_string, unsafe_allow_html=True)
     st.sidebar.write('**Data Science and Business Analytics Intern**')
 
+    if ADMIN_PANEL:
+        show_admin_panel(instrument.current_view())
+
 if __name__ == '__main__':
-    main()
+    try:
+        with instrument.span('rerun', 'page'):
+            main()
+    finally:
+        end_rerun()
@@ -0,0 +1,1037 @@
+"""Benchmarks for the dashboard's data paths.
+
+Run from the repository root, e.g.::
+
+    python benchmark.py load --rows 1000000
+    python benchmark.py --output results.json suite --rows 1000000 10000000
+    python benchmark.py compare baseline.json results.json
+    python benchmark.py users --users 1 4 8 --views State
+    python benchmark.py trends --rows 10000000 --years 10
+    python benchmark.py --cities 100000 sketches --rows 10000000
+    python benchmark.py api --rows 10000000 --clients 1 4 16
+    python benchmark.py startup --rows 1000000 --views 'Retail Data' Region
+
+Scaled inputs are generated by ``synthetic`` into a temporary directory (or
+``--workdir``). ``--output`` writes the results together with the code
+revision and the environment, and ``compare`` reports the measurements of
+two such files that got slower or larger.
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import aggregates
+import downsample
+import filters
+import loader
+import pages
+import parallel
+import ranking
+import shared
+import sketches
+import stats
+import streaming
+import synthetic
+import timeseries
+
+CITY_COLUMNS = ['City', 'Sales', 'Discount', 'Profit']
+
+
+def _input_name(rows, cities, suffix):
+    return f'superstore_{rows}' + (f'_{cities}cities' if cities else '') + suffix
+
+
+def scaled_csv(rows, workdir, cities=None):
+    path = os.path.join(workdir, _input_name(rows, cities, '.csv'))
+    if not os.path.exists(path):
+        synthetic.write_csv(path, rows, cities=cities)
+    return path
+
+
+def scaled_snapshot(rows, workdir, cities=None):
+    # Written chunk by chunk, so inputs larger than memory can be generated.
+    path = os.path.join(workdir, _input_name(rows, cities, loader.SNAPSHOT_SUFFIX))
+    if not os.path.exists(path):
+        synthetic.write_snapshot(path, rows, cities=cities)
+    return path
+
+
+def _peak_rss_mb():
+    # VmHWM belongs to the current address space; ru_maxrss on Linux survives
+    # exec and would include the parent's peak.
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere.
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / 1024
+
+
+def _reset_peak_rss():
+    # Start a new VmHWM, so the next peak belongs to one phase. Returns False
+    # where that is not supported, in which case peaks are cumulative.
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _load(method, path):
+    import pandas as pd
+    if method == 'read_csv':
+        return pd.read_csv(path)
+    if method == 'typed_csv':
+        return loader.read_dataset(path)
+    if method == 'snapshot':
+        return loader.read_snapshot(loader.snapshot_path(path))
+    if method == 'snapshot_city':
+        return loader.read_snapshot(loader.snapshot_path(path), CITY_COLUMNS)
+    raise ValueError(f'unknown load method {method!r}')
+
+
+def _measure_load(method, path, queue):
+    base_rss = _peak_rss_mb()
+    start = time.perf_counter()
+    df = _load(method, path)
+    elapsed = time.perf_counter() - start
+    queue.put({'method': method, 'rows': len(df), 'seconds': elapsed,
+               'peak_rss_mb': _peak_rss_mb(), 'base_rss_mb': base_rss,
+               'frame_mb': df.memory_usage(deep=True).sum() / (1 << 20)})
+
+
+def run_in_fresh_process(target, *args):
+    # Each measurement gets its own interpreter so timings are cold and the
+    # peak RSS belongs to that measurement alone.
+    ctx = mp.get_context('spawn')
+    queue = ctx.Queue()
+    proc = ctx.Process(target=target, args=args + (queue,))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+
+def bench_load(args):
+    results = []
+    for rows in args.rows:
+        path = scaled_csv(rows, args.workdir, args.cities)
+        loader.convert_to_snapshot(path)
+        for method in ['read_csv', 'typed_csv', 'snapshot', 'snapshot_city']:
+            results.append(run_in_fresh_process(_measure_load, method, path))
+    return results
+
+
+def _compare_cubes(incremental, full):
+    for dim in aggregates.DIMENSIONS:
+        for keys in [[dim], [dim, 'Discount'], [dim, 'Sub-Category']]:
+            a, b = incremental.rollup(keys), full.rollup(keys)
+            if not (list(a.index) == list(b.index)
+                    and np.allclose(a.values, b.values, rtol=1e-9, equal_nan=True)):
+                raise AssertionError(f'incremental cube differs from full recompute for {keys}')
+
+
+def _compare_summaries(incremental, full):
+    if incremental['moments'].count != full['moments'].count:
+        raise AssertionError('incremental statistics missed rows')
+    if not np.allclose(incremental['moments'].corr().values, full['moments'].corr().values, rtol=1e-9):
+        raise AssertionError('incremental correlation differs from full recompute')
+    for col in loader.NUMERICAL_COLUMNS:
+        a, b = incremental['histograms'][col].dense(50), full['histograms'][col].dense(50)
+        if not (np.array_equal(a[0], b[0]) and np.array_equal(a[1], b[1])):
+            raise AssertionError(f'incremental histogram of {col} differs from full recompute')
+
+
+def bench_append(args):
+    results = []
+    for rows in args.rows:
+        path = scaled_csv(rows, args.workdir, args.cities)
+        aggregates.get_cube(path)
+        pages.numerical_summary(loader.NUMERICAL_COLUMNS, path)
+        batch = synthetic.generate(args.batch, seed=rows, cities=args.cities)
+        # Include a city the history has never seen.
+        batch['City'] = batch['City'].cat.add_categories(['New Superstore City'])
+        batch.loc[0, 'City'] = 'New Superstore City'
+        start = time.perf_counter()
+        aggregates.append_rows(batch, path)
+        elapsed = time.perf_counter() - start
+        incremental = aggregates.get_cube(path)
+
+        full_rows = loader.read_dataset(path)
+        full = aggregates.AggregateCube.from_frame(full_rows)
+        _compare_cubes(incremental, full)
+        moments, distinct, histograms = streaming.fold(
+            [stats.Moments(loader.NUMERICAL_COLUMNS), stats.Distinct(loader.NUMERICAL_COLUMNS),
+             stats.Histograms(loader.NUMERICAL_COLUMNS)], [full_rows])
+        _compare_summaries(pages.numerical_summary(loader.NUMERICAL_COLUMNS, path),
+                           {'moments': moments, 'histograms': histograms})
+        results.append({'history_rows': rows, 'batch_rows': args.batch,
+                        'append_seconds': elapsed, 'matches_full': True})
+    return results
+
+
+def _measure(func):
+    # Time an untraced run, then trace a second run for its peak allocation.
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak / (1 << 20)
+
+
+def _categorical_page_with_copies(df, features):
+    # What the Categorical Variables page did before category_means().
+    for metric in ['Sales', 'Profit', 'Discount']:
+        for feature in features:
+            data = df.copy()
+            data.groupby(feature, observed=True)[metric].mean()
+
+
+def bench_pages(args):
+    results = []
+    for rows in args.rows:
+        df = synthetic.generate(rows, cities=args.cities)
+        features = list(loader.CATEGORICAL_COLUMNS)
+        dataset_mb = df.memory_usage(deep=True).sum() / (1 << 20)
+        for name, func in [
+                ('copy_groupby', lambda: _categorical_page_with_copies(df, features)),
+                ('category_means', lambda: aggregates.category_means(df, features))]:
+            seconds, peak_mb = _measure(func)
+            results.append({'method': name, 'rows': rows, 'seconds': seconds,
+                            'peak_alloc_mb': peak_mb, 'dataset_mb': dataset_mb})
+        del df
+    return results
+
+
+def bench_scatter(args):
+    import plotly.express as px
+    results = []
+    for rows in args.rows:
+        df = synthetic.generate(rows, cities=args.cities)
+        df = df[df.Category == 'Furniture']
+        data = df.assign(price=df.Sales / df.Quantity)[['Sub-Category', 'price']]
+        for mode in args.modes:
+            start = time.perf_counter()
+            points = downsample.downsample(data, 'price', 'Sub-Category', mode, args.budget)
+            payload = px.scatter(points, x='price', color='Sub-Category', size='size').to_json()
+            results.append({'mode': mode, 'rows': len(data), 'points': len(points),
+                            'payload_kb': len(payload) / 1024,
+                            'seconds': time.perf_counter() - start})
+    return results
+
+
+# Sidebar filters of increasing selectivity: ({column: values}, discount range)
+FILTER_CASES = {
+    'one region': ({'Region': ['West']}, None),
+    'segment, discount': ({'Segment': ['Consumer', 'Corporate']}, (0.0, 0.2)),
+    'regions, category, discount': ({'Region': ['West', 'East'], 'Category': ['Technology']}, (0.1, 0.3)),
+    'five states': ({'State': ['California', 'Texas', 'New York', 'Ohio', 'Florida']}, None),
+}
+
+
+def _best_of(func, repeat=5):
+    # Best wall time of ``repeat`` calls, and the last result.
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def bench_filters(args):
+    results = []
+    for rows in args.rows:
+        path = scaled_csv(rows, args.workdir, args.cities)
+        loader.convert_to_snapshot(path)
+        columns = filters.COLUMNS + ['Sales', 'Profit']
+        df = loader.load_dataset(path, columns)
+        start = time.perf_counter()
+        index = filters.get_index(path)
+        build = time.perf_counter() - start
+        results.append({'method': 'index build', 'rows': rows, 'seconds': build,
+                        'index_mb': sum(bits.nbytes for bits in index.bitmaps.values()) / (1 << 20)})
+        for name, (values, discount) in FILTER_CASES.items():
+            where = filters.make(values, {'Discount': discount})
+            mask_seconds, expected = _best_of(lambda: np.flatnonzero(filters.mask(df, where)))
+            select_seconds, positions = _best_of(lambda: index.positions(where))
+            if not np.array_equal(positions, expected):
+                raise AssertionError(f'{name}: index selection differs from the row mask')
+            # The aggregation a page runs on the selection, uncached.
+            aggregate_seconds, _ = _best_of(lambda: aggregates.category_means(
+                df, ['Region', 'State'], ['Sales', 'Profit'], positions), repeat=3)
+            results.append({'method': name, 'rows': rows, 'selected': len(positions),
+                            'mask_seconds': mask_seconds, 'select_seconds': select_seconds,
+                            'speedup': mask_seconds / select_seconds,
+                            'aggregate_seconds': aggregate_seconds})
+        loader.clear_cache()
+    return results
+
+
+def _check_ranking(ranks, full, k):
+    # Every metric's top and bottom k against a stable sort of the full table.
+    for metric in ranking.METRICS:
+        values = full[metric]
+        expected = {True: values.sort_values(ascending=False, kind='stable').head(k),
+                    False: values.sort_values(kind='stable').head(k)}
+        for largest, got in [(True, ranks.top(metric, k)), (False, ranks.bottom(metric, k))]:
+            if not (list(got.index) == list(expected[largest].index)
+                    and np.allclose(got.to_numpy(), expected[largest].to_numpy())):
+                raise AssertionError(f'{metric} {"top" if largest else "bottom"} {k} differs from a full sort')
+
+
+def _ranking_table(df):
+    # The full per-city table the City view used to sort.
+    import pandas as pd
+    grouped = df.groupby('City', observed=True)
+    totals = grouped[['Sales', 'Profit']].sum()
+    counts = grouped.size()
+    return pd.DataFrame({'Mean Profit': totals['Profit'] / counts, 'Total Profit': totals['Profit'],
+                         'Total Sales': totals['Sales'], 'Deals': counts.astype('float64')})
+
+
+def bench_ranking(args):
+    results = []
+    for rows in args.rows:
+        df = synthetic.generate(rows, cities=args.cities)
+        cube = aggregates.AggregateCube.from_frame(df)
+        cities = cube.values('City').size
+        # What the City view did on every render: a full mean table sorted by Profit.
+        start = time.perf_counter()
+        cube.value_counts('City').head(50)
+        cube.mean(['City']).sort_values('Profit')
+        results.append({'method': 'full sort', 'rows': rows, 'cities': cities,
+                        'seconds': time.perf_counter() - start})
+        start = time.perf_counter()
+        ranks = ranking.CityRanking.from_cube(cube)
+        results.append({'method': 'ranking build', 'rows': rows, 'cities': cities,
+                        'seconds': time.perf_counter() - start})
+        for label in ['first query', 'kept query']:
+            start = time.perf_counter()
+            for metric in ranking.METRICS:
+                ranks.top(metric, args.k)
+                ranks.bottom(metric, args.k)
+            results.append({'method': label, 'rows': rows, 'cities': cities,
+                            'seconds': (time.perf_counter() - start) / (2 * len(ranking.METRICS))})
+        full = _ranking_table(df)
+        _check_ranking(ranks, full, args.k)
+        # Appended batches: ranking merge against rebuilding the ranked table.
+        for i in range(3):
+            batch = synthetic.generate(args.batch, seed=i + 1, cities=args.cities)
+            start = time.perf_counter()
+            ranks = ranks.merged(batch)
+            merge_seconds = time.perf_counter() - start
+            df = loader.concat_frames([df, batch])
+            start = time.perf_counter()
+            full = _ranking_table(df)
+            rebuild_seconds = time.perf_counter() - start
+            _check_ranking(ranks, full, args.k)
+            results.append({'method': 'append', 'rows': len(df), 'batch_rows': args.batch, 'cities': len(full),
+                            'seconds': merge_seconds, 'rebuild_seconds': rebuild_seconds})
+    return results
+
+
+# Trend queries of the Trends view: (dimension, frequency), over all dates and over the last year.
+TREND_QUERIES = [(dim, freq) for dim in [None] + timeseries.DIMENSIONS for freq in timeseries.FREQUENCIES]
+_PERIODS = {'Day': 'D', 'Week': 'W-SUN', 'Month': 'M'}
+
+
+def _trend_groupby(df, dimension, frequency, start=None, end=None):
+    # What answering a trend from the rows takes: select the dates, bucket them and group.
+    dates = df[loader.DATE_COLUMN]
+    if start is not None:
+        df = df[(dates >= start) & (dates <= end)]
+        dates = df[loader.DATE_COLUMN]
+    keys = [dates.dt.to_period(_PERIODS[frequency]).dt.start_time.rename(loader.DATE_COLUMN)]
+    sums = df.groupby(keys + ([dimension] if dimension else []), observed=True)['Sales'].sum()
+    return sums.unstack(fill_value=0) if dimension else sums.to_frame('All')
+
+
+def _check_trends(rollup, df, start, end):
+    for dimension, frequency in TREND_QUERIES:
+        for bounds in [(None, None), (start, end)]:
+            got = rollup.trend(dimension, frequency, 'Sales', 'sum', *bounds)
+            expected = _trend_groupby(df, dimension, frequency, *bounds)
+            expected.index = expected.index.astype(got.index.dtype)
+            got = got.reindex(columns=expected.columns)
+            if not (got.index.equals(expected.index)
+                    and np.allclose(got.to_numpy(), expected.to_numpy(), rtol=1e-9, atol=1e-6)):
+                raise AssertionError(f'{frequency} trend by {dimension or "all rows"} differs from a groupby')
+
+
+def bench_trends(args):
+    results = []
+    for rows in args.rows:
+        df = synthetic.generate(rows, cities=args.cities, years=args.years)
+        last = df[loader.DATE_COLUMN].max()
+        start, end = last - np.timedelta64(364, 'D'), last
+        for label, bounds in [('groupby', (None, None)), ('groupby last year', (start, end))]:
+            begin = time.perf_counter()
+            for dimension, frequency in TREND_QUERIES:
+                _trend_groupby(df, dimension, frequency, *bounds)
+            results.append({'method': label, 'rows': rows, 'years': args.years,
+                            'seconds': (time.perf_counter() - begin) / len(TREND_QUERIES)})
+        begin = time.perf_counter()
+        rollup = timeseries.DailyRollup().update(df)
+        results.append({'method': 'rollup build', 'rows': rows, 'years': args.years,
+                        'seconds': time.perf_counter() - begin, 'mb': shared.sizeof(rollup) / 2 ** 20})
+        # The first queries also build the cumulative sums and bucket boundaries.
+        for label, bounds in [('first query', (None, None)), ('rollup query', (None, None)),
+                              ('rollup last year', (start, end))]:
+            begin = time.perf_counter()
+            for dimension, frequency in TREND_QUERIES:
+                rollup.trend(dimension, frequency, 'Sales', 'sum', *bounds)
+            results.append({'method': label, 'rows': rows, 'years': args.years,
+                            'seconds': (time.perf_counter() - begin) / len(TREND_QUERIES)})
+        _check_trends(rollup, df, start, end)
+        # Appended batches: folded into the rollup against rebuilding it.
+        for i in range(3):
+            batch = synthetic.generate(args.batch, seed=i + 1, cities=args.cities, years=args.years)
+            begin = time.perf_counter()
+            rollup = rollup.merge(timeseries.DailyRollup().update(batch))
+            merge_seconds = time.perf_counter() - begin
+            df = loader.concat_frames([df, batch])
+            begin = time.perf_counter()
+            timeseries.DailyRollup().update(df)
+            rebuild_seconds = time.perf_counter() - begin
+            _check_trends(rollup, df, start, end)
+            results.append({'method': 'append', 'rows': len(df), 'batch_rows': args.batch, 'years': args.years,
+                            'seconds': merge_seconds, 'rebuild_seconds': rebuild_seconds})
+    return results
+
+
+def _fold_chunks(partial, df, chunk_rows):
+    # Fold ``df`` into ``partial`` in chunks, as a streamed pass would.
+    for start in range(0, len(df), chunk_rows):
+        partial.update(df.iloc[start:start + chunk_rows])
+    return partial
+
+
+def _timed(func):
+    start = time.perf_counter()
+    value = func()
+    return value, time.perf_counter() - start
+
+
+def bench_sketches(args):
+    results = []
+    columns = loader.CATEGORICAL_COLUMNS + loader.NUMERICAL_COLUMNS
+    for rows in args.rows:
+        df = synthetic.generate(rows, cities=args.cities)
+        base = {'rows': rows, 'cities': df['City'].nunique()}
+
+        # Distinct counts: unique() per column, as the pages did, against HyperLogLog.
+        distinct, seconds = _timed(lambda: {col: df[col].unique() for col in columns})
+        exact = {col: len(values) for col, values in distinct.items()}
+        results.append(dict(base, method='distinct exact', seconds=seconds, mb=shared.sizeof(distinct) / 2 ** 20))
+        cardinality, seconds = _timed(lambda: _fold_chunks(sketches.Cardinality(columns), df, args.chunk_rows))
+        error = max(abs(cardinality.estimate(col) / exact[col] - 1) for col in columns)
+        results.append(dict(base, method='distinct sketch', seconds=seconds, mb=shared.sizeof(cardinality) / 2 ** 20,
+                            error=error, bound=cardinality.relative_error()))
+        discrete = [col for col in loader.NUMERICAL_COLUMNS if exact[col] < 25]
+        if [col for col in cardinality.below_limit() if col in loader.NUMERICAL_COLUMNS] != discrete:
+            raise AssertionError('approximate discrete variables differ')
+
+        # Sales medians per discrete variable: groupby median against KLL sketches.
+        for key in ['Quantity', 'Discount']:
+            medians, seconds = _timed(lambda: df.groupby(key)['Sales'].median())
+            results.append(dict(base, method=f'median by {key} exact', seconds=seconds))
+            quantiles, seconds = _timed(lambda: _fold_chunks(sketches.GroupQuantiles(key, 'Sales'), df, args.chunk_rows))
+            approximate = quantiles.median()
+            # Observed error in rank: how far from the middle of its group each median is.
+            error = max(abs(np.searchsorted(np.sort(values.to_numpy()), approximate[group]) / len(values) - 0.5)
+                        for group, values in df.groupby(key)['Sales'])
+            results.append(dict(base, method=f'median by {key} sketch', seconds=seconds,
+                                mb=shared.sizeof(quantiles) / 2 ** 20, error=error, bound=quantiles.rank_error()))
+
+        # Top 50 cities by deals: value_counts against count-min.
+        counts, seconds = _timed(lambda: df['City'].value_counts())
+        results.append(dict(base, method='top cities exact', seconds=seconds))
+        top, seconds = _timed(lambda: _fold_chunks(sketches.TopCounts('City'), df, args.chunk_rows))
+        got = top.top(50)
+        overcount, _ = top.error()
+        results.append(dict(base, method='top cities sketch', seconds=seconds, mb=shared.sizeof(top) / 2 ** 20,
+                            error=float((got - counts.reindex(got.index)).max()), bound=overcount,
+                            overlap=len(set(got.index) & set(counts.head(50).index)) / 50))
+    return results
+
+
+# Queries of the cube views: each dimension alone, by Discount and by Sub-Category.
+API_QUERIES = [[dim] + extra for dim in aggregates.DIMENSIONS for extra in [[], ['Discount'], ['Sub-Category']]]
+
+
+def _query_all(query):
+    start = time.perf_counter()
+    tables = [query(keys) for keys in API_QUERIES]
+    return tables, (time.perf_counter() - start) / len(API_QUERIES)
+
+
+def _check_store(tables, cube, source):
+    for keys, table in zip(API_QUERIES, tables):
+        expected = cube.mean(keys)[table.columns]
+        if not (len(table) == len(expected) and np.allclose(table.to_numpy(), expected.to_numpy(), equal_nan=True)):
+            raise AssertionError(f'{source} mean by {keys} differs from the cube')
+        # Discount keys must come back as the decimals in the file.
+        if 'Discount' in keys and 0.1 not in table.index.get_level_values('Discount'):
+            raise AssertionError(f'{source} Discount keys do not round-trip to 0.1')
+
+
+def bench_api(args):
+    import threading
+
+    import api
+    import store
+    results = []
+    for rows in args.rows:
+        path = scaled_csv(rows, args.workdir, args.cities)
+        base = {'rows': rows}
+
+        # What every consumer did without the store: read the rows and group them.
+        def recompute():
+            df = loader.read_dataset(path, aggregates.CUBE_COLUMNS)
+            return [df.groupby(keys, observed=True)[aggregates.METRICS].mean() for keys in API_QUERIES]
+        _, seconds = _timed(recompute)
+        results.append(dict(base, method='read and group', seconds=seconds / len(API_QUERIES)))
+        # Cube and store from scratch.
+        database = store.store_path(os.path.abspath(path))
+        for stale in [aggregates.cube_path(path), database, database + '-wal', database + '-shm']:
+            if os.path.exists(stale):
+                os.remove(stale)
+        aggregates._cubes.clear()
+        store.clear_cache()
+        cube, seconds = _timed(lambda: aggregates.get_cube(path))
+        results.append(dict(base, method='cube build', seconds=seconds))
+        _, seconds = _timed(lambda: store.materialize(path))
+        results.append(dict(base, method='store write', seconds=seconds, mb=os.path.getsize(database) / 2 ** 20))
+
+        store.clear_cache()
+        tables, seconds = _query_all(lambda keys: store.query(keys, path=path))
+        _check_store(tables, cube, 'store')
+        results.append(dict(base, method='store query', seconds=seconds))
+
+        server = api.make_server(path, port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f'http://127.0.0.1:{server.server_port}'
+        try:
+            store.clear_cache()
+            api._responses.clear()
+            for label in ['api query', 'api cached query']:
+                tables, seconds = _query_all(lambda keys: api.query(url, keys))
+                _check_store(tables, cube, label)
+                results.append(dict(base, method=label, seconds=seconds))
+            # Concurrent batch jobs on cached responses.
+            for clients in args.clients:
+                barrier = threading.Barrier(clients)
+
+                def client():
+                    barrier.wait()
+                    for _ in range(args.repeat):
+                        for keys in API_QUERIES:
+                            api.fetch(url, '/aggregate', by=keys)
+                threads = [threading.Thread(target=client) for _ in range(clients)]
+                start = time.perf_counter()
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                seconds = time.perf_counter() - start
+                results.append(dict(base, method='api concurrent', clients=clients, seconds=seconds,
+                                    requests_per_second=clients * args.repeat * len(API_QUERIES) / seconds))
+        finally:
+            server.shutdown()
+            server.server_close()
+    return results
+
+
+def _stream_partials():
+    return ([stats.GroupSums([col], aggregates.METRICS) for col in loader.CATEGORICAL_COLUMNS]
+            + [stats.Moments(loader.NUMERICAL_COLUMNS), stats.Histograms(loader.NUMERICAL_COLUMNS)])
+
+
+def _measure_stream(method, path, chunk_rows, queue):
+    # Everything the dashboard derives from the rows: the cube plus the
+    # category means, correlation moments and histograms.
+    base_rss = _peak_rss_mb()
+    start = time.perf_counter()
+    partials = _stream_partials()
+    if method == 'in_memory':
+        df = loader.read_snapshot(path) if path.endswith(loader.SNAPSHOT_SUFFIX) else loader.read_dataset(path)
+        cube = aggregates.AggregateCube.from_frame(df)
+        streaming.fold(partials, [df])
+        rows = len(df)
+    else:
+        cube, rows = None, 0
+        for chunk in streaming.iter_chunks(path, chunksize=chunk_rows):
+            part = aggregates.AggregateCube.from_frame(chunk)
+            cube = part if cube is None else cube.merge(part)
+            streaming.fold(partials, [chunk])
+            rows += len(chunk)
+    elapsed = time.perf_counter() - start
+    queue.put({'method': method, 'rows': rows, 'seconds': elapsed,
+               'rows_per_second': rows / elapsed,
+               'peak_rss_mb': _peak_rss_mb(), 'base_rss_mb': base_rss})
+
+
+def bench_stream(args):
+    results = []
+    for rows in args.rows:
+        if args.source == 'snapshot':
+            path = scaled_snapshot(rows, args.workdir, args.cities)
+        else:
+            path = scaled_csv(rows, args.workdir, args.cities)
+        methods = ['streaming'] + (['in_memory'] if rows <= args.in_memory_max else [])
+        for method in methods:
+            results.append(run_in_fresh_process(_measure_stream, method, path, args.chunk_rows))
+        if not args.keep_inputs:
+            os.remove(path)
+    return results
+
+
+def _parallel_run(path, workers):
+    cube = parallel.map_reduce(aggregates.AggregateCube.from_chunks, path,
+                               aggregates.CUBE_COLUMNS, workers=workers)
+    partials = parallel.fold(_stream_partials(), path, workers=workers)
+    return cube, partials
+
+
+def _compare_partials(parallel_run, serial_run):
+    _compare_cubes(parallel_run[0], serial_run[0])
+    *sums, moments, histograms = parallel_run[1]
+    *serial_sums, serial_moments, serial_histograms = serial_run[1]
+    for a, b in zip(sums, serial_sums):
+        a, b = a.mean(), b.mean()
+        # Summation order differs, so allow rounding relative to the table's scale.
+        atol = 1e-9 * np.abs(b.values).max()
+        if not (list(a.index) == list(b.index) and np.allclose(a.values, b.values, rtol=1e-9, atol=atol)):
+            raise AssertionError(f'parallel group means differ for {a.index.name}')
+    if not np.allclose(moments.corr().values, serial_moments.corr().values, rtol=1e-9, atol=1e-12):
+        raise AssertionError('parallel correlation differs')
+    for col in loader.NUMERICAL_COLUMNS:
+        a, b = histograms[col].dense(50), serial_histograms[col].dense(50)
+        if not (np.array_equal(a[0], b[0]) and np.array_equal(a[1], b[1])):
+            raise AssertionError(f'parallel histogram of {col} differs')
+
+
+def bench_parallel(args):
+    results = []
+    for rows in args.rows:
+        path = scaled_snapshot(rows, args.workdir, args.cities)
+        serial = None
+        for workers in args.workers:
+            if workers > 1:
+                # Start the pool's processes before timing.
+                parallel.map_reduce(aggregates.AggregateCube.from_chunks, loader.DATA_PATH, workers=workers)
+            start = time.perf_counter()
+            run = _parallel_run(path, workers)
+            elapsed = time.perf_counter() - start
+            if serial is None:
+                serial, serial_seconds = run, elapsed
+            else:
+                _compare_partials(run, serial)
+            speedup = serial_seconds / elapsed
+            results.append({'rows': rows, 'workers': workers, 'seconds': elapsed,
+                            'speedup': speedup, 'efficiency': speedup / workers,
+                            'matches_serial': True})
+        parallel.shutdown()
+    return results
+
+
+def _measure_view(choices, rows, queue):
+    # One dashboard view, in a process of its own: a cold render (the page's
+    # computation and its charts), a render with the page's data cached but
+    # no figures, and a fully cached rerun.
+    import shutil
+
+    import figcache
+    import instrument
+    import pairplots
+    import report
+    base_rss = _peak_rss_mb()
+    phases = {}
+    for phase in ['cold', 'render', 'cached']:
+        # The cold render is also broken down into loads, aggregations and renders.
+        if phase == 'cold':
+            instrument.enable()
+        else:
+            instrument.disable()
+        if phase == 'render':
+            figcache.figure_cache.clear()
+            shutil.rmtree(pairplots.ASSET_DIR, ignore_errors=True)
+        reset = _reset_peak_rss()
+        phases[phase] = report.render_view(choices), _peak_rss_mb()
+    (cold, cold_rss), (render, render_rss), (cached, _) = phases.values()
+    charts = report.chart_timings([cold])
+    slowest = max(charts, key=lambda chart: chart['seconds'], default=None)
+    queue.put({'view': cold['view'], 'rows': rows,
+               'cold_seconds': cold['seconds'],
+               'compute_seconds': max(0.0, cold['seconds'] - render['seconds']),
+               'render_seconds': render['seconds'],
+               'cached_seconds': cached['seconds'],
+               'charts': len(charts),
+               'slowest_chart': slowest and slowest['chart'][:40],
+               'peak_rss_mb': cold_rss,
+               'render_peak_rss_mb': render_rss if reset else None,
+               'base_rss_mb': base_rss,
+               'chart_seconds': [[chart['chart'], chart['seconds']] for chart in charts],
+               # Through to_json so missing values (no memory tracing) become null.
+               'spans': json.loads(instrument.summary().reset_index().round(3).to_json(orient='records'))})
+
+
+def bench_suite(args):
+    import report
+    results = []
+    for rows in args.rows:
+        path = scaled_csv(rows, args.workdir, args.cities)
+        synthetic.write_snapshot(loader.snapshot_path(path), rows, cities=args.cities)
+        start = time.perf_counter()
+        aggregates.get_cube(path)
+        results.append({'view': 'shared aggregates', 'rows': rows,
+                        'cold_seconds': time.perf_counter() - start})
+        # Every view process reads this dataset and renders its own assets.
+        os.environ['SUPERSTORE_DATA'] = path
+        os.environ['PAIRPLOT_DIR'] = os.path.join(args.workdir, f'assets_{rows}')
+        os.environ.pop('FIGURE_CACHE_DIR', None)
+        for choices in report.views():
+            if args.views and choices[-1] not in args.views:
+                continue
+            results.append(run_in_fresh_process(_measure_view, choices, rows))
+    return results
+
+
+def _measure_users(choices, users, coalesce, rows, queue):
+    # ``users`` sessions open the same view at the same moment on cold
+    # caches, in threads of one process as Streamlit runs them.
+    import threading
+
+    import drilldown
+    import figcache
+    import report
+    import shared
+    shared.COALESCE = coalesce
+    barrier = threading.Barrier(users)
+    rendered, errors = [], []
+
+    def session():
+        barrier.wait()
+        try:
+            rendered.append(report.render_view(choices, shutdown=False))
+        except Exception as exc:
+            errors.append(exc)
+    threads = [threading.Thread(target=session, name=f'session-{i}') for i in range(users)]
+    cpu = time.process_time()
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    # The drill-down pool's CPU time is only accounted once its workers exit.
+    drilldown.shutdown(wait=True)
+    parallel.shutdown()
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = time.process_time() - cpu + (after.ru_utime + after.ru_stime
+                                       - children.ru_utime - children.ru_stime)
+    if errors:
+        raise errors[0]
+
+    def charts(view):
+        # Plotly JSON is compared parsed: a figure rebuilt from the cache
+        # serializes its keys in another order.
+        return [block['data'] if block['kind'] == 'image' else json.loads(block['json'])
+                for block in view['blocks'] if block['kind'] in ('image', 'plotly')]
+    latencies = sorted(view['seconds'] for view in rendered)
+    stores = [streaming._results.stats(), aggregates._cubes.stats()]
+    queue.put({'view': rendered[0]['view'], 'rows': rows, 'users': users,
+               'mode': 'shared' if coalesce else 'independent',
+               'seconds': elapsed, 'views_per_second': users / elapsed,
+               'median_seconds': float(np.median(latencies)), 'max_seconds': latencies[-1],
+               'cpu_seconds': cpu,
+               'computed': sum(store['misses'] for store in stores),
+               'coalesced': sum(store['coalesced'] for store in stores) + loader._reads.coalesced,
+               'figures_coalesced': figcache.figure_cache.stats()['coalesced'],
+               'identical_output': all(charts(view) == charts(rendered[0]) for view in rendered),
+               'peak_rss_mb': _peak_rss_mb()})
+
+
+def bench_users(args):
+    import report
+    results = []
+    for rows in args.rows:
+        path = scaled_csv(rows, args.workdir, args.cities)
+        synthetic.write_snapshot(loader.snapshot_path(path), rows, cities=args.cities)
+        aggregates.get_cube(path)
+        os.environ['SUPERSTORE_DATA'] = path
+        os.environ.pop('FIGURE_CACHE_DIR', None)
+        for choices in report.views():
+            if choices[-1] not in args.views:
+                continue
+            for users in args.users:
+                for coalesce in [False, True]:
+                    # Pairplot assets are rendered afresh by every run.
+                    os.environ['PAIRPLOT_DIR'] = tempfile.mkdtemp(dir=args.workdir)
+                    results.append(run_in_fresh_process(_measure_users, choices, users, coalesce, rows))
+    return results
+
+
+# Run by ``startup`` in a fresh interpreter, so nothing is imported before
+# the timings start. Modes: app.py with the plotting imports it used to
+# make at its top, as it is, or warmed by warmup.warm() before the view
+# (which also renders the view in 'prewarmed view').
+_STARTUP_SCRIPT = """
+import json, sys, time
+choices, mode = json.loads(sys.argv[1]), sys.argv[2]
+start = time.perf_counter()
+if mode == 'eager imports':
+    import matplotlib.pyplot as plt, plotly.express, plotly.graph_objects, plotly.subplots, seaborn
+    plt.style.use('dark_background')
+import app
+imported = time.perf_counter()
+plotting = 'matplotlib.pyplot' in sys.modules
+if mode.startswith('prewarmed'):
+    import warmup
+    warmup.warm(views=choices[-1:] if mode == 'prewarmed view' else [])
+warmed = time.perf_counter()
+import report
+report.render_view(choices)
+done = time.perf_counter()
+with open('/proc/self/status') as f:
+    rss = next(int(line.split()[1]) / 1024 for line in f if line.startswith('VmHWM'))
+print(json.dumps({'import_seconds': imported - start, 'warm_seconds': warmed - imported,
+                  'first_render_seconds': done - warmed, 'seconds': done - start,
+                  'plotting_imported': plotting, 'peak_rss_mb': rss}))
+"""
+
+
+def bench_startup(args):
+    # Pairplot assets are named after the dataset version: one directory
+    # serves every input. Set before pairplots reads it at import.
+    os.environ['PAIRPLOT_DIR'] = os.path.join(args.workdir, 'assets')
+    os.environ.pop('FIGURE_CACHE_DIR', None)
+    import report
+    import warmup
+    results = []
+    for rows in args.rows:
+        path = scaled_csv(rows, args.workdir, args.cities)
+        env = dict(os.environ, SUPERSTORE_DATA=path)
+        # The files a deployment builds ahead of time (snapshot, cube,
+        # pairplots) exist for every mode: only the process starts cold.
+        warmup.warm(path, views=[], imports=False)
+        for choices in report.views():
+            if choices[-1] not in args.views:
+                continue
+            for mode in ['eager imports', 'deferred imports', 'prewarmed', 'prewarmed view']:
+                runs = []
+                for _ in range(args.repeat):
+                    out = subprocess.run([sys.executable, '-c', _STARTUP_SCRIPT, json.dumps(choices), mode],
+                                         cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                                         capture_output=True, text=True, check=True).stdout
+                    runs.append(json.loads(out.splitlines()[-1]))
+                # The median run of each mode, by time to the first render.
+                median = sorted(runs, key=lambda run: run['seconds'])[len(runs) // 2]
+                results.append(dict(median, view=choices[-1], rows=rows, mode=mode))
+    return results
+
+
+def _metadata(argv):
+    try:
+        revision = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                  check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+    import pandas as pd
+    return {'revision': revision, 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'argv': argv, 'python': platform.python_version(), 'pandas': pd.__version__,
+            'numpy': np.__version__, 'platform': platform.platform(), 'cpus': os.cpu_count()}
+
+
+# Fields that say what a result row measured, as opposed to what was measured.
+KEY_FIELDS = ['view', 'method', 'mode', 'rows', 'history_rows', 'batch_rows', 'workers', 'users', 'years',
+              'clients']
+
+
+def _key(row):
+    return tuple((k, row[k]) for k in KEY_FIELDS if k in row)
+
+
+def compare(baseline, current, threshold, min_seconds=0.01):
+    """Measurements of ``current`` more than ``threshold`` slower or larger than ``baseline``.
+
+    Both are result files written with ``--output``. Seconds and megabytes
+    are compared; lower is better for both. Timings under ``min_seconds`` in
+    both files are noise and skipped.
+    """
+    before = {_key(row): row for row in baseline['results']}
+    changes = []
+    for row in current['results']:
+        old = before.get(_key(row))
+        if old is None:
+            continue
+        for metric, value in row.items():
+            if not (metric.endswith('seconds') or metric.endswith('_mb')):
+                continue
+            if not isinstance(value, float) or not isinstance(old.get(metric), float) or old[metric] <= 0:
+                continue
+            if metric.endswith('seconds') and max(value, old[metric]) < min_seconds:
+                continue
+            ratio = value / old[metric]
+            changes.append(dict(dict(_key(row)), metric=metric, baseline=old[metric],
+                                current=value, ratio=ratio, regression=ratio > 1 + threshold))
+    return changes
+
+
+def bench_compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    changes = compare(baseline, current, args.threshold, args.min_seconds)
+    if any(change['regression'] for change in changes):
+        args.exit_status = 1
+    return changes
+
+
+def print_table(results):
+    # Nested values (e.g. per chart timings) are only in the JSON output.
+    keys = list(dict.fromkeys(k for row in results for k, v in row.items() if not isinstance(v, list)))
+    print('  '.join(f'{k:>14}' for k in keys))
+    for row in results:
+        values = [row.get(k, '') for k in keys]
+        print('  '.join(f'{v:>14.3f}' if isinstance(v, float) else f'{v!s:>14}' for v in values))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workdir', default=None,
+                        help='directory for generated inputs (default: a temp dir)')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    parser.add_argument('--output', default=None,
+                        help='also write the results and the code revision and environment to this JSON file')
+    parser.add_argument('--cities', type=int, default=None,
+                        help='distinct cities in generated inputs (default: those of the sample)')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('load', help='cold-start load time and RSS: CSV vs snapshot')
+    p.add_argument('--rows', type=int, nargs='+', default=[1_000_000])
+    p.set_defaults(func=bench_load)
+
+    p = sub.add_parser('append', help='incremental append latency, cube and statistics checked against a full recompute')
+    p.add_argument('--rows', type=int, nargs='+', default=[100_000, 1_000_000])
+    p.add_argument('--batch', type=int, default=10_000)
+    p.set_defaults(func=bench_append)
+
+    p = sub.add_parser('pages', help='Categorical Variables aggregation: per-feature copies vs bincount')
+    p.add_argument('--rows', type=int, nargs='+', default=[1_000_000, 10_000_000])
+    p.set_defaults(func=bench_pages)
+
+    p = sub.add_parser('stream', help='out-of-core aggregation: peak RSS and throughput as rows grow')
+    p.add_argument('--rows', type=int, nargs='+', default=[1_000_000, 10_000_000, 100_000_000])
+    p.add_argument('--source', choices=['snapshot', 'csv'], default='snapshot')
+    p.add_argument('--chunk-rows', type=int, default=streaming.CHUNK_ROWS)
+    p.add_argument('--in-memory-max', type=int, default=10_000_000,
+                   help='largest input also measured fully loaded, for comparison')
+    p.add_argument('--keep-inputs', action='store_true')
+    p.set_defaults(func=bench_stream)
+
+    p = sub.add_parser('parallel', help='parallel aggregation backend: scaling from 1 to N workers')
+    p.add_argument('--rows', type=int, nargs='+', default=[10_000_000])
+    p.add_argument('--workers', type=int, nargs='+',
+                   default=sorted({1, 2, 4, os.cpu_count() or 1}))
+    p.set_defaults(func=bench_parallel)
+
+    p = sub.add_parser('scatter', help='Sub-Category scatter payload size and build time per downsampling mode')
+    p.add_argument('--rows', type=int, nargs='+', default=[100_000, 1_000_000])
+    p.add_argument('--modes', nargs='+', default=list(downsample.MODES), choices=list(downsample.MODES))
+    p.add_argument('--budget', type=int, default=2000)
+    p.set_defaults(func=bench_scatter)
+
+    p = sub.add_parser('filters', help='sidebar filters: bitmap index selection vs row-by-row masks')
+    p.add_argument('--rows', type=int, nargs='+', default=[1_000_000, 10_000_000])
+    p.set_defaults(func=bench_filters)
+
+    p = sub.add_parser('ranking', help='City view top/bottom K: partial selection vs full sorts, incremental appends')
+    p.add_argument('--rows', type=int, nargs='+', default=[1_000_000])
+    p.add_argument('--k', type=int, default=30)
+    p.add_argument('--batch', type=int, default=10_000)
+    p.set_defaults(func=bench_ranking)
+
+    p = sub.add_parser('trends', help='Trends view: day/week/month rollups vs grouping the rows, incremental appends')
+    p.add_argument('--rows', type=int, nargs='+', default=[1_000_000])
+    p.add_argument('--years', type=int, default=4, help='years of order dates in generated inputs')
+    p.add_argument('--batch', type=int, default=10_000)
+    p.set_defaults(func=bench_trends)
+
+    p = sub.add_parser('sketches', help='approximate mode: HyperLogLog, KLL and count-min against exact results')
+    p.add_argument('--rows', type=int, nargs='+', default=[1_000_000, 10_000_000])
+    p.add_argument('--chunk-rows', type=int, default=streaming.CHUNK_ROWS)
+    p.set_defaults(func=bench_sketches)
+
+    p = sub.add_parser('api', help='aggregate store and query API vs reading and grouping the rows')
+    p.add_argument('--rows', type=int, nargs='+', default=[1_000_000, 10_000_000])
+    p.add_argument('--clients', type=int, nargs='+', default=[1, 4, 16])
+    p.add_argument('--repeat', type=int, default=20, help='passes over the queries per client')
+    p.set_defaults(func=bench_api)
+
+    p = sub.add_parser('startup', help='process start: import time and first render, eager vs deferred vs prewarmed')
+    p.add_argument('--rows', type=int, nargs='+', default=[100_000])
+    p.add_argument('--views', nargs='+', default=['Retail Data', 'Region'],
+                   help='last sidebar choice of the views rendered first (default: Retail Data, Region)')
+    p.add_argument('--repeat', type=int, default=3, help='runs per mode, the median is reported')
+    p.set_defaults(func=bench_startup)
+
+    p = sub.add_parser('suite', help='every dashboard view without Streamlit: compute and render time, peak RSS')
+    p.add_argument('--rows', type=int, nargs='+', default=[1_000_000])
+    p.add_argument('--views', nargs='+', default=None,
+                   help='last sidebar choice of the views to run, e.g. "State" (default: all)')
+    p.set_defaults(func=bench_suite)
+
+    p = sub.add_parser('users', help='concurrent sessions opening the same view: shared results vs independent')
+    p.add_argument('--rows', type=int, nargs='+', default=[100_000])
+    p.add_argument('--users', type=int, nargs='+', default=[1, 4, 8])
+    p.add_argument('--views', nargs='+', default=['State'],
+                   help='last sidebar choice of the views to open (default: State)')
+    p.set_defaults(func=bench_users)
+
+    p = sub.add_parser('compare', help='measurements of two --output files that regressed')
+    p.add_argument('baseline')
+    p.add_argument('current')
+    p.add_argument('--threshold', type=float, default=0.1, help='relative change reported as a regression')
+    p.add_argument('--min-seconds', type=float, default=0.01, help='shorter timings are not compared')
+    p.set_defaults(func=bench_compare)
+
+    args = parser.parse_args(argv)
+    args.exit_status = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        args.workdir = args.workdir or tmp
+        results = args.func(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'command': args.command, 'metadata': _metadata(sys.argv if argv is None else argv),
+                       'results': results}, f, indent=2)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    elif results:
+        print_table(results)
+    return args.exit_status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
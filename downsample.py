@@ -0,0 +1,84 @@
+"""Bounded-size representations of per-row scatter data.
+
+The Sub-Category scatter plots used to send one marker per order row to the
+browser. These helpers reduce a value column, split by a group column, to at
+most ``budget`` points. Every mode returns a frame with the group, the x
+value, a marker ``size`` and the number of rows each point stands for.
+
+``bins``       fixed-width bins per group; x is the mean of the bin and the
+               marker size is the number of rows in it (a density strip).
+``quantiles``  evenly spaced quantiles of each group.
+``sample``     a random sample stratified by group, keeping the |value|
+               marker size of the original chart.
+``full``       every row, as before (not bounded).
+
+``from_histograms`` gives the ``bins`` representation for data that was
+streamed into per-group histograms rather than loaded.
+"""
+import numpy as np
+import pandas as pd
+
+
+def _groups(df, group):
+    return df[group].nunique() or 1
+
+
+def binned(df, value, group, budget):
+    bins = max(2, budget // _groups(df, group))
+    values = df[value].to_numpy(dtype='float64')
+    finite = np.isfinite(values)
+    edges = np.histogram_bin_edges(values[finite], bins=bins)
+    index = np.clip(np.searchsorted(edges, values, side='right') - 1, 0, bins - 1)
+    table = (pd.DataFrame({group: df[group], 'bin': index, value: values})[finite]
+               .groupby([group, 'bin'], observed=True)[value]
+               .agg(['mean', 'size'])
+               .reset_index())
+    return pd.DataFrame({group: table[group], value: table['mean'],
+                         'size': table['size'], 'rows': table['size']})
+
+
+def quantiles(df, value, group, budget):
+    count = max(2, budget // _groups(df, group))
+    grouped = df.groupby(group, observed=True)[value]
+    table = grouped.quantile(np.linspace(0, 1, count)).rename(value).reset_index(group)
+    sizes = grouped.size()
+    return pd.DataFrame({group: table[group].to_numpy(), value: table[value].to_numpy(),
+                         'size': 1.0,
+                         'rows': (table[group].map(sizes) / count).to_numpy()})
+
+
+def sample(df, value, group, budget, seed=0):
+    frac = min(1.0, budget / max(len(df), 1))
+    rows = df.groupby(group, observed=True).sample(frac=frac, random_state=seed).head(budget)
+    return pd.DataFrame({group: rows[group], value: rows[value],
+                         'size': np.absolute(rows[value]), 'rows': 1 / frac})
+
+
+def full(df, value, group, budget=None):
+    return pd.DataFrame({group: df[group], value: df[value],
+                         'size': np.absolute(df[value]), 'rows': 1})
+
+
+def from_histograms(histograms, value, group, budget):
+    """Binned points from ``{group value: stats.Histogram}``, for streamed data."""
+    bins = max(2, budget // max(len(histograms), 1))
+    frames = []
+    for name, histogram in histograms.items():
+        edges, counts = histogram.dense(bins)
+        keep = counts > 0
+        centers = (edges[:-1] + edges[1:]) / 2
+        frames.append(pd.DataFrame({group: name, value: centers[keep],
+                                    'size': counts[keep], 'rows': counts[keep]}))
+    if not frames:
+        return pd.DataFrame(columns=[group, value, 'size', 'rows'])
+    return pd.concat(frames, ignore_index=True)
+
+
+MODES = {'bins': binned, 'quantiles': quantiles, 'sample': sample, 'full': full}
+
+
+def downsample(df, value, group, mode='bins', budget=2000):
+    """Reduce ``df[value]`` split by ``df[group]`` to at most ``budget`` points."""
+    if mode not in MODES:
+        raise ValueError(f'unknown downsampling mode {mode!r}; expected one of {list(MODES)}')
+    return MODES[mode](df, value, group, budget)
@@ -0,0 +1,77 @@
+"""Per-state Category / Sub-Category profit drill-down.
+
+The State x Category x Sub-Category profit table is computed with one
+groupby, and the per-state figures are rendered to PNG in a process pool.
+Figures are drawn with the object-oriented matplotlib API so rendering does
+not touch pyplot's global state.
+"""
+import io
+import os
+from concurrent.futures.process import BrokenProcessPool
+
+import instrument
+import shared
+
+CATEGORIES = ['Furniture', 'Office Supplies', 'Technology']
+
+# One pool per process, started lazily and reused across reruns.
+_pool = shared.ProcessPool()
+
+
+def state_category_profit(df):
+    """Total Profit per (State, Category, Sub-Category), in a single groupby."""
+    return df.groupby(['State', 'Category', 'Sub-Category'], observed=True)['Profit'].sum()
+
+
+def render_state(state, profit):
+    """PNG of one state's profit by sub-category, one panel per category.
+
+    ``profit`` is the state's slice of the table, indexed by (Category,
+    Sub-Category). Categories without sales get an empty, labelled panel.
+    """
+    # Imported here so importing the dashboard does not pull in matplotlib.
+    import matplotlib.style
+    import seaborn as sns
+    from matplotlib.figure import Figure
+
+    with matplotlib.style.context('dark_background'):
+        fig = Figure(figsize=(30, 4))
+        axes = fig.subplots(1, 3)
+        fig.suptitle(state, fontsize=20)
+        categories = set(profit.index.get_level_values('Category'))
+        for ax, cat in zip(axes, CATEGORIES):
+            if cat in categories:
+                cat_data = profit.xs(cat, level='Category')
+                sns.barplot(x=cat_data.values, y=cat_data.index.astype(str), ax=ax)
+            else:
+                ax.text(0.5, 0.5, 'No sales', ha='center', va='center', transform=ax.transAxes)
+            ax.set_xlabel('Profit')
+            ax.set_ylabel(cat)
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format='png', bbox_inches='tight')
+    return buffer.getvalue()
+
+
+def shutdown(wait=False):
+    """Stop the pool's workers (see ``shared.ProcessPool.shutdown``)."""
+    _pool.shutdown(wait)
+
+
+@instrument.timed('render')
+def render_states(table, states):
+    """Render the drill-down of every state in ``states``; returns {state: png}."""
+    present = set(table.index.get_level_values('State'))
+    slices = {state: table.xs(state, level='State') if state in present
+              else table.iloc[:0].droplevel('State')
+              for state in states}
+    if len(slices) <= 1:
+        return {state: render_state(state, profit) for state, profit in slices.items()}
+    try:
+        workers = int(os.environ.get('DRILLDOWN_WORKERS', 0)) or os.cpu_count()
+        futures = {state: _pool.get(workers).submit(render_state, state, profit)
+                   for state, profit in slices.items()}
+        return {state: future.result() for state, future in futures.items()}
+    except BrokenProcessPool:
+        # A worker died (or could not start); drop the pool and render here.
+        _pool.shutdown()
+        return {state: render_state(state, profit) for state, profit in slices.items()}
@@ -0,0 +1,213 @@
+"""LRU cache for rendered dashboard figures.
+
+Figures are stored already serialized: matplotlib charts as PNG bytes,
+Plotly charts as their JSON and prebuilt image assets as their encoded
+bytes. Keys are built by the caller from the page, the sidebar choice, the
+chart and the dataset version, so a new dataset version
+simply stops matching the old entries, which then age out.
+
+The in-memory tier is bounded by ``max_bytes``. With a ``directory`` the
+cache also keeps a disk tier, bounded by ``max_disk_bytes``, that survives
+restarts and is shared by every process using the same directory.
+
+Concurrent sessions missing the same figure are coalesced: ``get_or_claim``
+lets the first one render it and makes the others wait for its ``put``.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import shared
+
+EXTENSIONS = {'png': '.png', 'plotly': '.json', 'image': '.img'}
+# How long a session waits for another one's render before drawing it itself.
+CLAIM_SECONDS = float(os.environ.get('FIGURE_CLAIM_SECONDS', 60))
+
+
+class FigureCache:
+
+    def __init__(self, max_bytes=256 << 20, directory=None, max_disk_bytes=1 << 30):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._size = 0
+        self._stats = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0, 'coalesced': 0}
+        self._claims = {}
+        self._disk = OrderedDict()
+        self._disk_size = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._scan_disk()
+
+    def _scan_disk(self):
+        files = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if os.path.splitext(name)[1] in EXTENSIONS.values():
+                st = os.stat(path)
+                files.append((st.st_atime, path, st.st_size))
+        for _, path, size in sorted(files):
+            self._disk[path] = size
+            self._disk_size += size
+
+    def _disk_path(self, key, kind):
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        return os.path.join(self.directory, digest + EXTENSIONS[kind])
+
+    def get(self, key, kind):
+        """Return the cached payload for ``key`` or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == kind:
+                self._entries.move_to_end(key)
+                self._stats['hits'] += 1
+                return entry[1]
+        # The disk tier is read outside the lock, so memory hits of other
+        # sessions do not wait on it. Files another process wrote since the
+        # index was scanned are found too.
+        payload = self._read_disk(self._disk_path(key, kind)) if self.directory else None
+        with self._lock:
+            if payload is None:
+                self._stats['misses'] += 1
+                return None
+            self._stats['disk_hits'] += 1
+            self._store(key, kind, payload)
+            return payload
+
+    def _read_disk(self, path):
+        try:
+            with open(path, 'rb') as f:
+                payload = f.read()
+        except OSError:
+            with self._lock:
+                self._disk_size -= self._disk.pop(path, 0)
+            return None
+        with self._lock:
+            self._disk_size -= self._disk.pop(path, 0)
+            self._disk[path] = len(payload)
+            self._disk_size += len(payload)
+        return payload
+
+    def claim(self, key):
+        """Mark ``key`` as being rendered by this thread; False if another thread already is."""
+        return self._claim(key) is None
+
+    def _claim(self, key):
+        # None when the calling thread holds the claim, else the event its
+        # holder sets when the figure is put.
+        if not shared.COALESCE:
+            return None
+        owner = threading.get_ident()
+        with self._lock:
+            claim = self._claims.get(key)
+            if claim is None:
+                self._claims[key] = (threading.Event(), owner)
+                return None
+            return None if claim[1] == owner else claim[0]
+
+    def get_or_claim(self, key, kind, timeout=CLAIM_SECONDS):
+        """Return the cached payload for ``key``, or None after claiming it.
+
+        On None the caller renders the figure and ``put``s it. While another
+        thread holds the claim this waits for its ``put`` instead, for up to
+        ``timeout`` seconds, after which it returns None to render it anyway.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            payload = self.get(key, kind)
+            if payload is not None:
+                return payload
+            rendered = self._claim(key)
+            if rendered is None:
+                return None
+            with self._lock:
+                self._stats['coalesced'] += 1
+            if not rendered.wait(max(0.0, deadline - time.monotonic())):
+                return None
+
+    def release_claims(self):
+        """Drop the claims of this thread, e.g. after its render failed."""
+        owner = threading.get_ident()
+        with self._lock:
+            for key, claim in list(self._claims.items()):
+                if claim[1] == owner:
+                    del self._claims[key]
+                    claim[0].set()
+
+    def put(self, key, kind, payload):
+        with self._lock:
+            self._store(key, kind, payload)
+            claim = self._claims.pop(key, None)
+        if self.directory:
+            self._write_disk(self._disk_path(key, kind), payload)
+        if claim is not None:
+            claim[0].set()
+
+    def _store(self, key, kind, payload):
+        if len(payload) > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._size -= len(old[1])
+        self._entries[key] = (kind, payload)
+        self._size += len(payload)
+        while self._size > self.max_bytes:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+            self._stats['evictions'] += 1
+
+    def _write_disk(self, path, payload):
+        # Written to a temporary file and renamed outside the lock; the lock
+        # is only taken to update the index.
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(payload)
+            os.replace(tmp, path)
+        except OSError:
+            return
+        evicted = []
+        with self._lock:
+            self._disk_size -= self._disk.pop(path, 0)
+            self._disk[path] = len(payload)
+            self._disk_size += len(payload)
+            while self._disk_size > self.max_disk_bytes and len(self._disk) > 1:
+                old_path, size = self._disk.popitem(last=False)
+                self._disk_size -= size
+                evicted.append(old_path)
+        for old_path in evicted:
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            lookups = stats['hits'] + stats['disk_hits'] + stats['misses']
+            stats['hit_rate'] = (stats['hits'] + stats['disk_hits']) / lookups if lookups else 0.0
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = self._size
+            stats['disk_entries'] = len(self._disk)
+            stats['disk_bytes'] = self._disk_size
+            return stats
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+            for key in self._stats:
+                self._stats[key] = 0
+
+
+# Shared by every session of the app. Budgets come from the environment:
+# FIGURE_CACHE_MB (memory), FIGURE_CACHE_DIR and FIGURE_CACHE_DISK_MB (disk).
+figure_cache = FigureCache(
+    max_bytes=int(os.environ.get('FIGURE_CACHE_MB', 256)) << 20,
+    directory=os.environ.get('FIGURE_CACHE_DIR') or None,
+    max_disk_bytes=int(os.environ.get('FIGURE_CACHE_DISK_MB', 1024)) << 20,
+)
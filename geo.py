@@ -0,0 +1,140 @@
+"""Geographic dimension: US states, their postal codes and Superstore regions.
+
+The tables are built once at import. Lookups on a State column go through
+its categories, so mapping a million rows costs as much as mapping the ~50
+distinct states.
+"""
+import pandas as pd
+
+STATE_CODES = {
+    'Alabama': 'AL',
+    'Alaska': 'AK',
+    'American Samoa': 'AS',
+    'Arizona': 'AZ',
+    'Arkansas': 'AR',
+    'California': 'CA',
+    'Colorado': 'CO',
+    'Connecticut': 'CT',
+    'Delaware': 'DE',
+    'District of Columbia': 'DC',
+    'Florida': 'FL',
+    'Georgia': 'GA',
+    'Guam': 'GU',
+    'Hawaii': 'HI',
+    'Idaho': 'ID',
+    'Illinois': 'IL',
+    'Indiana': 'IN',
+    'Iowa': 'IA',
+    'Kansas': 'KS',
+    'Kentucky': 'KY',
+    'Louisiana': 'LA',
+    'Maine': 'ME',
+    'Maryland': 'MD',
+    'Massachusetts': 'MA',
+    'Michigan': 'MI',
+    'Minnesota': 'MN',
+    'Mississippi': 'MS',
+    'Missouri': 'MO',
+    'Montana': 'MT',
+    'Nebraska': 'NE',
+    'Nevada': 'NV',
+    'New Hampshire': 'NH',
+    'New Jersey': 'NJ',
+    'New Mexico': 'NM',
+    'New York': 'NY',
+    'North Carolina': 'NC',
+    'North Dakota': 'ND',
+    'Northern Mariana Islands': 'MP',
+    'Ohio': 'OH',
+    'Oklahoma': 'OK',
+    'Oregon': 'OR',
+    'Pennsylvania': 'PA',
+    'Puerto Rico': 'PR',
+    'Rhode Island': 'RI',
+    'South Carolina': 'SC',
+    'South Dakota': 'SD',
+    'Tennessee': 'TN',
+    'Texas': 'TX',
+    'Utah': 'UT',
+    'Vermont': 'VT',
+    'Virgin Islands': 'VI',
+    'Virginia': 'VA',
+    'Washington': 'WA',
+    'West Virginia': 'WV',
+    'Wisconsin': 'WI',
+    'Wyoming': 'WY',
+}
+
+# Region each state is reported under in the Superstore data.
+STATE_REGIONS = {
+    'Alabama': 'South',
+    'Arizona': 'West',
+    'Arkansas': 'South',
+    'California': 'West',
+    'Colorado': 'West',
+    'Connecticut': 'East',
+    'Delaware': 'East',
+    'District of Columbia': 'East',
+    'Florida': 'South',
+    'Georgia': 'South',
+    'Idaho': 'West',
+    'Illinois': 'Central',
+    'Indiana': 'Central',
+    'Iowa': 'Central',
+    'Kansas': 'Central',
+    'Kentucky': 'South',
+    'Louisiana': 'South',
+    'Maine': 'East',
+    'Maryland': 'East',
+    'Massachusetts': 'East',
+    'Michigan': 'Central',
+    'Minnesota': 'Central',
+    'Mississippi': 'South',
+    'Missouri': 'Central',
+    'Montana': 'West',
+    'Nebraska': 'Central',
+    'Nevada': 'West',
+    'New Hampshire': 'East',
+    'New Jersey': 'East',
+    'New Mexico': 'West',
+    'New York': 'East',
+    'North Carolina': 'South',
+    'North Dakota': 'Central',
+    'Ohio': 'East',
+    'Oklahoma': 'Central',
+    'Oregon': 'West',
+    'Pennsylvania': 'East',
+    'Rhode Island': 'East',
+    'South Carolina': 'South',
+    'South Dakota': 'Central',
+    'Tennessee': 'South',
+    'Texas': 'Central',
+    'Utah': 'West',
+    'Vermont': 'East',
+    'Virginia': 'South',
+    'Washington': 'West',
+    'West Virginia': 'East',
+    'Wisconsin': 'Central',
+    'Wyoming': 'West',
+}
+
+STATES = pd.DataFrame(
+    {'code': pd.Series(STATE_CODES), 'region': pd.Series(STATE_REGIONS)}
+).rename_axis('State')
+CODE_STATES = {code: state for state, code in STATE_CODES.items()}
+
+
+def state_codes(states):
+    """Postal codes for a State column (NaN for unknown names).
+
+    For a categorical column only the categories are mapped and the row
+    codes are reused.
+    """
+    return states.map(STATE_CODES)
+
+
+def state_totals(cube, metrics=('Sales', 'Profit')):
+    """Total ``metrics`` per state postal code, read from the aggregate cube."""
+    totals = cube.sum(['State'], list(metrics))
+    totals.index = pd.Index(totals.index.map(STATE_CODES), name='state_code')
+    return totals
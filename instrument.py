@@ -0,0 +1,241 @@
+"""Timing and memory instrumentation for the dashboard.
+
+Sections of work are wrapped in spans::
+
+    with instrument.span('read_csv', 'load'):
+        ...
+
+or, for whole functions, decorated with ``@instrument.timed('load')``.
+Every finished span records its wall time and the CPU time of its thread
+and, when memory tracing is on, the memory it allocated (net of what it
+freed) and its peak above the starting point. Spans nest, so a page's span
+contains the loads, aggregations and figure renders it triggered.
+
+The last ``MAX_SPANS`` records are kept in memory for the admin panel. They
+export as JSON lines or as Chrome trace events (load the file in Perfetto
+or chrome://tracing), and with INSTRUMENT_LOG set every record is also
+appended to that file as JSON lines.
+
+Instrumentation is off unless INSTRUMENT=1 (timings) or INSTRUMENT=memory
+(timings and tracemalloc) is set, or it is switched on with ``enable``.
+While it is off ``span`` returns a shared no-op context manager and timed
+functions call straight through. Memory tracing is process-wide, so with
+concurrent sessions a span's memory includes other threads' allocations.
+"""
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+
+MAX_SPANS = int(os.environ.get('INSTRUMENT_SPANS', 10_000))
+LOG_PATH = os.environ.get('INSTRUMENT_LOG') or None
+
+_lock = threading.Lock()
+_records = deque(maxlen=MAX_SPANS)
+_local = threading.local()
+_state = {'enabled': False, 'memory': False, 'started_tracemalloc': False}
+# Trace timestamps are taken from perf_counter, anchored to the wall clock once.
+_origin = time.time() - time.perf_counter()
+
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def annotate(self, **fields):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+def _stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+class _Span:
+    __slots__ = ('name', 'category', 'fields', 'start', 'cpu', 'memory', 'peak', 'children')
+
+    def __init__(self, name, category, fields):
+        self.name = name
+        self.category = category
+        self.fields = fields
+        self.memory = None
+        self.children = 0.0
+
+    def annotate(self, **fields):
+        """Add fields to the record, e.g. what the span turned out to do."""
+        self.fields.update(fields)
+
+    def __enter__(self):
+        stack = _stack()
+        if _state['memory'] and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            # The peak is reset for this span; fold the enclosing span's peak
+            # so far into it first.
+            if stack:
+                stack[-1].peak = max(stack[-1].peak, peak)
+            tracemalloc.reset_peak()
+            self.memory = self.peak = current
+        stack.append(self)
+        self.cpu = time.thread_time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self.start
+        cpu = time.thread_time() - self.cpu
+        stack = _stack()
+        stack.pop()
+        if stack:
+            stack[-1].children += wall
+        # self_ms is the time not spent in nested spans, e.g. a page's own
+        # plotting code between the loads and renders it calls.
+        record = {'name': self.name, 'category': self.category,
+                  'view': getattr(_local, 'view', None), 'thread': threading.current_thread().name,
+                  'depth': len(stack), 'start': _origin + self.start,
+                  'wall_ms': wall * 1000, 'self_ms': (wall - self.children) * 1000, 'cpu_ms': cpu * 1000}
+        if self.memory is not None and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            peak = max(peak, self.peak)
+            record['alloc_mb'] = (current - self.memory) / (1 << 20)
+            record['peak_mb'] = (peak - self.memory) / (1 << 20)
+            if stack:
+                stack[-1].peak = max(stack[-1].peak, peak)
+            tracemalloc.reset_peak()
+        if exc_type is not None:
+            record['error'] = exc_type.__name__
+        record.update(self.fields)
+        _record(record)
+        return False
+
+
+def _record(record):
+    with _lock:
+        _records.append(record)
+        if LOG_PATH:
+            with open(LOG_PATH, 'a') as f:
+                f.write(json.dumps(record, default=str) + '\n')
+
+
+def enabled():
+    return _state['enabled']
+
+
+def tracing_memory():
+    return _state['enabled'] and _state['memory']
+
+
+def enable(memory=False):
+    """Start recording spans; ``memory`` also traces allocations (slower)."""
+    with _lock:
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _state['started_tracemalloc'] = True
+        elif not memory and _state['started_tracemalloc']:
+            tracemalloc.stop()
+            _state['started_tracemalloc'] = False
+        _state['memory'] = memory
+        _state['enabled'] = True
+
+
+def disable():
+    with _lock:
+        if _state['started_tracemalloc']:
+            tracemalloc.stop()
+            _state['started_tracemalloc'] = False
+        _state['enabled'] = _state['memory'] = False
+
+
+def span(name, category='section', **fields):
+    """Context manager recording one section of work; a no-op while disabled."""
+    if not _state['enabled']:
+        return _NO_SPAN
+    return _Span(name, category, fields)
+
+
+def timed(category='section', name=None):
+    """Decorator recording every call of a function as a span."""
+    def decorate(func):
+        label = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _state['enabled']:
+                return func(*args, **kwargs)
+            with _Span(label, category, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def set_view(view):
+    """Label the spans of this thread with the dashboard view being rendered."""
+    _local.view = view
+
+
+def current_view():
+    return getattr(_local, 'view', None)
+
+
+def records(view=None):
+    with _lock:
+        result = list(_records)
+    return result if view is None else [record for record in result if record['view'] == view]
+
+
+def clear():
+    with _lock:
+        _records.clear()
+
+
+def summary(view=None):
+    """Totals per (category, name), slowest first, as a DataFrame."""
+    import pandas as pd
+    df = pd.DataFrame(records(view), columns=['category', 'name', 'wall_ms', 'self_ms', 'cpu_ms', 'peak_mb'])
+    if df.empty:
+        return pd.DataFrame(columns=['calls', 'wall_ms', 'self_ms', 'cpu_ms', 'max_wall_ms', 'peak_mb'])
+    grouped = df.groupby(['category', 'name'])
+    table = pd.DataFrame({'calls': grouped.size(), 'wall_ms': grouped['wall_ms'].sum(),
+                          'self_ms': grouped['self_ms'].sum(), 'cpu_ms': grouped['cpu_ms'].sum(),
+                          'max_wall_ms': grouped['wall_ms'].max(), 'peak_mb': grouped['peak_mb'].max()})
+    return table.sort_values('wall_ms', ascending=False)
+
+
+def to_jsonl(view=None):
+    """The records as JSON lines."""
+    return ''.join(json.dumps(record, default=str) + '\n' for record in records(view))
+
+
+def trace_events(view=None):
+    """The records in the Chrome trace event format, as a dict."""
+    events = []
+    threads = {}
+    for record in records(view):
+        tid = threads.setdefault(record['thread'], len(threads) + 1)
+        args = {k: v for k, v in record.items()
+                if k not in ('name', 'category', 'thread', 'depth', 'start', 'wall_ms')}
+        events.append({'name': record['name'], 'cat': record['category'], 'ph': 'X',
+                       'ts': record['start'] * 1e6, 'dur': record['wall_ms'] * 1e3,
+                       'pid': os.getpid(), 'tid': tid, 'args': args})
+    events.extend({'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': tid,
+                   'args': {'name': thread}} for thread, tid in threads.items())
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def trace_json(view=None):
+    return json.dumps(trace_events(view), default=str)
+
+
+_mode = os.environ.get('INSTRUMENT', '')
+if _mode in ('1', 'memory'):
+    enable(memory=_mode == 'memory')
@@ -0,0 +1,306 @@
+"""Data loading for the Superstore dashboard.
+
+The dataset is parsed once per file version and kept in an in-process cache,
+so Streamlit reruns and concurrent sessions all share the same typed frame.
+Callers must treat the returned frame as read-only.
+
+When pyarrow is available the CSV is converted into a columnar Feather
+snapshot next to it (``SampleSuperstore.feather``). Cold starts then read the
+snapshot through a memory map instead of parsing text, and pages can ask for
+just the columns they use.
+"""
+import hashlib
+import os
+import threading
+
+import pandas as pd
+
+import instrument
+import shared
+
+try:
+    import pyarrow
+    import pyarrow.feather as feather
+    import pyarrow.ipc
+except ImportError:
+    feather = None
+
+DATA_PATH = os.environ.get('SUPERSTORE_DATA', 'SampleSuperstore.csv')
+SNAPSHOT_SUFFIX = '.feather'
+
+# Explicit schema: low-cardinality text columns become categoricals and
+# numerics are stored in the smallest dtype that holds the Superstore values.
+# Discount stays float64: as float32 its levels widen to 0.10000000149 once
+# aggregated, and Postal Code is nullable since some exports leave it blank.
+CATEGORICAL_COLUMNS = ['Ship Mode', 'Segment', 'Country', 'City', 'State',
+                       'Region', 'Category', 'Sub-Category']
+SCHEMA = {
+    'Ship Mode': 'category',
+    'Segment': 'category',
+    'Country': 'category',
+    'City': 'category',
+    'State': 'category',
+    'Postal Code': 'Int32',
+    'Region': 'category',
+    'Category': 'category',
+    'Sub-Category': 'category',
+    'Sales': 'float64',
+    'Quantity': 'int16',
+    'Discount': 'float64',
+    'Profit': 'float64',
+}
+NUMERICAL_COLUMNS = [col for col in SCHEMA if col not in CATEGORICAL_COLUMNS]
+# Optional: parsed to datetime64 when the file has it (the sample does not),
+# for the trend views (see ``timeseries``).
+DATE_COLUMN = 'Order Date'
+
+_lock = threading.Lock()
+_cache = {}
+_reads = shared.SingleFlight()
+_versions = {}
+_stats = {'hits': 0, 'misses': 0}
+
+
+def _file_hash(path, chunk_size=1 << 20):
+    # Seeded with the schema, so cubes and figures kept under an older
+    # schema are not taken for the current version.
+    digest = hashlib.sha1(repr(SCHEMA).encode())
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest
+
+
+def _stamp(path):
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _sort_categories(df):
+    # read_csv appends categories found in later parser chunks unsorted, so
+    # sort them to keep group order independent of the file size.
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            categories = df[col].cat.categories
+            if not categories.is_monotonic_increasing:
+                df[col] = df[col].cat.reorder_categories(categories.sort_values())
+    return df
+
+
+def csv_columns(path=DATA_PATH):
+    """Column names in the header of the CSV at ``path``."""
+    with open(path, newline='') as f:
+        return list(pd.read_csv(f, nrows=0).columns)
+
+
+def has_dates(path=DATA_PATH):
+    """True when the dataset at ``path`` (a CSV or a snapshot) has an order-date column."""
+    if path.endswith(SNAPSHOT_SUFFIX):
+        return DATE_COLUMN in feather.read_table(path, memory_map=True).schema.names
+    return DATE_COLUMN in csv_columns(path)
+
+
+def read_options(columns):
+    """``read_csv`` keyword arguments that type ``columns`` with the schema."""
+    return {'dtype': {col: SCHEMA[col] for col in columns if col in SCHEMA},
+            'parse_dates': [col for col in columns if col == DATE_COLUMN]}
+
+
+def read_dataset(path=DATA_PATH, columns=None):
+    """Parse the CSV with the explicit schema, bypassing the cache."""
+    if columns is None:
+        return _sort_categories(pd.read_csv(path, **read_options(csv_columns(path))))
+    df = pd.read_csv(path, usecols=list(columns), **read_options(columns))[list(columns)]
+    return _sort_categories(df)
+
+
+def snapshot_path(path=DATA_PATH):
+    return os.path.splitext(path)[0] + SNAPSHOT_SUFFIX
+
+
+def _snapshot_schema(snapshot):
+    # Column dtypes the snapshot was written with, from its pandas metadata.
+    with pyarrow.memory_map(snapshot) as source:
+        metadata = pyarrow.ipc.open_file(source).schema.pandas_metadata or {}
+    return {col['name']: col['numpy_type'] for col in metadata.get('columns', [])
+            if col['pandas_type'] != 'categorical'}
+
+
+def snapshot_is_fresh(path=DATA_PATH, snapshot=None):
+    snapshot = snapshot or snapshot_path(path)
+    if not (os.path.exists(snapshot)
+            and os.stat(snapshot).st_mtime_ns >= os.stat(path).st_mtime_ns):
+        return False
+    written = _snapshot_schema(snapshot)
+    return all(written[col] == dtype for col, dtype in SCHEMA.items()
+               if col in written and dtype != 'category')
+
+
+def convert_to_snapshot(path=DATA_PATH, snapshot=None, df=None):
+    """Write the typed dataset to an uncompressed Feather file.
+
+    Categoricals are stored dictionary-encoded and the file is left
+    uncompressed so it can be memory-mapped when read back.
+    """
+    if feather is None:
+        raise ImportError('pyarrow is required to write dataset snapshots')
+    snapshot = snapshot or snapshot_path(path)
+    if df is None:
+        df = read_dataset(path)
+    # Sessions loading different columns may write the snapshot at once.
+    tmp = f'{snapshot}.{os.getpid()}.{threading.get_ident()}.tmp'
+    df.to_feather(tmp, compression='uncompressed')
+    os.replace(tmp, snapshot)
+    return snapshot
+
+
+def read_snapshot(snapshot, columns=None):
+    table = feather.read_table(snapshot, columns=columns, memory_map=True)
+    return table.to_pandas()
+
+
+def _read(path, columns):
+    # Prefer a fresh snapshot; otherwise parse the CSV once and (re)write the
+    # snapshot from the parsed frame so the next cold start can use it.
+    if feather is None:
+        with instrument.span('read_csv', 'load'):
+            return read_dataset(path, columns)
+    snapshot = snapshot_path(path)
+    if snapshot_is_fresh(path, snapshot):
+        with instrument.span('read_snapshot', 'load'):
+            return read_snapshot(snapshot, columns)
+    with instrument.span('read_csv', 'load'):
+        df = read_dataset(path)
+    try:
+        with instrument.span('write_snapshot', 'load'):
+            convert_to_snapshot(path, snapshot, df)
+    except OSError:
+        pass
+    return df if columns is None else df[list(columns)]
+
+
+def _version(path):
+    # Caller holds _lock. The content hash is only recomputed when the file's
+    # mtime or size changes. The running hash object is kept so appends can
+    # extend it without re-reading the file.
+    stamp = _stamp(path)
+    known = _versions.get(path)
+    if known is None or known['stamp'] != stamp:
+        digest = _file_hash(path)
+        known = _versions[path] = {'stamp': stamp, 'digest': digest,
+                                   'version': digest.hexdigest()}
+    return known['version']
+
+
+def dataset_version(path=DATA_PATH):
+    """Content hash of the dataset file, used to key derived results."""
+    with _lock:
+        return _version(os.path.abspath(path))
+
+
+def load_dataset(path=DATA_PATH, columns=None):
+    """Return the typed dataset for ``path``, parsing it only when the file changed.
+
+    The cache is keyed on the file's content hash, which is only recomputed
+    when its mtime or size change, so a touched but otherwise identical file
+    is still served from the cache. ``columns`` limits the load to a subset
+    of columns; it is answered from the full frame if that is cached.
+    """
+    path = os.path.abspath(path)
+    key = None if columns is None else tuple(columns)
+    with _lock:
+        version = _version(path)
+        entry = _cache.get(path)
+        if entry is None or entry['version'] != version:
+            entry = _cache[path] = {'version': version, 'frames': {}, 'pending': []}
+        if entry['pending']:
+            # Fold appended batches into the full frame only when a page
+            # actually asks for rows.
+            full = entry['frames'].get(None)
+            entry['frames'] = {} if full is None else {None: concat_frames([full] + entry['pending'])}
+            entry['pending'] = []
+        frames = entry['frames']
+        if key in frames:
+            _stats['hits'] += 1
+            return frames[key]
+        if None in frames:
+            _stats['hits'] += 1
+            return frames[None][list(key)]
+        _stats['misses'] += 1
+    # Parse outside the lock, so loads of other files or columns are not held
+    # up; concurrent loads of the same columns share one parse.
+    df = _reads.do((path, version, key), lambda: _read(path, columns))
+    with _lock:
+        entry = _cache.get(path)
+        if entry is not None and entry['version'] == version and not entry['pending']:
+            df = entry['frames'].setdefault(key, df)
+    return df
+
+
+def coerce_rows(rows, columns=None):
+    """Check ``rows`` against the Superstore schema and apply its dtypes.
+
+    ``columns`` is the column order of the file the rows go to (the schema's
+    by default); it may include the order date.
+    """
+    columns = list(SCHEMA) if columns is None else list(columns)
+    missing = [col for col in columns if col not in rows.columns]
+    if missing:
+        raise ValueError(f'rows are missing columns: {missing}')
+    rows = rows[columns].astype({col: SCHEMA[col] for col in columns if col in SCHEMA})
+    if DATE_COLUMN in columns:
+        rows[DATE_COLUMN] = pd.to_datetime(rows[DATE_COLUMN])
+    return rows.reset_index(drop=True)
+
+
+def concat_frames(frames):
+    """Concatenate typed frames, keeping categoricals by unioning their categories."""
+    frames = [df.copy(deep=False) for df in frames]
+    for col in frames[0].columns:
+        if isinstance(frames[0][col].dtype, pd.CategoricalDtype):
+            categories = frames[0][col].cat.categories
+            for df in frames[1:]:
+                categories = categories.union(df[col].cat.categories)
+            categories = categories.sort_values()
+            for df in frames:
+                df[col] = df[col].cat.set_categories(categories)
+    return pd.concat(frames, ignore_index=True)
+
+
+def append_rows(rows, path=DATA_PATH):
+    """Append ``rows`` to the dataset file without re-reading it.
+
+    The file's content hash is extended with the appended bytes and a cached
+    frame picks the rows up on its next use. Returns the typed rows together
+    with the dataset versions before and after the append.
+    """
+    path = os.path.abspath(path)
+    rows = coerce_rows(rows, csv_columns(path))
+    data = rows.to_csv(header=False, index=False, lineterminator='\n').encode()
+    with _lock:
+        old_version = _version(path)
+        with open(path, 'ab') as f:
+            f.write(data)
+        known = _versions[path]
+        known['digest'].update(data)
+        known['stamp'] = _stamp(path)
+        known['version'] = new_version = known['digest'].hexdigest()
+        entry = _cache.get(path)
+        if entry is not None and entry['version'] == old_version:
+            entry['version'] = new_version
+            entry['pending'].append(rows)
+    return rows, old_version, new_version
+
+
+def cache_info():
+    with _lock:
+        return {'hits': _stats['hits'], 'misses': _stats['misses'],
+                'entries': sum(len(e['frames']) for e in _cache.values())}
+
+
+def clear_cache():
+    with _lock:
+        _cache.clear()
+        _versions.clear()
+        _stats['hits'] = 0
+        _stats['misses'] = 0
@@ -0,0 +1,247 @@
+"""Data each dashboard page needs.
+
+Every page declares the dataset columns it reads and whether it uses the
+aggregate cube. ``page_rows`` and ``page_cube`` fetch exactly that, and
+only when the page asks for it, so the static pages never touch the dataset
+and the other pages read just their own columns.
+
+When the dataset is too large to load (see ``streaming.out_of_core``), or
+the parallel backend is on, the functions below answer from mergeable
+partial aggregates folded over chunks (or partitions) instead of from the
+loaded rows. Pages only display a preview of the rows of datasets that are
+too large to load.
+
+Every function takes the sidebar's row filter as ``where`` (see
+``filters``); the selected rows are fed to the same aggregations.
+"""
+import functools
+import os
+from collections import namedtuple
+
+import pandas as pd
+
+import aggregates
+import downsample
+import drilldown
+import filters
+import instrument
+import loader
+import parallel
+import ranking
+import sketches
+import store
+import streaming
+import timeseries
+from stats import Distinct, GroupHistograms, GroupSums, Histograms, Moments
+
+# columns: list of columns, or None for every column; rows: whether the page
+# reads rows at all; cube: whether it reads the AggregateCube.
+Page = namedtuple('Page', ['rows', 'columns', 'cube'], defaults=[False, None, False])
+
+STATIC = Page()
+
+PAGES = {
+    'Retail Data': Page(rows=True),
+    'Numerical Variables': Page(rows=True, columns=loader.NUMERICAL_COLUMNS),
+    'Categorical Variables': Page(rows=True, columns=loader.CATEGORICAL_COLUMNS + ['Sales', 'Profit', 'Discount']),
+    'Conclusion': STATIC,
+    'Dataset': STATIC,
+    'Technologies Used': STATIC,
+}
+
+# The "Data insights" page is split by its 'Based on' choice. Most views are
+# served from the cube; two read rows for per-row charts that are not cached.
+INSIGHTS = {
+    'Ship Mode': Page(cube=True),
+    'Segment': Page(cube=True),
+    'Region': Page(cube=True),
+    'City': Page(cube=True),
+    'State': Page(rows=True, columns=['State', 'Category', 'Sub-Category', 'Profit'], cube=True),
+    'Category': Page(cube=True),
+    'Sub-Category': Page(rows=True, columns=['Category', 'Sub-Category', 'Sales', 'Quantity', 'Profit'], cube=True),
+    # Served from the order-date rollups (see ``order_trends``).
+    'Trends': Page(columns=timeseries.COLUMNS),
+}
+
+PREVIEW_ROWS = 1000
+# Serve unfiltered cube pages from the aggregate store ('1') or from an
+# api.py server (its URL) instead of the cube in this process.
+AGGREGATE_STORE = os.environ.get('AGGREGATE_STORE', '')
+
+
+@instrument.timed('load')
+def page_rows(page, path=loader.DATA_PATH, where=filters.NO_FILTER):
+    """The columns ``page`` declared, loaded on first use and cached by the loader."""
+    if not page.rows:
+        raise ValueError('page does not declare any rows')
+    return filters.filtered_frame(path, page.columns, where)
+
+
+@instrument.timed('aggregate')
+def page_cube(page, path=loader.DATA_PATH, where=filters.NO_FILTER):
+    if not page.cube:
+        raise ValueError('page does not declare the aggregate cube')
+    if AGGREGATE_STORE and not where.active:
+        return store.StoreCube(path if AGGREGATE_STORE == '1' else AGGREGATE_STORE)
+    return aggregates.get_cube(path, where)
+
+
+def filter_options(path=loader.DATA_PATH):
+    """Values of every filter column, for the sidebar: from the filter index
+    when the dataset is loaded (which builds it) and from the cube otherwise."""
+    if streaming.out_of_core(path):
+        cube = aggregates.get_cube(path)
+        return {col: list(cube.values(col)) for col in filters.COLUMNS}
+    index = filters.get_index(path)
+    return {col: list(index.values[col]) for col in filters.COLUMNS}
+
+
+def out_of_core(path=loader.DATA_PATH):
+    return streaming.out_of_core(path)
+
+
+def from_partials(path=loader.DATA_PATH):
+    """True when page statistics come from partial aggregates rather than the loaded rows."""
+    return streaming.out_of_core(path) or parallel.enabled()
+
+
+@instrument.timed('load')
+def page_preview(page, path=loader.DATA_PATH, where=filters.NO_FILTER):
+    """Rows to display for ``page``: all of them, or the first PREVIEW_ROWS when streaming."""
+    if streaming.out_of_core(path):
+        columns = page.columns
+        if where.active and columns is not None:
+            columns = list(dict.fromkeys(columns + where.columns))
+        # The first matching rows of the first chunk, if any match there.
+        rows = streaming.head(path, columns, streaming.CHUNK_ROWS if where.active else PREVIEW_ROWS)
+        rows = rows[filters.mask(rows, where)].head(PREVIEW_ROWS)
+        return rows if page.columns is None else rows[page.columns]
+    return page_rows(page, path, where)
+
+
+@instrument.timed('aggregate')
+def row_count(path=loader.DATA_PATH, where=filters.NO_FILTER):
+    if streaming.out_of_core(path):
+        return int(aggregates.get_cube(path, where).count(['Region']).sum())
+    if where.active:
+        return len(filters.get_index(path).positions(where))
+    return len(loader.load_dataset(path))
+
+
+@instrument.timed('aggregate')
+def category_means(columns, metrics=('Sales', 'Profit', 'Discount'), path=loader.DATA_PATH,
+                   where=filters.NO_FILTER):
+    """``aggregates.category_means`` of the whole dataset (or the rows passing
+    ``where``), loaded or streamed."""
+    columns, metrics = list(columns), list(metrics)
+    if not from_partials(path):
+        positions = filters.get_index(path).positions(where) if where.active else None
+        return aggregates.category_means(loader.load_dataset(path, columns + metrics), columns, metrics,
+                                         positions)
+    sums = streaming.compute(('category_means', tuple(columns), tuple(metrics)),
+                             lambda: [GroupSums([col], metrics) for col in columns],
+                             columns + metrics, path, where=where)
+    return {col: partial.mean() for col, partial in zip(columns, sums)}
+
+
+@instrument.timed('aggregate')
+def numerical_summary(columns, path=loader.DATA_PATH, where=filters.NO_FILTER):
+    """Moments, small distinct sets and histograms of numerical ``columns``.
+
+    Always built from partials, loaded or not, so the page only needs the
+    correlation matrix and histogram bins, never the column values.
+    """
+    columns = list(columns)
+    moments, distinct, histograms = streaming.compute(
+        ('numerical', tuple(columns)),
+        lambda: [Moments(columns), Distinct(columns), Histograms(columns)],
+        columns, path, where=where)
+    return {'moments': moments, 'distinct': distinct, 'histograms': histograms}
+
+
+@instrument.timed('aggregate')
+def streamed_median(key, value, path=loader.DATA_PATH, where=filters.NO_FILTER):
+    """Approximate ``groupby(key)[value].median()``, from per-group histograms."""
+    # Finer bins than the default: a median is only as precise as its bin.
+    histograms, = streaming.compute(('median', key, value),
+                                    lambda: [GroupHistograms(key, value, max_bins=1 << 14)],
+                                    [key, value], path, where=where)
+    return histograms.median()
+
+
+@instrument.timed('aggregate')
+def approximate_cardinality(columns, path=loader.DATA_PATH, where=filters.NO_FILTER):
+    """HyperLogLog distinct counts of ``columns`` (see ``sketches``)."""
+    columns = list(columns)
+    cardinality, = streaming.compute(('cardinality', tuple(columns)), lambda: [sketches.Cardinality(columns)],
+                                     columns, path, where=where)
+    return cardinality
+
+
+@instrument.timed('aggregate')
+def approximate_median(key, value, path=loader.DATA_PATH, where=filters.NO_FILTER):
+    """``groupby(key)[value].median()`` from KLL sketches, with ``.rank_error()`` of the result."""
+    quantiles, = streaming.compute(('quantiles', key, value), lambda: [sketches.GroupQuantiles(key, value)],
+                                   [key, value], path, where=where)
+    return quantiles
+
+
+@instrument.timed('aggregate')
+def approximate_top_counts(column, path=loader.DATA_PATH, where=filters.NO_FILTER):
+    """Most frequent values of ``column`` from a count-min sketch."""
+    counts, = streaming.compute(('top_counts', column), lambda: [sketches.TopCounts(column)],
+                                [column], path, where=where)
+    return counts
+
+
+@instrument.timed('aggregate')
+def state_category_profit(path=loader.DATA_PATH, where=filters.NO_FILTER):
+    """``drilldown.state_category_profit`` of the whole dataset, loaded or streamed."""
+    if not from_partials(path):
+        return drilldown.state_category_profit(page_rows(INSIGHTS['State'], path, where))
+    keys = ['State', 'Category', 'Sub-Category']
+    sums, = streaming.compute('state_category_profit', lambda: [GroupSums(keys, ['Profit'])],
+                              INSIGHTS['State'].columns, path, where=where)
+    return sums.sum()['Profit']
+
+
+@instrument.timed('aggregate')
+def city_ranking(path=loader.DATA_PATH, where=filters.NO_FILTER):
+    """Top and bottom cities by deals, Sales or Profit (see ``ranking``)."""
+    return ranking.get_ranking(path, where)
+
+
+def _per_product(measure, chunk):
+    return chunk.assign(per_product=chunk[measure] / chunk.Quantity)
+
+
+@instrument.timed('aggregate')
+def per_product_points(category, measure, name, mode, budget, path=loader.DATA_PATH, where=filters.NO_FILTER):
+    """Scatter points of ``measure`` per unit sold, by Sub-Category, for one Category.
+
+    Streamed datasets only support the binned representation, built from a
+    histogram per (Category, Sub-Category).
+    """
+    if not streaming.out_of_core(path):
+        df = page_rows(INSIGHTS['Sub-Category'], path, where)
+        rows = df[df.Category == category]
+        rows = pd.DataFrame({'Sub-Category': rows['Sub-Category'],
+                             name: rows[measure] / rows.Quantity})
+        return downsample.downsample(rows, name, 'Sub-Category', mode, budget)
+    histograms, = streaming.compute(
+        ('per_product', measure),
+        lambda: [GroupHistograms(['Category', 'Sub-Category'], 'per_product')],
+        INSIGHTS['Sub-Category'].columns, path,
+        transform=functools.partial(_per_product, measure), where=where)
+    groups = {sub: histogram for (cat, sub), histogram in histograms.histograms.items() if cat == category}
+    return downsample.from_histograms(groups, name, 'Sub-Category', budget)
+
+
+@instrument.timed('aggregate')
+def order_trends(path=loader.DATA_PATH, where=filters.NO_FILTER):
+    """The ``timeseries.DailyRollup`` of the dataset, or None when it has no order dates."""
+    if not loader.has_dates(path):
+        return None
+    rollup, = streaming.compute('order_trends', lambda: [timeseries.DailyRollup()],
+                                INSIGHTS['Trends'].columns, path, where=where)
+    return rollup
@@ -0,0 +1,201 @@
+"""Build step for the pairplots on the Data insights page.
+
+The pairplots used to be hand-made PNGs that went stale whenever the data
+changed. They are now rendered from the current dataset, one process per
+plot, and written as compressed images named after the dataset version::
+
+    python pairplots.py --workers 4
+
+Assets are WebP when Pillow was built with the WebP codec, optimized PNG
+otherwise. Datasets larger than ``PAIRPLOT_MAX_ROWS`` (default 10000, so the
+9,994-row sample is plotted in full) are sampled, stratified by the hue
+column, before plotting: a scatter panel cannot show more points usefully,
+and the sample keeps every class in proportion. The app serves the assets as
+bytes through the figure cache and renders a missing one on first use.
+"""
+import argparse
+import contextlib
+import functools
+import io
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import pandas as pd
+
+import loader
+import streaming
+
+# Insight views with a pairplot, and the asset name of each.
+PAIRPLOTS = {
+    'Ship Mode': 'Pairplot_ShipMode',
+    'Segment': 'Pairplot_Segment',
+    'Region': 'Pairplot_Region',
+    'Category': 'Pairplot_Category',
+}
+ASSET_DIR = os.environ.get('PAIRPLOT_DIR', 'assets')
+MANIFEST = 'pairplots.json'
+MAX_ROWS = int(os.environ.get('PAIRPLOT_MAX_ROWS', 10000))
+FORMATS = {'webp': 'image/webp', 'png': 'image/png'}
+PALETTE = ['red', 'blue', 'green', 'm']
+MARKERS = ['o', 's', 'P', '^']
+
+
+@functools.lru_cache(maxsize=None)
+def default_format():
+    """'webp' when Pillow can encode WebP, else 'png'."""
+    # PIL.features.check() aborts some source builds of Pillow at exit; the
+    # WebP plugin only registers its encoder when the codec is compiled in.
+    from PIL import Image
+    Image.init()
+    return 'webp' if 'WEBP' in Image.SAVE else 'png'
+
+
+def sample_rows(hue, max_rows=MAX_ROWS, path=loader.DATA_PATH, seed=0):
+    """At most about ``max_rows`` rows of the numerical columns and ``hue``, stratified by ``hue``."""
+    columns = loader.NUMERICAL_COLUMNS + [hue]
+    if streaming.out_of_core(path):
+        # Sample each chunk at the same rate rather than loading the rows.
+        import aggregates
+        frac = min(1.0, max_rows / aggregates.get_cube(path).count(['Region']).sum())
+        parts = [chunk.groupby(hue, observed=True).sample(frac=frac, random_state=seed)
+                 for chunk in streaming.iter_chunks(path, columns)]
+        df = pd.concat(parts, ignore_index=True)
+    else:
+        df = loader.load_dataset(path, columns)
+        if len(df) > max_rows:
+            df = df.groupby(hue, observed=True).sample(frac=max_rows / len(df), random_state=seed)
+    # Drop classes missing from the sample so the legend matches the panels.
+    return df.assign(**{hue: df[hue].cat.remove_unused_categories()}).reset_index(drop=True)
+
+
+def render_pairplot(hue, df, fmt=None, lock=None):
+    """Encoded image of the pairplot of ``df`` coloured by ``hue``.
+
+    ``lock`` is held while pyplot draws, for callers sharing pyplot between
+    threads; the encoding runs outside it.
+    """
+    fmt = fmt or default_format()
+    # Imported here so building the asset list does not pull in matplotlib.
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    from PIL import Image
+
+    levels = len(df[hue].cat.categories)
+    with lock or contextlib.nullcontext(), plt.style.context('dark_background'):
+        grid = sns.pairplot(df, hue=hue, palette=PALETTE[:levels], markers=MARKERS[:levels])
+        grid.figure.suptitle(f'Pairplot based on {hue}', fontsize=20, y=1.03)
+        buffer = io.BytesIO()
+        grid.figure.savefig(buffer, format='png', dpi=72, bbox_inches='tight')
+        plt.close(grid.figure)
+    image = Image.open(buffer)
+    out = io.BytesIO()
+    if fmt == 'webp':
+        image.save(out, format='WEBP', quality=80, method=6)
+    else:
+        image.convert('RGB').quantize(256).save(out, format='PNG', optimize=True)
+    return out.getvalue()
+
+
+def asset_path(hue, version, fmt=None, directory=ASSET_DIR):
+    fmt = fmt or default_format()
+    return os.path.join(directory, f'{PAIRPLOTS[hue]}-{version[:12]}.{fmt}')
+
+
+def _render_job(hue, df, fmt, lock=None):
+    start = time.perf_counter()
+    return render_pairplot(hue, df, fmt, lock), time.perf_counter() - start
+
+
+def _write(path, payload):
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(payload)
+    os.replace(tmp, path)
+
+
+def _prune(hue, keep, directory):
+    # Assets of older dataset versions are never served again.
+    prefix = PAIRPLOTS[hue] + '-'
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if name.startswith(prefix) and path != keep and not name.endswith('.tmp'):
+            os.remove(path)
+
+
+def build(hues=None, workers=None, max_rows=MAX_ROWS, fmt=None, force=False,
+          path=loader.DATA_PATH, directory=ASSET_DIR, lock=None):
+    """Render the pairplots of ``hues`` (default: all) for the current dataset version.
+
+    Assets that already exist for this version are kept unless ``force``.
+    Plots rendered in this process hold ``lock`` while pyplot draws them.
+    Returns the manifest entries of the assets built.
+    """
+    hues = list(hues or PAIRPLOTS)
+    fmt = fmt or default_format()
+    version = loader.dataset_version(path)
+    os.makedirs(directory, exist_ok=True)
+    todo = [hue for hue in hues if force or not os.path.exists(asset_path(hue, version, fmt, directory))]
+    samples = {hue: sample_rows(hue, max_rows, path) for hue in todo}
+    workers = min(workers or os.cpu_count() or 1, len(todo))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn')) as pool:
+            futures = {hue: pool.submit(_render_job, hue, samples[hue], fmt) for hue in todo}
+            rendered = {hue: future.result() for hue, future in futures.items()}
+    else:
+        rendered = {hue: _render_job(hue, samples[hue], fmt, lock) for hue in todo}
+
+    manifest_path = os.path.join(directory, MANIFEST)
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+    built = {}
+    for hue, (payload, seconds) in rendered.items():
+        target = asset_path(hue, version, fmt, directory)
+        _write(target, payload)
+        _prune(hue, target, directory)
+        built[hue] = manifest[hue] = {
+            'file': os.path.basename(target), 'version': version, 'format': fmt,
+            'bytes': len(payload), 'rows': len(samples[hue]), 'seconds': round(seconds, 3)}
+    _write(manifest_path, json.dumps(manifest, indent=2).encode())
+    return built
+
+
+def asset_bytes(hue, fmt=None, path=loader.DATA_PATH, directory=ASSET_DIR, lock=None):
+    """The encoded pairplot of ``hue`` for the current dataset, built if it is missing
+    (holding ``lock`` while pyplot draws it)."""
+    fmt = fmt or default_format()
+    target = asset_path(hue, loader.dataset_version(path), fmt, directory)
+    if not os.path.exists(target):
+        build([hue], workers=1, fmt=fmt, path=path, directory=directory, lock=lock)
+    with open(target, 'rb') as f:
+        return f.read()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Render the Data insights pairplots for the current dataset.')
+    parser.add_argument('--path', default=loader.DATA_PATH)
+    parser.add_argument('--hue', nargs='+', choices=list(PAIRPLOTS), help='default: all')
+    parser.add_argument('--workers', type=int, default=None, help='default: one per CPU')
+    parser.add_argument('--max-rows', type=int, default=MAX_ROWS, help='rows sampled for each plot')
+    parser.add_argument('--format', choices=list(FORMATS), default=None,
+                        help='default: webp when Pillow supports it, else png')
+    parser.add_argument('--force', action='store_true', help='rebuild assets that are up to date')
+    parser.add_argument('--dir', default=ASSET_DIR)
+    args = parser.parse_args(argv)
+    start = time.perf_counter()
+    built = build(args.hue, args.workers, args.max_rows, args.format, args.force, args.path, args.dir)
+    for hue, entry in built.items():
+        print(f"{hue:>10}  {entry['file']:<32} {entry['bytes'] / 1024:7.1f} KB  "
+              f"{entry['rows']:>7} rows  {entry['seconds']:6.2f} s")
+    print(f'{len(built)} pairplot(s) built in {time.perf_counter() - start:.2f} s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""Parallel aggregation over partitions of the dataset.
+
+The dataset is split into partitions (see ``streaming.partitions``) that
+worker processes read for themselves, so no rows are sent between
+processes. Each worker folds its partition into mergeable partial
+aggregates, which are small, and the parent merges them in partition order.
+
+The backend is off unless PARALLEL_WORKERS is set above 1. Results match
+the serial path up to floating point summation order.
+"""
+import functools
+import os
+from concurrent.futures.process import BrokenProcessPool
+
+import shared
+import streaming
+
+WORKERS = int(os.environ.get('PARALLEL_WORKERS', 0))
+# More partitions than workers evens out partitions that take longer.
+PARTITIONS_PER_WORKER = 2
+
+_pool = shared.ProcessPool()
+
+
+def enabled():
+    return WORKERS > 1
+
+
+def shutdown(wait=False):
+    """Stop the pool's workers (see ``shared.ProcessPool.shutdown``)."""
+    _pool.shutdown(wait)
+
+
+def _chunks(chunks, transform):
+    return chunks if transform is None else map(transform, chunks)
+
+
+def _run(func, partition, columns, transform):
+    return func(_chunks(streaming.iter_partition(partition, columns), transform))
+
+
+def _merge(left, right):
+    if isinstance(left, list):
+        return [a.merge(b) for a, b in zip(left, right)]
+    return left.merge(right)
+
+
+def map_reduce(func, path, columns=None, transform=None, workers=None):
+    """``func(chunks)`` over every partition of ``path``, merged into one result.
+
+    ``func`` takes an iterable of row chunks and returns something with a
+    ``merge`` method (or a list of such). ``func`` and ``transform`` are
+    pickled to the workers, so they must be module-level functions or
+    ``functools.partial`` objects of them. With one worker, or if the pool
+    breaks, the whole dataset is folded here instead.
+    """
+    workers = workers or WORKERS
+    if workers <= 1:
+        return func(_chunks(streaming.iter_chunks(path, columns), transform))
+    parts = streaming.partitions(path, workers * PARTITIONS_PER_WORKER)
+    try:
+        futures = [_pool.get(workers).submit(_run, func, partition, columns, transform)
+                   for partition in parts]
+        results = [future.result() for future in futures]
+    except BrokenProcessPool:
+        _pool.shutdown()
+        return func(_chunks(streaming.iter_chunks(path, columns), transform))
+    return functools.reduce(_merge, results)
+
+
+def fold(partials, path, columns=None, transform=None, workers=None):
+    """Parallel ``streaming.fold`` of the dataset into ``partials``; returns the merged partials."""
+    return map_reduce(functools.partial(streaming.fold, partials), path, columns, transform, workers)
@@ -0,0 +1,153 @@
+"""Top-K and bottom-K cities for the "Data insights → City" view.
+
+``CityRanking`` keeps per-city totals (deals, Sales, Profit) as arrays and
+answers "the K best or worst cities by a metric" with ``np.argpartition``,
+which selects in time linear in the number of cities, and then sorts only
+the K selected ones. The deepest selection asked for per (metric, side) is
+kept, so changing K (up to that depth) or switching back to a metric is a
+slice of a kept selection.
+
+Appended rows update the totals of the cities they touch, and every kept
+selection is repaired from the old selection plus those cities: a city the
+rows did not touch keeps its value, so when the new K-th value still beats
+the old one no other city can enter. Otherwise that selection is redone
+over every city. Ties are ranked in city order, like a stable sort.
+"""
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+import aggregates
+import filters
+import loader
+import shared
+
+# Metric: (column, statistic). The first one is what the view shows by default.
+METRICS = {
+    'Mean Profit': ('Profit', 'mean'),
+    'Total Profit': ('Profit', 'sum'),
+    'Total Sales': ('Sales', 'sum'),
+    'Deals': (None, 'count'),
+}
+SUMS = ['Sales', 'Profit']
+# Cities kept per selection; deeper requests select again, as deep as asked.
+DEPTH = 100
+
+
+def _select(values, k, largest):
+    # Positions of the k largest (or smallest) values, best first; ties are
+    # taken and ranked in position order.
+    keyed = -values if largest else values
+    k = min(k, len(keyed))
+    if k == 0:
+        return np.empty(0, dtype=np.intp)
+    if k < len(keyed):
+        threshold = keyed[np.argpartition(keyed, k - 1)[:k]].max()
+        better = np.flatnonzero(keyed < threshold)
+        tied = np.flatnonzero(keyed == threshold)[:k - len(better)]
+        positions = np.concatenate([better, tied])
+    else:
+        positions = np.arange(len(keyed))
+    return positions[np.lexsort((positions, keyed[positions]))]
+
+
+class CityRanking:
+    """Per-city totals with kept top/bottom selections; treat as read-only."""
+
+    def __init__(self, cities, counts, sums):
+        self.cities = cities
+        self.counts = counts
+        self.sums = sums
+        self._selections = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_cube(cls, cube):
+        table = cube.rollup(['City'])
+        cities = pd.Index(np.asarray(table.index), name='City')
+        return cls(cities, table['count']['Sales'].to_numpy(dtype=np.int64),
+                   {col: table['sum'][col].to_numpy(dtype='float64') for col in SUMS})
+
+    def values(self, metric, positions=slice(None)):
+        column, stat = METRICS[metric]
+        if stat == 'count':
+            return self.counts[positions].astype('float64')
+        if stat == 'sum':
+            return self.sums[column][positions]
+        return self.sums[column][positions] / self.counts[positions]
+
+    def _ranked(self, metric, k, largest):
+        key = (metric, largest)
+        with self._lock:
+            selection = self._selections.get(key)
+            if selection is None or len(selection) < min(k, len(self.cities)):
+                selection = self._selections[key] = _select(self.values(metric), max(k, DEPTH), largest)
+        positions = selection[:k]
+        return pd.Series(self.values(metric, positions), index=self.cities[positions], name=metric)
+
+    def top(self, metric, k):
+        """The ``k`` cities with the highest ``metric``, highest first."""
+        return self._ranked(metric, k, True)
+
+    def bottom(self, metric, k):
+        """The ``k`` cities with the lowest ``metric``, lowest first."""
+        return self._ranked(metric, k, False)
+
+    def merged(self, rows):
+        """A ranking that also counts ``rows``; this one is left as it is."""
+        grouped = rows.groupby('City', observed=True)
+        counts, sums = grouped.size(), grouped[SUMS].sum()
+        # New cities go in at their sorted place, so positions stay in city
+        # order; ``moved`` maps the old positions to the new ones.
+        cities = self.cities.union(pd.Index(np.asarray(counts.index), name='City'))
+        moved = cities.get_indexer(self.cities)
+        touched = cities.get_indexer(counts.index)
+        ranking = CityRanking(cities, np.zeros(len(cities), dtype=np.int64),
+                              {col: np.zeros(len(cities)) for col in SUMS})
+        ranking.counts[moved] = self.counts
+        for col in SUMS:
+            ranking.sums[col][moved] = self.sums[col]
+        ranking.counts[touched] += counts.to_numpy()
+        for col in SUMS:
+            ranking.sums[col][touched] += sums[col].to_numpy()
+        with self._lock:
+            selections = dict(self._selections)
+        for (metric, largest), selection in selections.items():
+            ranking._selections[metric, largest] = ranking._repair(
+                metric, largest, moved[selection], self.values(metric, selection[-1:]), touched)
+        return ranking
+
+    def _repair(self, metric, largest, selection, old_last, touched):
+        # Reselect among the old selection and the touched cities; exact when
+        # the new last value is strictly better than the old last one.
+        candidates = np.union1d(selection, touched)
+        values = self.values(metric, candidates)
+        chosen = candidates[_select(values, len(selection), largest)]
+        if len(chosen) and len(old_last):
+            last = self.values(metric, chosen[-1:])[0]
+            if last > old_last[0] if largest else last < old_last[0]:
+                return chosen
+        return _select(self.values(metric), len(selection), largest)
+
+
+_rankings = shared.SharedStore(int(os.environ.get('SHARED_RANKINGS_MB', 64)) << 20)
+
+
+def get_ranking(path=loader.DATA_PATH, where=filters.NO_FILTER):
+    """The ``CityRanking`` of the rows of ``path`` passing ``where``, shared by every session."""
+    path = os.path.abspath(path)
+    version = loader.dataset_version(path)
+    return _rankings.get_or_compute((path, version, where),
+                                    lambda: CityRanking.from_cube(aggregates.get_cube(path, where)))
+
+
+def append_rows(rows, old_version, new_version, path=loader.DATA_PATH):
+    """Fold appended ``rows`` into the rankings kept for ``old_version``."""
+    path = os.path.abspath(path)
+    for (source, version, where), ranking in _rankings.items():
+        if (source, version) != (path, old_version):
+            continue
+        batch = filters.filter_chunk(where, None, rows) if where.active else rows
+        _rankings.put((path, new_version, where), ranking.merged(batch) if len(batch) else ranking)
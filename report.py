@@ -0,0 +1,436 @@
+"""Headless export of every dashboard view to an HTML and PPTX report.
+
+    python report.py --out report --format html pptx --workers 4
+
+The report runs the dashboard's own page code (``app.main``) once per view
+with ``HeadlessPage`` standing in for the Streamlit module, so it needs no
+Streamlit server and shows exactly what the dashboard shows. Widgets take
+their default values.
+
+The shared aggregates (dataset snapshot, cube, pairplot assets) are built
+once up front and persisted, then the views are rendered concurrently in
+worker processes. Every chart is timed from the previous output of its view
+to the chart itself, which covers computing and drawing it; the timings are
+also written to ``timings.json`` for tracking build time as data grows.
+"""
+import argparse
+import base64
+import html
+import importlib.util
+import io
+import json
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+
+import aggregates
+import drilldown
+import loader
+import pairplots
+import parallel
+
+FORMATS = ['html', 'pptx']
+
+
+class _Section:
+    open = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class _Sidebar:
+    """Sidebar widgets answer for the page; sidebar text is left out of the report."""
+
+    def __init__(self, page):
+        self.radio = page.radio
+        self.selectbox = page.selectbox
+        self.slider = page.slider
+        self.multiselect = page.multiselect
+        self.checkbox = page.checkbox
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+class HeadlessPage:
+    """Stands in for the ``streamlit`` module while one view is rendered.
+
+    ``choices`` are the sidebar labels that select the view; other widgets
+    return their defaults. Output is collected in ``blocks``.
+    """
+
+    def __init__(self, choices):
+        self.choices = list(choices)
+        self.blocks = []
+        self.sidebar = _Sidebar(self)
+        self._mark = time.perf_counter()
+
+    def _pick(self, options):
+        options = list(options)
+        for choice in self.choices:
+            if choice in options:
+                return choice
+        return options[0]
+
+    def _add(self, block):
+        now = time.perf_counter()
+        block['seconds'] = now - self._mark
+        self._mark = now
+        self.blocks.append(block)
+
+    def _title(self):
+        for block in reversed(self.blocks):
+            if block['kind'] == 'heading':
+                return block['text']
+        return ''
+
+    # Widgets
+    def radio(self, label, options, *args, **kwargs):
+        return self._pick(options)
+
+    def selectbox(self, label, options, *args, **kwargs):
+        return self._pick(options)
+
+    def slider(self, label, min_value=None, max_value=None, value=None, *args, **kwargs):
+        return value
+
+    def multiselect(self, label, options, default=None, *args, **kwargs):
+        return list(default or [])
+
+    def checkbox(self, label, value=False, *args, **kwargs):
+        return value
+
+    def expander(self, label, *args, **kwargs):
+        # Sections are expanded, under their label.
+        self._heading(label, 4)
+        return _Section()
+
+    def set_option(self, *args, **kwargs):
+        pass
+
+    # Text
+    def _heading(self, text, level):
+        self._add({'kind': 'heading', 'level': level, 'text': str(text)})
+
+    def title(self, text, *args, **kwargs):
+        self._heading(text, 1)
+
+    def header(self, text, *args, **kwargs):
+        self._heading(text, 2)
+
+    def subheader(self, text, *args, **kwargs):
+        self._heading(text, 3)
+
+    def write(self, *args, **kwargs):
+        text = ' '.join(str(arg) for arg in args).strip()
+        if text.startswith('#'):
+            self._heading(text.lstrip('#').strip(), min(text.index(' ') if ' ' in text else 1, 4))
+        elif text:
+            self._add({'kind': 'text', 'text': text})
+
+    def markdown(self, body, unsafe_allow_html=False, *args, **kwargs):
+        self._add({'kind': 'html' if unsafe_allow_html else 'text', 'text': body})
+
+    def caption(self, text, *args, **kwargs):
+        self._add({'kind': 'text', 'text': str(text)})
+
+    def info(self, body, *args, **kwargs):
+        self._add({'kind': 'text', 'text': str(body)})
+
+    def warning(self, body, *args, **kwargs):
+        self._add({'kind': 'text', 'text': str(body)})
+
+    def dataframe(self, data, *args, **kwargs):
+        self._add({'kind': 'table', 'rows': len(data),
+                   'html': data.head(10).to_html(border=0, classes='table')})
+
+    # Charts
+    def image(self, image, *args, **kwargs):
+        fmt = 'webp' if image[:4] == b'RIFF' else 'png'
+        self._add({'kind': 'image', 'title': self._title(), 'format': fmt, 'data': image})
+
+    def plotly_chart(self, fig, *args, **kwargs):
+        title = fig.layout.title.text or self._title()
+        self._add({'kind': 'plotly', 'title': title, 'json': fig.to_json()})
+
+
+class _Sessions:
+    """Module stand-in forwarding to the ``HeadlessPage`` of the calling thread,
+    so views can be rendered in threads at once, like Streamlit sessions."""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def __getattr__(self, name):
+        return getattr(self._local.page, name)
+
+
+_sessions = _Sessions()
+
+
+def views():
+    """Sidebar choices of every view of the dashboard, in sidebar order."""
+    import app
+    result = []
+    for nav in app.NAV:
+        if nav != 'Home':
+            result.append([nav])
+            continue
+        for page in app.HOME_PAGES:
+            if page == 'Data insights':
+                result.extend(['Home', page, view] for view in app.INSIGHT_VIEWS)
+            else:
+                result.append(['Home', page])
+    return result
+
+
+def render_view(choices, shutdown=True):
+    """Run ``app.main`` for one view headlessly; returns its blocks and time.
+
+    Safe to call from several threads at once. ``shutdown`` stops the worker
+    pools afterwards, which pool workers must do before they exit.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import app
+    page = HeadlessPage(choices)
+    app.st = _sessions
+    _sessions._local.page = page
+    start = time.perf_counter()
+    try:
+        app.main()
+    finally:
+        app.end_rerun()
+        _sessions._local.page = None
+        if shutdown:
+            drilldown.shutdown()
+            parallel.shutdown()
+    seconds = time.perf_counter() - start
+    # The banner above the navigation is the same on every view.
+    first = next((i for i, block in enumerate(page.blocks) if block['kind'] == 'heading'), 0)
+    return {'view': ' / '.join(choices[1:] or choices), 'blocks': page.blocks[first:], 'seconds': seconds}
+
+
+def prepare(workers=None):
+    """Build the aggregates every view shares, once, before rendering."""
+    timings = {}
+    start = time.perf_counter()
+    loader.dataset_version()
+    aggregates.get_cube()
+    timings['cube'] = time.perf_counter() - start
+    start = time.perf_counter()
+    pairplots.build(workers=workers)
+    timings['pairplots'] = time.perf_counter() - start
+    return timings
+
+
+def render_views(view_choices, workers=None):
+    workers = min(workers or os.cpu_count() or 1, len(view_choices))
+    if workers <= 1:
+        return [render_view(choices) for choices in view_choices]
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn')) as pool:
+        return list(pool.map(render_view, view_choices))
+
+
+def chart_timings(rendered):
+    return [{'view': view['view'], 'chart': block['title'], 'kind': block['kind'],
+             'seconds': round(block['seconds'], 4),
+             'bytes': len(block.get('data') or block.get('json') or '')}
+            for view in rendered for block in view['blocks']
+            if block['kind'] in ('image', 'plotly')]
+
+
+def write_html(rendered, path, plotlyjs='inline'):
+    import plotly.offline
+    if plotlyjs == 'inline':
+        script = f'<script>{plotly.offline.get_plotlyjs()}</script>'
+    else:
+        script = '<script src="https://cdn.plot.ly/plotly-2.35.2.min.js"></script>'
+    parts = ['<!DOCTYPE html><html><head><meta charset="utf-8"><title>EDA - Retail report</title>',
+             script,
+             '<style>body{background:#111;color:#eee;font-family:sans-serif;margin:2em}'
+             'img{max-width:100%}.table{color:#eee;border-collapse:collapse}'
+             '.table td,.table th{padding:2px 8px}.timing{color:#888;font-size:small}</style>',
+             '</head><body>', '<h1>Exploratory Data Analysis - Retail</h1>']
+    charts = 0
+    for view in rendered:
+        parts.append(f'<section><h1>{html.escape(view["view"])}</h1>')
+        for block in view['blocks']:
+            kind = block['kind']
+            if kind == 'heading':
+                level = block['level'] + 1
+                parts.append(f'<h{level}>{html.escape(block["text"])}</h{level}>')
+            elif kind == 'text':
+                parts.append(f'<p>{html.escape(block["text"])}</p>')
+            elif kind == 'html':
+                parts.append(block['text'])
+            elif kind == 'table':
+                parts.append(block['html'] + f'<p class="timing">{block["rows"]} rows</p>')
+            elif kind == 'image':
+                data = base64.b64encode(block['data']).decode()
+                parts.append(f'<img src="data:image/{block["format"]};base64,{data}">')
+            elif kind == 'plotly':
+                charts += 1
+                parts.append(f'<div id="chart{charts}"></div><script>'
+                             f'(function(f){{Plotly.newPlot("chart{charts}",f.data,f.layout)}})({block["json"]})'
+                             '</script>')
+            if kind in ('image', 'plotly'):
+                parts.append(f'<p class="timing">{block["seconds"]:.3f} s</p>')
+        parts.append('</section>')
+    parts.append('</body></html>')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(parts))
+
+
+def _plotly_png(fig):
+    # Static export of a Plotly chart: kaleido when it can start its
+    # browser, else the bar, line and scatter traces redrawn with matplotlib.
+    if importlib.util.find_spec('kaleido') is not None:
+        import plotly.io as pio
+        try:
+            return pio.to_image(fig, format='png', width=1200, height=600)
+        except Exception:
+            pass
+    return _matplotlib_png(fig)
+
+
+def _array(values):
+    # Plotly JSON stores numeric arrays base64-encoded, as {'dtype', 'bdata'}.
+    if isinstance(values, dict) and 'bdata' in values:
+        array = np.frombuffer(base64.b64decode(values['bdata']), dtype=values['dtype'])
+        return array.reshape(values['shape']) if 'shape' in values else array
+    return np.asarray(values)
+
+
+def _matplotlib_png(fig):
+    # None for traces this does not draw (e.g. choropleths).
+    from matplotlib.figure import Figure
+    if not fig.data or any(trace.type not in ('bar', 'scatter', 'scattergl') for trace in fig.data):
+        return None
+    import matplotlib.style
+    with matplotlib.style.context('dark_background'):
+        figure = Figure(figsize=(12, 6), dpi=100)
+        ax = figure.subplots()
+        bars = [trace for trace in fig.data if trace.type == 'bar' and trace.width is None]
+        for trace in fig.data:
+            y = _array(trace.y)
+            x = _array(trace.x) if trace.x is not None else np.arange(len(y))
+            if trace.type == 'bar' and trace.width is not None:
+                # Histogram bins: left edges and widths.
+                ax.bar(x, y, width=_array(trace.width), align='edge', label=trace.name)
+            elif trace.type == 'bar':
+                # Categorical bars, side by side when there are several traces.
+                i, width = bars.index(trace), 0.8 / len(bars)
+                ax.bar(np.arange(len(x)) + (i - (len(bars) - 1) / 2) * width, y, width=width, label=trace.name)
+                ax.set_xticks(np.arange(len(x)), [str(value) for value in x], rotation=90)
+            elif trace.mode and 'lines' not in trace.mode:
+                ax.scatter(x, y, s=8, label=trace.name)
+            else:
+                if x.dtype.kind in 'OU':
+                    # Order dates come back as ISO strings.
+                    x = x.astype('datetime64[ns]')
+                ax.plot(x, y, label=trace.name)
+        layout = fig.layout
+        ax.set_title(layout.title.text or '')
+        ax.set_xlabel(layout.xaxis.title.text or '')
+        ax.set_ylabel(layout.yaxis.title.text or '')
+        if len(fig.data) > 1:
+            ax.legend()
+        out = io.BytesIO()
+        figure.savefig(out, format='png', bbox_inches='tight')
+    return out.getvalue()
+
+
+def _picture(block):
+    # PNG bytes for a slide, or None when the chart cannot be rasterized.
+    if block['kind'] == 'image':
+        if block['format'] == 'png':
+            return block['data']
+        from PIL import Image
+        out = io.BytesIO()
+        try:
+            Image.open(io.BytesIO(block['data'])).save(out, format='PNG')
+        except OSError:
+            # A WebP asset this Pillow build cannot decode.
+            return None
+        return out.getvalue()
+    import plotly.io as pio
+    return _plotly_png(pio.from_json(block['json']))
+
+
+def write_pptx(rendered, path, html_name=None):
+    from pptx import Presentation
+    from pptx.util import Inches, Pt
+    from PIL import Image
+
+    deck = Presentation()
+    deck.slide_width, deck.slide_height = Inches(13.333), Inches(7.5)
+    title_layout, blank_layout = deck.slide_layouts[0], deck.slide_layouts[6]
+    slide = deck.slides.add_slide(title_layout)
+    slide.shapes.title.text = 'Exploratory Data Analysis - Retail'
+    slide.placeholders[1].text = time.strftime('Report built %Y-%m-%d %H:%M')
+
+    for view in rendered:
+        charts = [block for block in view['blocks'] if block['kind'] in ('image', 'plotly')]
+        if not charts:
+            continue
+        for block in charts:
+            slide = deck.slides.add_slide(blank_layout)
+            box = slide.shapes.add_textbox(Inches(0.4), Inches(0.2), Inches(12.5), Inches(0.7))
+            box.text_frame.text = f'{view["view"]}: {block["title"]}'
+            box.text_frame.paragraphs[0].runs[0].font.size = Pt(20)
+            picture = _picture(block)
+            if picture is None:
+                note = slide.shapes.add_textbox(Inches(0.4), Inches(3), Inches(12.5), Inches(1))
+                note.text_frame.text = f'Interactive chart: see {html_name or "the HTML report"}.'
+                continue
+            width, height = Image.open(io.BytesIO(picture)).size
+            scale = min(12.5 / width, 6.3 / height)
+            slide.shapes.add_picture(io.BytesIO(picture), Inches(0.4), Inches(1.0),
+                                     Inches(width * scale), Inches(height * scale))
+    deck.save(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Export every dashboard view to a report, without a Streamlit server.')
+    parser.add_argument('--out', default='report', help='output directory')
+    parser.add_argument('--format', nargs='+', choices=FORMATS, default=FORMATS)
+    parser.add_argument('--workers', type=int, default=None, help='default: one per CPU')
+    parser.add_argument('--plotlyjs', choices=['inline', 'cdn'], default='inline',
+                        help='embed plotly.js in the HTML or load it from the CDN')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    timings = prepare(args.workers)
+    view_choices = views()
+    rendered = render_views(view_choices, args.workers)
+    timings['render'] = time.perf_counter() - start - sum(timings.values())
+
+    os.makedirs(args.out, exist_ok=True)
+    if 'html' in args.format:
+        write_html(rendered, os.path.join(args.out, 'report.html'), args.plotlyjs)
+    if 'pptx' in args.format:
+        write_pptx(rendered, os.path.join(args.out, 'report.pptx'), 'report.html')
+    timings['total'] = time.perf_counter() - start
+    charts = chart_timings(rendered)
+    with open(os.path.join(args.out, 'timings.json'), 'w') as f:
+        json.dump({'dataset_version': loader.dataset_version(), 'stages': timings,
+                   'views': [{'view': view['view'], 'seconds': view['seconds']} for view in rendered],
+                   'charts': charts}, f, indent=2)
+
+    for chart in charts:
+        print(f"{chart['seconds']:8.3f} s  {chart['view']:<28} {chart['chart']}")
+    print(f"{len(charts)} charts from {len(rendered)} views in {timings['total']:.1f} s "
+          f"(shared aggregates {timings['cube'] + timings['pairplots']:.1f} s)")
+
+
+if __name__ == '__main__':
+    main()
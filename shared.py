@@ -0,0 +1,199 @@
+"""Results shared by every session of the app.
+
+Streamlit runs the reruns of every session in threads of one process, so
+analysts opening the same view at once would each compute the same
+aggregates. ``SingleFlight`` coalesces concurrent identical requests: the
+first caller for a key computes it and later callers wait for that result
+instead of starting their own, while different keys compute side by side.
+``SharedStore`` keeps the results in a process-wide LRU bounded by their
+approximate size in bytes, and ``ProcessPool`` is a worker pool started
+once per process and reused by every session.
+
+Keys carry the dataset version, so results of an old version are never
+served again and age out. SHARED_COALESCE=0 turns coalescing off (every
+caller computes), for comparison in ``benchmark.py users``.
+"""
+import os
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+import pandas as pd
+
+COALESCE = os.environ.get('SHARED_COALESCE', '1') != '0'
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    """At most one computation per key at a time; concurrent callers share its result."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.coalesced = 0
+
+    def do(self, key, compute):
+        """``compute()``, or the result of the call already computing ``key``.
+
+        An exception raised by the computing call is raised in every caller
+        that waited for it.
+        """
+        if not COALESCE:
+            return compute()
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+        try:
+            call.value = compute()
+        except BaseException as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.value
+
+
+def sizeof(value, _seen=None):
+    """Approximate bytes held by ``value``: frames, arrays and containers or objects holding them."""
+    seen = set() if _seen is None else _seen
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=False).sum())
+    if isinstance(value, (pd.Series, pd.Index)):
+        return int(value.memory_usage(deep=False))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (bytes, bytearray, str)):
+        return sys.getsizeof(value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(sizeof(k, seen) + sizeof(v, seen) for k, v in value.items())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return sys.getsizeof(value) + sum(sizeof(item, seen) for item in value)
+    if hasattr(value, '__dict__') and not callable(value):
+        return sys.getsizeof(value) + sizeof(vars(value), seen)
+    return sys.getsizeof(value)
+
+
+class SharedStore:
+    """Process-wide LRU of computed results, bounded by ``max_bytes``.
+
+    ``get_or_compute`` coalesces concurrent misses of the same key. A result
+    larger than the whole budget is returned but not kept.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._size = 0
+        self._flight = SingleFlight()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return entry[0]
+
+    def put(self, key, value):
+        size = sizeof(value)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= old[1]
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (value, size)
+            self._size += size
+            while self._size > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._size -= evicted
+                self._stats['evictions'] += 1
+
+    def get_or_compute(self, key, compute):
+        """The stored result for ``key``, computing (and storing) it on a miss."""
+        missing = object()
+        value = self.get(key, missing)
+        if value is not missing:
+            return value
+
+        def run():
+            # A call that finished between the miss and this flight stored it.
+            value = self.get(key, missing)
+            if value is missing:
+                with self._lock:
+                    self._stats['misses'] += 1
+                value = compute()
+                self.put(key, value)
+            return value
+        return self._flight.do(key, run)
+
+    def items(self):
+        with self._lock:
+            return [(key, value) for key, (value, _) in self._entries.items()]
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, coalesced=self._flight.coalesced,
+                        entries=len(self._entries), bytes=self._size)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+class ProcessPool:
+    """A spawn process pool, started on first use and reused across reruns.
+
+    ``get(workers)`` returns the pool, restarting it when the number of
+    workers changes. After ``shutdown`` (e.g. when the pool broke) the next
+    ``get`` starts a new one.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._workers = 0
+
+    def get(self, workers):
+        with self._lock:
+            if self._executor is None or self._workers != workers:
+                if self._executor is not None:
+                    self._executor.shutdown(wait=False)
+                self._executor = ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn'))
+                self._workers = workers
+            return self._executor
+
+    def shutdown(self, wait=False):
+        """Stop the pool's workers. A process that is itself a pool worker must
+        call this before it exits, since it waits for its children first."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=not wait)
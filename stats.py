@@ -0,0 +1,317 @@
+"""Mergeable partial aggregates.
+
+Every partial here is updated with chunks of rows and can be merged with
+another partial of the same kind. A result can therefore be built from a
+stream of chunks, from parallel partitions or from appended batches without
+ever holding all the rows, and merging in any order gives the same answer
+(up to floating point rounding).
+"""
+import copy
+
+import numpy as np
+import pandas as pd
+
+
+class GroupSums:
+    """Sums and row counts of ``metrics`` per group of ``keys``.
+
+    Covers ``groupby(keys)[metrics].sum()``, ``.mean()``, ``.size()`` and
+    ``value_counts``. Group labels are kept as plain values so chunks with
+    different categorical dictionaries merge cleanly.
+    """
+
+    def __init__(self, keys, metrics):
+        self.keys = list(keys)
+        self.metrics = list(metrics)
+        self.table = None
+
+    def update(self, df):
+        grouped = df.groupby(self.keys, observed=True, sort=False)
+        part = grouped[self.metrics].sum().astype('float64')
+        part['count'] = grouped.size()
+        if isinstance(part.index, pd.MultiIndex):
+            part.index = pd.MultiIndex.from_tuples(part.index, names=self.keys)
+        else:
+            part.index = pd.Index(part.index.to_numpy(dtype=object), name=self.keys[0])
+        self._add(part)
+        return self
+
+    def _add(self, part):
+        if self.table is None:
+            self.table = part
+            return
+        levels = list(range(len(self.keys)))
+        self.table = pd.concat([self.table, part]).groupby(level=levels, sort=False).sum()
+
+    def merge(self, other):
+        result = copy.copy(self)
+        if other.table is not None:
+            result._add(other.table)
+        return result
+
+    def _result(self):
+        if self.table is None:
+            return pd.DataFrame(columns=self.metrics + ['count'], dtype='float64')
+        return self.table.sort_index()
+
+    def sum(self):
+        return self._result()[self.metrics]
+
+    def count(self):
+        return self._result()['count'].astype('int64').rename('count')
+
+    def mean(self):
+        """Means of ``metrics`` per group, with the group's ``count`` alongside."""
+        table = self._result()
+        means = table[self.metrics].div(table['count'], axis=0)
+        means['count'] = table['count'].astype('int64')
+        return means
+
+    def value_counts(self):
+        return self.count().sort_values(ascending=False, kind='stable')
+
+
+class Moments:
+    """Count, means and co-moments of numeric columns.
+
+    Chunks are combined with the pairwise update of Chan et al., which stays
+    accurate where summing raw squares would cancel. Rows with a missing
+    value in any column are skipped.
+    """
+
+    def __init__(self, columns):
+        self.columns = list(columns)
+        self.count = 0
+        self.mean = np.zeros(len(self.columns))
+        self.comoment = np.zeros((len(self.columns), len(self.columns)))
+
+    def update(self, df):
+        values = df[self.columns].to_numpy(dtype='float64')
+        values = values[~np.isnan(values).any(axis=1)]
+        if len(values):
+            mean = values.mean(axis=0)
+            centered = values - mean
+            self._combine(len(values), mean, centered.T @ centered)
+        return self
+
+    def _combine(self, count, mean, comoment):
+        if not count:
+            return
+        total = self.count + count
+        delta = mean - self.mean
+        self.comoment = self.comoment + comoment + np.outer(delta, delta) * (self.count * count / total)
+        self.mean = self.mean + delta * (count / total)
+        self.count = total
+
+    def merge(self, other):
+        result = copy.copy(self)
+        result._combine(other.count, other.mean, other.comoment)
+        return result
+
+    def cov(self):
+        return pd.DataFrame(self.comoment / (self.count - 1), index=self.columns, columns=self.columns)
+
+    def corr(self):
+        """Pearson correlation matrix, like ``df[columns].corr()``."""
+        std = np.sqrt(np.diag(self.comoment))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            corr = self.comoment / np.outer(std, std)
+        return pd.DataFrame(corr, index=self.columns, columns=self.columns)
+
+
+class Histogram:
+    """Sparse fixed-width histogram whose bin width doubles as needed.
+
+    Bin ``i`` covers ``[i * width, (i + 1) * width)`` with
+    ``width = base * 2 ** scale``. When more than ``max_bins`` bins are
+    occupied the width is doubled by merging neighbouring bins, so any two
+    histograms with the same ``base`` can be merged exactly by coarsening
+    the finer one.
+    """
+
+    def __init__(self, base=2.0 ** -10, max_bins=4096):
+        self.base = base
+        self.max_bins = max_bins
+        self.scale = 0
+        self.bins = np.empty(0, dtype=np.int64)
+        self.counts = np.empty(0, dtype=np.int64)
+        self.min = np.inf
+        self.max = -np.inf
+
+    @property
+    def width(self):
+        return self.base * 2.0 ** self.scale
+
+    @property
+    def count(self):
+        return int(self.counts.sum())
+
+    def update(self, values):
+        values = np.asarray(values, dtype='float64')
+        values = values[np.isfinite(values)]
+        if not len(values):
+            return self
+        low, high = min(self.min, values.min()), max(self.max, values.max())
+        # Pick a width at which the combined range fits in max_bins up front,
+        # instead of binning finely and coarsening repeatedly.
+        span = (high - low) / (self.base * self.max_bins)
+        if span > 1:
+            self._coarsen(max(self.scale, int(np.ceil(np.log2(span)))))
+        bins, counts = np.unique(np.floor(values / self.width).astype(np.int64), return_counts=True)
+        self._add(bins, counts)
+        self.min, self.max = low, high
+        return self
+
+    def _coarsen(self, scale):
+        if scale > self.scale:
+            self.bins, self.counts = _combine(self.bins >> (scale - self.scale), self.counts)
+            self.scale = scale
+
+    def _add(self, bins, counts):
+        self.bins, self.counts = _combine(np.concatenate([self.bins, bins]),
+                                          np.concatenate([self.counts, counts]))
+        while len(self.bins) > self.max_bins:
+            self._coarsen(self.scale + 1)
+
+    def merge(self, other):
+        if other.base != self.base:
+            raise ValueError('histograms with different bases cannot be merged')
+        result = copy.copy(self)
+        scale = max(self.scale, other.scale)
+        result._coarsen(scale)
+        result._add(other.bins >> (scale - other.scale), other.counts)
+        result.min, result.max = min(self.min, other.min), max(self.max, other.max)
+        return result
+
+    def dense(self, max_bins=50):
+        """``(edges, counts)`` over the occupied range with at most ``max_bins`` bins."""
+        if not len(self.bins):
+            return np.empty(0), np.empty(0, dtype=np.int64)
+        scale = self.scale
+        while (self.bins[-1] >> (scale - self.scale)) - (self.bins[0] >> (scale - self.scale)) >= max_bins:
+            scale += 1
+        bins = self.bins >> (scale - self.scale)
+        first = bins[0]
+        counts = np.bincount(bins - first, weights=self.counts).astype(np.int64)
+        width = self.base * 2.0 ** scale
+        edges = (first + np.arange(len(counts) + 1)) * width
+        return edges, counts
+
+    def quantile(self, q):
+        """Approximate quantile, interpolated within a bin; off by at most one bin width."""
+        if not len(self.bins):
+            return np.nan
+        cumulative = np.cumsum(self.counts)
+        rank = q * cumulative[-1]
+        i = min(int(np.searchsorted(cumulative, rank, side='left')), len(self.bins) - 1)
+        before = cumulative[i - 1] if i else 0
+        fraction = (rank - before) / self.counts[i]
+        value = (self.bins[i] + fraction) * self.width
+        return float(np.clip(value, self.min, self.max))
+
+    def median(self):
+        return self.quantile(0.5)
+
+
+class Histograms:
+    """One ``Histogram`` per column of ``columns``."""
+
+    def __init__(self, columns, **options):
+        self.histograms = {col: Histogram(**options) for col in columns}
+
+    def update(self, df):
+        for col, histogram in self.histograms.items():
+            histogram.update(df[col].to_numpy())
+        return self
+
+    def merge(self, other):
+        result = copy.copy(self)
+        result.histograms = {col: histogram.merge(other.histograms[col])
+                             for col, histogram in self.histograms.items()}
+        return result
+
+    def __getitem__(self, col):
+        return self.histograms[col]
+
+
+class GroupHistograms:
+    """One ``Histogram`` of ``value`` per group of ``key`` (a column or a list of columns)."""
+
+    def __init__(self, key, value, **options):
+        self.key = key
+        self.value = value
+        self.options = options
+        self.histograms = {}
+
+    def _histogram(self, group):
+        if group not in self.histograms:
+            self.histograms[group] = Histogram(**self.options)
+        return self.histograms[group]
+
+    def update(self, df):
+        for group, values in df.groupby(self.key, observed=True)[self.value]:
+            self._histogram(group).update(values.to_numpy())
+        return self
+
+    def merge(self, other):
+        result = copy.copy(self)
+        result.histograms = dict(self.histograms)
+        for group, histogram in other.histograms.items():
+            mine = result.histograms.get(group)
+            result.histograms[group] = histogram if mine is None else mine.merge(histogram)
+        return result
+
+    def quantile(self, q):
+        return pd.Series({group: h.quantile(q) for group, h in sorted(self.histograms.items())},
+                         name=self.value, dtype='float64').rename_axis(self.key)
+
+    def median(self):
+        return self.quantile(0.5)
+
+
+class Distinct:
+    """Distinct values of ``columns``, tracked only up to ``limit`` per column.
+
+    Enough to tell low-cardinality (discrete) columns from continuous ones
+    without keeping every value of the continuous ones.
+    """
+
+    def __init__(self, columns, limit=25):
+        self.columns = list(columns)
+        self.limit = limit
+        self.values = {col: set() for col in self.columns}
+
+    def _add(self, col, values):
+        seen = self.values[col]
+        if seen is not None:
+            seen.update(values)
+            if len(seen) >= self.limit:
+                self.values[col] = None
+
+    def update(self, df):
+        for col in self.columns:
+            if self.values[col] is not None:
+                self._add(col, df[col].unique())
+        return self
+
+    def merge(self, other):
+        result = copy.copy(self)
+        result.values = {col: None if seen is None else set(seen) for col, seen in self.values.items()}
+        for col, seen in other.values.items():
+            if seen is None:
+                result.values[col] = None
+            else:
+                result._add(col, seen)
+        return result
+
+    def below_limit(self):
+        """Columns with fewer than ``limit`` distinct values."""
+        return [col for col in self.columns if self.values[col] is not None]
+
+
+def _combine(bins, counts):
+    # Sum the counts of equal bins; returns sorted unique bins.
+    if not len(bins):
+        return bins, counts
+    unique, inverse = np.unique(bins, return_inverse=True)
+    return unique, np.bincount(inverse, weights=counts, minlength=len(unique)).astype(np.int64)
@@ -0,0 +1,241 @@
+"""Materialized aggregate store: the cube's cuboids in a SQLite file.
+
+``materialize`` writes the ``AggregateCube`` of a dataset version into
+``<dataset>.aggregates.sqlite``, one row per cuboid cell with the sum, count,
+min and max of every metric. ``query`` then answers "``stat`` of ``metrics``
+by ``keys``" with one GROUP BY over the cells of a single dimension, without
+reading the rows or loading the cube. The dashboard (``AGGREGATE_STORE``),
+``api.py`` and batch jobs read the same file. Any process that finds it
+behind the dataset rewrites it.
+
+Connections come from a pool per file (``STORE_POOL_SIZE``, default 4)
+shared by every thread. The file is in WAL mode, so readers keep answering
+from the previous version while a new one is written. Query results are kept
+per version in a ``shared.SharedStore`` (``STORE_CACHE_MB``, default 64).
+"""
+import contextlib
+import functools
+import os
+import queue
+import sqlite3
+import threading
+
+import numpy as np
+import pandas as pd
+
+import aggregates
+import instrument
+import loader
+import shared
+
+STORE_SUFFIX = '.aggregates.sqlite'
+POOL_SIZE = int(os.environ.get('STORE_POOL_SIZE', 4))
+STATS = ['mean'] + aggregates.STATS
+KEYS = aggregates.DIMENSIONS + aggregates.CUBE_KEYS
+# Cells columns of the keys; every dimension's values share the `value` column.
+_KEY_COLUMNS = {'Discount': 'discount', 'Sub-Category': 'sub_category'}
+_STAT_COLUMNS = [(stat, metric) for stat in aggregates.STATS for metric in aggregates.METRICS]
+# Group the cells of this dimension when no dimension is asked for: every
+# dimension's cells cover all rows, and it has the fewest values.
+_ANY_DIMENSION = 'Segment'
+
+
+class ConnectionPool:
+    """At most ``size`` connections to one SQLite file, reused across threads."""
+
+    def __init__(self, database, size=POOL_SIZE):
+        self.database = database
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _connect(self):
+        # Autocommit: writers open their transactions explicitly.
+        conn = sqlite3.connect(self.database, timeout=60, check_same_thread=False, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    @contextlib.contextmanager
+    def connection(self):
+        """A connection for this thread's exclusive use until the block exits."""
+        with self._slots:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
+            try:
+                yield conn
+            finally:
+                if conn.in_transaction:
+                    conn.rollback()
+                self._idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+_pools_lock = threading.Lock()
+_pools = {}
+_writes = shared.SingleFlight()
+_results = shared.SharedStore(int(os.environ.get('STORE_CACHE_MB', 64)) << 20)
+# Version known to be in each store file, so queries skip reading it back.
+_stored = {}
+
+
+def store_path(path=loader.DATA_PATH):
+    return os.path.splitext(path)[0] + STORE_SUFFIX
+
+
+def pool(database):
+    with _pools_lock:
+        if database not in _pools:
+            _pools[database] = ConnectionPool(database)
+        return _pools[database]
+
+
+def _read_version(conn):
+    try:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+    except sqlite3.OperationalError:
+        # No store written yet.
+        return None
+    return row[0] if row else None
+
+
+def _cells(cube):
+    # Rows of the cells table: dimension, value, discount, sub_category, then the stats.
+    for dim, cuboid in cube.cuboids.items():
+        index = cuboid.index
+        # Discount is read as float64, so its levels are the decimals in the
+        # file (0.2, not a float32 expansion like 0.20000000298).
+        discounts = index.get_level_values('Discount').to_numpy(dtype='float64').tolist()
+        stats = cuboid[_STAT_COLUMNS].to_numpy(dtype='float64').tolist()
+        yield from ((dim, str(value), discount, str(sub), *values) for value, discount, sub, values in
+                    zip(index.get_level_values(dim), discounts, index.get_level_values('Sub-Category'), stats))
+
+
+def materialize(path=loader.DATA_PATH):
+    """Write the cube of the current version of ``path`` to its store, unless
+    the store already has it; returns the version."""
+    path = os.path.abspath(path)
+    version = loader.dataset_version(path)
+    database = store_path(path)
+    if _stored.get(database) == version:
+        return version
+
+    def write():
+        with pool(database).connection() as conn:
+            if _read_version(conn) != version:
+                cube = aggregates.get_cube(path)
+                with instrument.span('materialize_store', 'aggregate'):
+                    conn.execute('BEGIN IMMEDIATE')
+                    # Another process may have written it while this one waited.
+                    if _read_version(conn) != version:
+                        stats = ', '.join(f'"{stat}_{metric}" REAL' for stat, metric in _STAT_COLUMNS)
+                        conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+                        conn.execute('DROP TABLE IF EXISTS cells')
+                        conn.execute(f'CREATE TABLE cells (dimension TEXT, value TEXT, discount REAL, '
+                                     f'sub_category TEXT, {stats})')
+                        conn.executemany(f'INSERT INTO cells VALUES ({", ".join("?" * (4 + len(_STAT_COLUMNS)))})',
+                                         _cells(cube))
+                        conn.execute('CREATE INDEX cells_dimension ON cells (dimension)')
+                        conn.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (version,))
+                    conn.execute('COMMIT')
+                    # Move the new cells from the log into the file itself.
+                    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        _stored[database] = version
+    _writes.do((database, version), write)
+    return version
+
+
+def _select(database, keys):
+    dims = [key for key in keys if key in aggregates.DIMENSIONS]
+    dimension = dims[0] if dims else _ANY_DIMENSION
+    columns = [_KEY_COLUMNS.get(key, 'value') for key in keys]
+    stats = ', '.join(f'{"SUM" if stat in ("sum", "count") else stat.upper()}("{stat}_{metric}")'
+                      for stat, metric in _STAT_COLUMNS)
+    group = ', '.join(columns)
+    sql = f'SELECT {group}, {stats} FROM cells WHERE dimension = ? GROUP BY {group} ORDER BY {group}'
+    with instrument.span('query_store', 'aggregate'), pool(database).connection() as conn:
+        rows = conn.execute(sql, (dimension,)).fetchall()
+    table = pd.DataFrame(rows, columns=keys + [f'{stat} {metric}' for stat, metric in _STAT_COLUMNS])
+    table = table.set_index(keys)
+    table.columns = pd.MultiIndex.from_tuples(_STAT_COLUMNS)
+    # Counts are stored as REAL with the other stats.
+    table['count'] = table['count'].astype(np.int64)
+    return table
+
+
+def rollup(keys, path=loader.DATA_PATH):
+    """``AggregateCube.rollup(keys)``, read from the store of ``path``.
+
+    ``keys`` may name one of the cube's dimensions and any of Discount and
+    Sub-Category, like the cube's cuboids. The store is (re)written first
+    when it is behind the dataset.
+    """
+    keys = list(keys)
+    unknown = [key for key in keys if key not in KEYS]
+    if unknown or not keys:
+        raise ValueError(f'keys must be taken from {KEYS}, got {keys}')
+    if len([key for key in keys if key in aggregates.DIMENSIONS]) > 1:
+        raise ValueError(f'at most one of {aggregates.DIMENSIONS} can be grouped on at once')
+    path = os.path.abspath(path)
+    version = materialize(path)
+    database = store_path(path)
+    return _results.get_or_compute((database, version, tuple(keys)), lambda: _select(database, keys))
+
+
+def statistic(table, stat, metrics=aggregates.METRICS):
+    """``stat`` of ``metrics`` from a rollup, as the cube's ``mean``, ``sum``... return it."""
+    metrics = list(metrics)
+    if stat not in STATS:
+        raise ValueError(f'stat must be one of {STATS}, got {stat!r}')
+    unknown = [metric for metric in metrics if metric not in aggregates.METRICS]
+    if unknown:
+        raise ValueError(f'metrics must be taken from {aggregates.METRICS}, got {metrics}')
+    if stat == 'count':
+        return table['count'][['Sales']].rename(columns={'Sales': 'count'}).astype(np.int64)
+    if stat == 'mean':
+        return table['sum'][metrics] / table['count'][metrics]
+    return table[stat][metrics]
+
+
+def query(keys, metrics=aggregates.METRICS, stat='mean', path=loader.DATA_PATH):
+    """``stat`` ('mean', 'sum', 'count', 'min' or 'max') of ``metrics`` per group of ``keys``."""
+    return statistic(rollup(keys, path), stat, metrics)
+
+
+class StoreCube(aggregates.AggregateCube):
+    """A read-only ``AggregateCube`` whose rollups are store queries.
+
+    ``source`` is the path of the dataset, whose store file is read in
+    process, or the URL of an ``api.py`` server.
+    """
+
+    def __init__(self, source=loader.DATA_PATH):
+        super().__init__({})
+        if source.startswith(('http://', 'https://')):
+            # Imported here because the API builds on this module.
+            import api
+            self._rollup = functools.partial(api.fetch_rollup, source)
+        else:
+            self._rollup = functools.partial(rollup, path=source)
+
+    def rollup(self, keys):
+        return self._rollup(list(keys))
+
+
+def clear_cache():
+    _results.clear()
+    _stored.clear()
+    with _pools_lock:
+        for open_pool in _pools.values():
+            open_pool.close()
+        _pools.clear()
+
+
+if __name__ == '__main__':
+    print(f'{store_path(os.path.abspath(loader.DATA_PATH))}: version {materialize()}')
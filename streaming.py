@@ -0,0 +1,238 @@
+"""Out-of-core evaluation for datasets that do not fit in memory.
+
+The dataset is streamed in chunks, from its Feather snapshot when that is
+fresh and from the CSV otherwise, and every chunk is folded into the
+mergeable partial aggregates of ``stats`` (or into an ``AggregateCube``).
+Memory use is bounded by the chunk size and the number of groups, not by
+the number of rows.
+
+Results are kept per dataset version in a process-wide ``shared.SharedStore``
+(``SHARED_RESULTS_MB``, default 512), so a page only pays for a pass over
+the data once per version and concurrent sessions asking for the same result
+wait for one pass instead of each making their own. ``compute`` also serves datasets
+that do fit in memory (from the loader's cached frame), and appended rows
+are folded into the cached results instead of starting a new pass.
+"""
+import functools
+import os
+
+import pandas as pd
+
+import filters
+import instrument
+import loader
+import shared
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError:
+    pa = None
+
+CHUNK_ROWS = int(os.environ.get('CHUNK_ROWS', 1_000_000))
+# Datasets larger than this are streamed instead of loaded; OUT_OF_CORE=1
+# streams regardless of size.
+OUT_OF_CORE_MB = int(os.environ.get('OUT_OF_CORE_MB', 1024))
+
+_results = shared.SharedStore(int(os.environ.get('SHARED_RESULTS_MB', 512)) << 20)
+
+
+def out_of_core(path=loader.DATA_PATH):
+    """True when ``path`` should be streamed rather than loaded into memory."""
+    if os.environ.get('OUT_OF_CORE') == '1':
+        return True
+    return os.path.getsize(path) > OUT_OF_CORE_MB << 20
+
+
+def _snapshot_chunks(snapshot, columns, chunksize, first=0, stop=None):
+    # Read record batches from a plain file handle rather than a memory map,
+    # so pages of already processed batches do not stay resident.
+    with pa.OSFile(snapshot, 'rb') as source:
+        reader = pa.ipc.open_file(source)
+        stop = reader.num_record_batches if stop is None else stop
+        batches, rows = [], 0
+        for i in range(first, stop):
+            batch = reader.get_batch(i)
+            if columns is not None:
+                batch = batch.select(list(columns))
+            batches.append(batch)
+            rows += batch.num_rows
+            if rows >= chunksize:
+                yield pa.Table.from_batches(batches).to_pandas()
+                batches, rows = [], 0
+        if batches:
+            yield pa.Table.from_batches(batches).to_pandas()
+
+
+class _ByteRange:
+    """Read-only view of ``[start, end)`` of a file, for parsing one CSV partition."""
+
+    def __init__(self, path, start, end):
+        self._file = open(path, 'rb')
+        self._file.seek(start)
+        self._left = end - start
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self._left:
+            size = self._left
+        data = self._file.read(size)
+        self._left -= len(data)
+        return data
+
+    def close(self):
+        self._file.close()
+
+
+def _csv_chunks(path, columns, chunksize, start=None, end=None):
+    names = loader.csv_columns(path)
+    options = loader.read_options(names if columns is None else columns)
+    if start is None:
+        yield from pd.read_csv(path, usecols=columns, chunksize=chunksize, **options)
+        return
+    source = _ByteRange(path, start, end)
+    try:
+        yield from pd.read_csv(source, header=None, names=names, usecols=columns,
+                               chunksize=chunksize, **options)
+    finally:
+        source.close()
+
+
+def _snapshot_for(path):
+    # The snapshot to read for ``path``, or None to parse the CSV.
+    if path.endswith(loader.SNAPSHOT_SUFFIX):
+        # A snapshot without its CSV, e.g. an export written by another host.
+        return path
+    snapshot = loader.snapshot_path(path)
+    if pa is not None and loader.snapshot_is_fresh(path, snapshot):
+        return snapshot
+    return None
+
+
+def iter_chunks(path=loader.DATA_PATH, columns=None, chunksize=None):
+    """Yield the typed dataset as DataFrames of about ``chunksize`` rows
+    (``CHUNK_ROWS`` by default).
+
+    ``path`` is the CSV (its snapshot is used when fresh) or a snapshot
+    itself. Categorical columns of different chunks may have different
+    categories; the partial aggregates merge them by label.
+    """
+    chunksize = chunksize or CHUNK_ROWS
+    snapshot = _snapshot_for(path)
+    if snapshot is not None:
+        return _snapshot_chunks(snapshot, columns, chunksize)
+    return _csv_chunks(path, columns, chunksize)
+
+
+def partitions(path=loader.DATA_PATH, count=1):
+    """Split the dataset into at most ``count`` partitions for ``iter_partition``.
+
+    Snapshots are split into ranges of record batches and CSVs into byte
+    ranges that start on a line, so each partition can be read on its own
+    (CSV fields must not contain line breaks).
+    """
+    snapshot = _snapshot_for(path)
+    if snapshot is not None:
+        with pa.OSFile(snapshot, 'rb') as source:
+            batches = pa.ipc.open_file(source).num_record_batches
+        count = max(1, min(count, batches))
+        bounds = [batches * i // count for i in range(count + 1)]
+        return [('snapshot', snapshot, first, stop)
+                for first, stop in zip(bounds, bounds[1:]) if stop > first]
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        f.readline()
+        bounds = [f.tell()]
+        for i in range(1, count):
+            f.seek(max(bounds[0], size * i // count) - 1)
+            f.readline()
+            bounds.append(f.tell())
+    bounds.append(size)
+    return [('csv', path, start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+
+def iter_partition(partition, columns=None, chunksize=None):
+    """Yield the rows of one partition from ``partitions`` in chunks."""
+    kind, source, start, stop = partition
+    chunksize = chunksize or CHUNK_ROWS
+    if kind == 'snapshot':
+        return _snapshot_chunks(source, columns, chunksize, start, stop)
+    return _csv_chunks(source, columns, chunksize, start, stop)
+
+
+def fold(partials, chunks):
+    """Update every partial with every chunk; returns ``partials``."""
+    for chunk in chunks:
+        for partial in partials:
+            partial.update(chunk)
+    return partials
+
+
+def compute(name, build, columns=None, path=loader.DATA_PATH, transform=None, where=filters.NO_FILTER):
+    """Fold a pass over ``path`` into the partials returned by ``build()``.
+
+    The folded partials are cached under ``name`` for the current dataset
+    version and row filter. ``columns`` limits the pass to the columns the
+    partials read; ``transform`` is applied to every chunk first (e.g. to
+    derive columns). With the parallel backend on, the pass is split across
+    its workers; datasets small enough to load are folded from the loaded
+    frame, restricted to ``where`` through the filter index. Streamed chunks
+    are filtered as they are read.
+    """
+    # Imported here because parallel builds on this module.
+    import parallel
+    path = os.path.abspath(path)
+    version = loader.dataset_version(path)
+    chunk_columns, chunk_transform = columns, transform
+    if where.active:
+        if columns is not None:
+            chunk_columns = list(dict.fromkeys(list(columns) + where.columns))
+        chunk_transform = functools.partial(filters.filter_chunk, where, transform)
+
+    def run():
+        label = name if isinstance(name, str) else name[0]
+        with instrument.span(label, 'aggregate') as section:
+            if parallel.enabled():
+                section.annotate(source='parallel')
+                partials = parallel.fold(build(), path, chunk_columns, chunk_transform)
+            elif out_of_core(path):
+                section.annotate(source='stream')
+                chunks = iter_chunks(path, chunk_columns)
+                if chunk_transform is not None:
+                    chunks = map(chunk_transform, chunks)
+                partials = fold(build(), chunks)
+            else:
+                section.annotate(source='frame')
+                chunks = [filters.apply(loader.load_dataset(path, columns), where, path)]
+                if transform is not None:
+                    chunks = map(transform, chunks)
+                partials = fold(build(), chunks)
+        # Appended rows are folded in chunk by chunk, filtered like a stream.
+        return {'partials': partials, 'build': build, 'columns': chunk_columns, 'transform': chunk_transform}
+    return _results.get_or_compute((path, name, version, where), run)['partials']
+
+
+def append_rows(rows, old_version, new_version, path=loader.DATA_PATH):
+    """Fold appended ``rows`` into the results cached for ``old_version``.
+
+    The rows are folded into fresh partials that are merged with the cached
+    ones, so results already handed out are not modified.
+    """
+    path = os.path.abspath(path)
+    for (source, name, version, where), entry in _results.items():
+        if source != path or version != old_version:
+            continue
+        batch = rows if entry['columns'] is None else rows[list(entry['columns'])]
+        if entry['transform'] is not None:
+            batch = entry['transform'](batch)
+        added = fold(entry['build'](), [batch])
+        _results.put((path, name, new_version, where),
+                     dict(entry, partials=[old.merge(new) for old, new in zip(entry['partials'], added)]))
+
+
+def head(path=loader.DATA_PATH, columns=None, rows=1000):
+    """The first ``rows`` rows, for previews of datasets too large to show."""
+    return next(iter_chunks(path, columns, rows)).head(rows)
+
+
+def clear_cache():
+    _results.clear()
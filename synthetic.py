@@ -0,0 +1,261 @@
+"""Synthetic Superstore data at any scale.
+
+The generator is fitted to SampleSuperstore.csv and draws new rows from it:
+
+- places (Postal Code, City, State, Region) with their observed frequencies,
+  optionally extended with more cities per state (``cities``);
+- Sub-Category (and so Category), Ship Mode, Segment and Quantity from their
+  observed frequencies;
+- Discount from the levels observed for the row's State and Category;
+- unit price and profit margin together from a row of the same
+  Sub-Category and discount, which keeps the loss-making discounts of the
+  sample;
+- optionally (``years``) an Order Date over that many years from 2014, busier
+  before the holidays and growing from year to year. The sample has no
+  dates, so these follow the published Superstore rather than a fit.
+
+Rows are generated in chunks with a seed per chunk, so any size can be
+written without holding it in memory and the same arguments always give the
+same file::
+
+    python synthetic.py --rows 10000000 --out superstore_10M.csv --snapshot [--years 4]
+"""
+import argparse
+import functools
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+import loader
+
+CHUNK_ROWS = 1_000_000
+# Batch size of written snapshots, the size to_feather writes, so
+# streaming.partitions can balance them.
+BATCH_ROWS = 1 << 16
+# Log-normal noise on sampled unit prices.
+PRICE_NOISE = 0.05
+# Order dates: first day, relative volume per month (January first) and
+# growth per year.
+DATE_START = np.datetime64('2014-01-01')
+MONTH_WEIGHTS = np.array([0.5, 0.4, 0.9, 0.8, 0.8, 0.8, 0.8, 0.8, 1.5, 0.9, 1.6, 1.6])
+YEAR_GROWTH = 0.15
+
+
+class Model:
+    """Frequencies and per-group parameters fitted to a Superstore frame."""
+
+    def __init__(self, df, cities=None):
+        places = df.groupby(['Postal Code', 'City', 'State', 'Region'], observed=True).size()
+        self.places = places.index.to_frame(index=False)
+        self.place_weights = places.to_numpy(dtype='float64')
+        if cities:
+            self._add_cities(cities)
+        self.place_weights /= self.place_weights.sum()
+
+        self.sub_categories = df.groupby(['Sub-Category', 'Category'], observed=True).size()
+        self.frequencies = {col: df[col].value_counts(normalize=True).sort_index()
+                            for col in ['Ship Mode', 'Segment', 'Quantity']}
+        self.levels = np.sort(df['Discount'].unique())
+        self.country = df['Country'].iloc[0]
+
+        # Discount levels per (State, Category), as cumulative probabilities.
+        self.states = pd.Index(sorted(self.places['State'].unique()))
+        self.category_names = pd.Index(sorted(df['Category'].unique()))
+        counts = (df.groupby(['State', 'Category', 'Discount'], observed=True).size()
+                  .unstack('Discount', fill_value=0)
+                  .reindex(pd.MultiIndex.from_product([self.states, self.category_names]), fill_value=0)
+                  .reindex(columns=self.levels, fill_value=0))
+        fallback = df.groupby(['Category', 'Discount'], observed=True).size().unstack(fill_value=0)
+        fallback = fallback.reindex(index=self.category_names, columns=self.levels, fill_value=0).to_numpy()
+        cells = counts.to_numpy(dtype='float64', copy=True)
+        empty = cells.sum(axis=1) == 0
+        cells[empty] = fallback[np.tile(np.arange(len(self.category_names)), len(self.states))[empty]]
+        self.discount_cdf = np.cumsum(cells / cells.sum(axis=1, keepdims=True), axis=1)
+
+        # Unit list price and margin are drawn together, from an observed row
+        # of the same Sub-Category and discount level: the discount largely
+        # decides the margin, and the most expensive products are the ones
+        # discounted at a loss. Levels a Sub-Category was never sold at
+        # borrow the rows of its nearest level.
+        self.sub_names = self.sub_categories.index.get_level_values('Sub-Category')
+        sub = self.sub_names.get_indexer(df['Sub-Category'])
+        level = np.searchsorted(self.levels, df['Discount'])
+        unit = df['Sales'] / (df['Quantity'] * (1 - df['Discount'].astype('float64')))
+        self.sales_rows = _Empirical(sub * len(self.levels) + level,
+                                     np.column_stack([unit, df['Profit'] / df['Sales']]),
+                                     len(self.sub_names) * len(self.levels))
+        self.sales_cell = np.empty((len(self.sub_names), len(self.levels)), dtype=np.int64)
+        for i in range(len(self.sub_names)):
+            seen = np.flatnonzero(self.sales_rows.sizes[i * len(self.levels):(i + 1) * len(self.levels)])
+            nearest = seen[np.abs(self.levels[seen][None, :] - self.levels[:, None]).argmin(axis=1)]
+            self.sales_cell[i] = i * len(self.levels) + nearest
+
+    def _add_cities(self, cities):
+        # More cities in the same states: copies of sampled places under new
+        # names and postal codes, less frequent the more copies there are.
+        extra = cities - self.places['City'].nunique()
+        if extra <= 0:
+            return
+        rng = np.random.default_rng(len(self.places))
+        source = rng.choice(len(self.places), extra, p=self.place_weights / self.place_weights.sum())
+        added = self.places.iloc[source].reset_index(drop=True)
+        copy = added.groupby('City', observed=True).cumcount().to_numpy() + 2
+        added['City'] = added['City'].astype(str) + ' ' + copy.astype(str)
+        added['Postal Code'] = added['Postal Code'] + 100_000 * copy
+        self.places = pd.concat([self.places, added], ignore_index=True)
+        self.place_weights = np.concatenate([self.place_weights, self.place_weights[source] / copy])
+
+    def generate(self, rows, rng, years=None):
+        """A frame of ``rows`` rows in the loader's schema and column order,
+        preceded by an Order Date column when ``years`` is given."""
+        place = rng.choice(len(self.places), rows, p=self.place_weights)
+        subs = self.sub_categories.index
+        sub = rng.choice(len(subs), rows, p=(self.sub_categories / self.sub_categories.sum()).to_numpy())
+        category = self.category_names.get_indexer(subs.get_level_values('Category'))[sub]
+        state = self.states.get_indexer(self.places['State'])[place]
+
+        cdf = self.discount_cdf[state * len(self.category_names) + category]
+        level = np.minimum((rng.random(rows)[:, None] >= cdf).sum(axis=1), len(self.levels) - 1)
+        discount = self.levels[level].astype('float64')
+        quantity = rng.choice(self.frequencies['Quantity'].index.to_numpy(), rows,
+                              p=self.frequencies['Quantity'].to_numpy())
+
+        # A little noise on the price so Sales takes new values, not only observed ones.
+        price, margin = self.sales_rows.sample(self.sales_cell[sub, level], rng).T
+        price = price * np.exp(PRICE_NOISE * rng.standard_normal(rows))
+        sales = np.round(price * quantity * (1 - discount), 4)
+
+        def categorical(codes, values):
+            values = pd.Index(values)
+            order = values.argsort()
+            return pd.Categorical.from_codes(np.argsort(order)[codes], values[order])
+
+        def drawn(col):
+            frequencies = self.frequencies[col]
+            return categorical(rng.choice(len(frequencies), rows, p=frequencies.to_numpy()),
+                               frequencies.index)
+
+        df = pd.DataFrame({
+            'Ship Mode': drawn('Ship Mode'),
+            'Segment': drawn('Segment'),
+            'Country': pd.Categorical.from_codes(np.zeros(rows, dtype='int8'), [self.country]),
+            'City': categorical(*_codes(self.places['City'], place)),
+            'State': categorical(*_codes(self.places['State'], place)),
+            'Postal Code': self.places['Postal Code'].to_numpy()[place],
+            'Region': categorical(*_codes(self.places['Region'], place)),
+            'Category': categorical(category, self.category_names),
+            'Sub-Category': categorical(sub, self.sub_names),
+            'Sales': sales,
+            'Quantity': quantity,
+            'Discount': discount,
+            'Profit': np.round(sales * margin, 4),
+        }).astype(loader.SCHEMA)
+        if years:
+            # Drawn last, so the other columns do not depend on ``years``.
+            days, weights = _order_days(years)
+            df.insert(0, loader.DATE_COLUMN, days[rng.choice(len(days), rows, p=weights)])
+        return df
+
+
+class _Empirical:
+    """Observed values (or rows of values) per cell, sampled with replacement."""
+
+    def __init__(self, cells, values, count):
+        order = np.argsort(cells, kind='stable')
+        self.values = values[order]
+        self.sizes = np.bincount(cells, minlength=count)
+        self.offsets = np.concatenate([[0], np.cumsum(self.sizes)[:-1]])
+
+    def sample(self, cells, rng):
+        # Every sampled cell must have values.
+        picks = (rng.random(len(cells)) * self.sizes[cells]).astype(np.int64)
+        return self.values[self.offsets[cells] + picks]
+
+
+def _order_days(years):
+    # Every day of ``years`` years from DATE_START, with its probability.
+    first_year = DATE_START.astype('datetime64[Y]')
+    days = np.arange(DATE_START, (first_year + years).astype('datetime64[D]'))
+    month = days.astype('datetime64[M]').astype(np.int64) % 12
+    year = (days.astype('datetime64[Y]') - first_year).astype(np.int64)
+    weights = MONTH_WEIGHTS[month] * (1 + YEAR_GROWTH) ** year
+    return days.astype('datetime64[s]'), weights / weights.sum()
+
+
+def _codes(column, rows):
+    # Codes of ``column[rows]`` into the distinct values of ``column``.
+    codes, values = pd.factorize(column)
+    return codes[rows], values
+
+
+@functools.lru_cache(maxsize=4)
+def fit(path=loader.DATA_PATH, cities=None):
+    """The ``Model`` of the dataset at ``path``, with at least ``cities`` cities."""
+    return Model(loader.read_dataset(path), cities)
+
+
+def generate(rows, seed=0, cities=None, years=None):
+    """``rows`` synthetic rows as one frame."""
+    return fit(cities=cities).generate(rows, np.random.default_rng(seed), years)
+
+
+def chunks(rows, chunk_rows=CHUNK_ROWS, seed=0, cities=None, years=None):
+    """Yield ``rows`` synthetic rows in frames of ``chunk_rows``.
+
+    Every chunk has the same categories, in sorted order, whichever values
+    it happens to contain.
+    """
+    model = fit(cities=cities)
+    for index, start in enumerate(range(0, rows, chunk_rows)):
+        yield model.generate(min(chunk_rows, rows - start), np.random.default_rng([seed, index]), years)
+
+
+def write_csv(path, rows, chunk_rows=CHUNK_ROWS, seed=0, cities=None, years=None):
+    tmp = path + '.tmp'
+    with open(tmp, 'w', newline='') as f:
+        for index, chunk in enumerate(chunks(rows, chunk_rows, seed, cities, years)):
+            chunk.to_csv(f, header=index == 0, index=False)
+    os.replace(tmp, path)
+    return path
+
+
+def write_snapshot(path, rows, chunk_rows=CHUNK_ROWS, seed=0, cities=None, years=None):
+    """Write the rows as a Feather (Arrow IPC) file readable by ``streaming``."""
+    import pyarrow as pa
+    import pyarrow.ipc
+    tmp = path + '.tmp'
+    writer = None
+    for chunk in chunks(rows, chunk_rows, seed, cities, years):
+        table = pa.Table.from_pandas(chunk, preserve_index=False)
+        if writer is None:
+            writer = pa.ipc.new_file(tmp, table.schema)
+        writer.write_table(table, max_chunksize=BATCH_ROWS)
+    writer.close()
+    os.replace(tmp, path)
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write synthetic Superstore data.')
+    parser.add_argument('--rows', type=int, required=True)
+    parser.add_argument('--out', required=True, help='CSV to write')
+    parser.add_argument('--snapshot', action='store_true', help='also write its Feather snapshot')
+    parser.add_argument('--cities', type=int, default=None,
+                        help='number of distinct cities (default: those of the sample)')
+    parser.add_argument('--years', type=int, default=None,
+                        help='add an Order Date column spanning this many years from 2014')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    args = parser.parse_args(argv)
+    start = time.perf_counter()
+    write_csv(args.out, args.rows, args.chunk_rows, args.seed, args.cities, args.years)
+    if args.snapshot:
+        write_snapshot(loader.snapshot_path(args.out), args.rows, args.chunk_rows, args.seed, args.cities,
+                       args.years)
+    print(f'{args.rows} rows written to {args.out} in {time.perf_counter() - start:.1f} s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+"""Order-date trends: day, week and month rollups per dimension.
+
+``DailyRollup`` is a mergeable partial like those of ``stats``: for every
+trend dimension it keeps the row count and the Sales and Profit sums of each
+(day, value) in a dense array, one row per day from the first to the last
+order date and one column per value. ``pages.order_trends`` folds it with
+``streaming.compute``, so it is built once per dataset version and row
+filter, from loaded, streamed or parallel passes, and appended rows are
+folded into it rather than rebuilt.
+
+Weeks (from Monday) and months are pre-bucketed from the days: the bucket
+boundaries of each frequency and the cumulative sums over the days are built
+once per rollup, after which any bucket, or any date range, is one
+subtraction per value. A trend over years of history costs one row per
+bucket shown, however many orders those years hold.
+"""
+import copy
+
+import numpy as np
+import pandas as pd
+
+import loader
+
+DIMENSIONS = ['Region', 'Segment', 'Category', 'State']
+METRICS = ['Sales', 'Profit']
+COLUMNS = [loader.DATE_COLUMN] + DIMENSIONS + METRICS
+FREQUENCIES = ['Day', 'Week', 'Month']
+STATS = ['sum', 'mean', 'count']
+
+
+def _codes(column):
+    # Codes into plain labels, -1 for missing values; labels are merged by value.
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return column.cat.codes.to_numpy(), pd.Index(np.asarray(column.cat.categories))
+    codes, labels = pd.factorize(column)
+    return codes, pd.Index(np.asarray(labels))
+
+
+def _bucket_starts(first, days, frequency):
+    # Positions among the ``days`` days from ``first`` where the buckets of
+    # ``frequency`` start, and the first day of each bucket.
+    dates = first + np.arange(days)
+    if frequency == 'Day':
+        keys = dates
+    elif frequency == 'Week':
+        # Day 0 of the epoch was a Thursday, so Mondays are 3 (mod 7) days before.
+        keys = dates - (dates.astype(np.int64) + 3) % 7
+    elif frequency == 'Month':
+        keys = dates.astype('datetime64[M]').astype('datetime64[D]')
+    else:
+        raise ValueError(f'unknown frequency: {frequency}')
+    starts = np.flatnonzero(np.concatenate([[True], keys[1:] != keys[:-1]]))
+    return starts, keys[starts]
+
+
+class DailyRollup:
+    """Row counts and ``metrics`` sums per day and value of each of ``dimensions``.
+
+    Rows without an order date are skipped.
+    """
+
+    def __init__(self, dimensions=DIMENSIONS, metrics=METRICS):
+        self.dimensions = list(dimensions)
+        self.metrics = list(metrics)
+        self.first = None
+        self.days = 0
+        # Per dimension: the values, and a (1 + metrics, days, values) array
+        # of the counts followed by the sums of each metric.
+        self.labels = {}
+        self.tables = {}
+        self._buckets = {}
+
+    def update(self, df):
+        days = df[loader.DATE_COLUMN].to_numpy(dtype='datetime64[D]')
+        dated = ~np.isnat(days)
+        if not dated.any():
+            return self
+        first = days[dated].min()
+        offsets = (days[dated] - first).astype(np.int64)
+        count = int(offsets.max()) + 1
+        weights = [None] + [df[metric].to_numpy(dtype='float64')[dated] for metric in self.metrics]
+        labels, tables = {}, {}
+        for dim in self.dimensions:
+            codes, labels[dim] = _codes(df[dim])
+            codes = codes[dated]
+            kept = codes >= 0
+            width = len(labels[dim])
+            cells = offsets[kept] * width + codes[kept]
+            tables[dim] = np.stack([
+                np.bincount(cells, None if w is None else w[kept], minlength=count * width)
+                for w in weights]).astype('float64').reshape(len(weights), count, width)
+        self._add(first, count, labels, tables)
+        return self
+
+    def _add(self, first, days, labels, tables):
+        # Arrays are replaced, never written to, so merged copies stay independent.
+        self._buckets = {}
+        if self.first is None:
+            self.first, self.days, self.labels, self.tables = first, days, labels, tables
+            return
+        start = min(self.first, first)
+        span = int((max(self.first + self.days, first + days) - start).astype(np.int64))
+        merged_labels, merged_tables = {}, {}
+        for dim in self.dimensions:
+            merged = merged_labels[dim] = self.labels[dim].union(labels[dim])
+            table = merged_tables[dim] = np.zeros((1 + len(self.metrics), span, len(merged)))
+            for day, width, own_labels, own in [(self.first, self.days, self.labels[dim], self.tables[dim]),
+                                                (first, days, labels[dim], tables[dim])]:
+                offset = int((day - start).astype(np.int64))
+                table[:, offset:offset + width, merged.get_indexer(own_labels)] += own
+        self.first, self.days, self.labels, self.tables = start, span, merged_labels, merged_tables
+
+    def merge(self, other):
+        result = copy.copy(self)
+        if other.first is not None:
+            result._add(other.first, other.days, other.labels, other.tables)
+        return result
+
+    def span(self):
+        """First and last order date, or None when there are none."""
+        if self.first is None:
+            return None
+        return pd.Timestamp(self.first), pd.Timestamp(self.first + self.days - 1)
+
+    def _cumulative(self, dim):
+        # Running totals over the days, with a leading row of zeros; built
+        # once per rollup (concurrent first calls may both build it).
+        cumulative = self._buckets.get(None)
+        if cumulative is None:
+            cumulative = self._buckets[None] = {
+                name: np.concatenate([np.zeros_like(table[:, :1]), np.cumsum(table, axis=1)], axis=1)
+                for name, table in self.tables.items()}
+        return cumulative[dim]
+
+    def _bucketed(self, frequency):
+        buckets = self._buckets.get(frequency)
+        if buckets is None:
+            buckets = self._buckets[frequency] = _bucket_starts(self.first, self.days, frequency)
+        return buckets
+
+    def _window(self, start, end):
+        # Day positions [lo, hi) of the days from ``start`` to ``end`` inclusive.
+        lo, hi = 0, self.days
+        if start is not None:
+            lo = int((np.datetime64(pd.Timestamp(start).date(), 'D') - self.first).astype(np.int64))
+        if end is not None:
+            hi = int((np.datetime64(pd.Timestamp(end).date(), 'D') - self.first).astype(np.int64)) + 1
+        return min(max(lo, 0), self.days), min(max(hi, 0), self.days)
+
+    def _frame(self, totals, dimension, index, metric, stat):
+        # ``stat`` of ``metric`` from (fields, rows, values) totals, without
+        # the values that have no rows at all.
+        if stat not in STATS:
+            raise ValueError(f'unknown statistic: {stat}')
+        if dimension is None:
+            totals, columns = totals.sum(axis=2, keepdims=True), pd.Index(['All'])
+        else:
+            columns = pd.Index(self.labels[dimension], name=dimension)
+        counts = totals[0]
+        values = counts
+        if stat != 'count':
+            values = totals[1 + self.metrics.index(metric)]
+            if stat == 'mean':
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    values = np.where(counts > 0, values / counts, np.nan)
+        present = counts.sum(axis=0) > 0
+        return pd.DataFrame(values[:, present], index=index, columns=columns[present])
+
+    def trend(self, dimension=None, frequency='Month', metric='Sales', stat='sum', start=None, end=None):
+        """``stat`` ('sum', 'mean' or 'count') of ``metric`` per ``frequency``
+        bucket and value of ``dimension`` (None for all rows), over the order
+        dates from ``start`` to ``end`` inclusive (None: no bound).
+
+        Rows are labelled with the first day of their bucket; buckets cut by
+        the range only count the days inside it.
+        """
+        empty = pd.DatetimeIndex([], name=loader.DATE_COLUMN)
+        if self.first is None:
+            return pd.DataFrame(index=empty)
+        lo, hi = self._window(start, end)
+        starts, labels = self._bucketed(frequency)
+        cumulative = self._cumulative(dimension or self.dimensions[0])
+        if lo >= hi:
+            return self._frame(cumulative[:, :0], dimension, empty, metric, stat)
+        # The buckets holding days lo to hi - 1; the first and last are cut at the range.
+        first, stop = np.searchsorted(starts, lo, 'right') - 1, np.searchsorted(starts, hi, 'left')
+        edges = np.concatenate([[lo], starts[first + 1:stop], [hi]])
+        totals = np.diff(cumulative[:, edges], axis=1)
+        index = pd.DatetimeIndex(labels[first:stop], name=loader.DATE_COLUMN)
+        return self._frame(totals, dimension, index, metric, stat)
+
+    def totals(self, dimension=None, start=None, end=None):
+        """Row count and ``metrics`` sums per value of ``dimension`` over the
+        order dates from ``start`` to ``end`` inclusive."""
+        columns = ['count'] + self.metrics
+        if self.first is None:
+            return pd.DataFrame(columns=columns)
+        lo, hi = self._window(start, end)
+        cumulative = self._cumulative(dimension or self.dimensions[0])
+        totals = cumulative[:, max(hi, lo)] - cumulative[:, lo]
+        if dimension is None:
+            index = pd.Index(['All'])
+            totals = totals.sum(axis=1, keepdims=True)
+        else:
+            index = pd.Index(self.labels[dimension], name=dimension)
+        present = totals[0] > 0
+        table = pd.DataFrame(totals.T[present], index=index[present], columns=columns)
+        return table.astype({'count': 'int64'})
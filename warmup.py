@@ -0,0 +1,95 @@
+"""Pre-warm the dashboard before its first request.
+
+    python warmup.py [--views State ...]
+    python warmup.py --serve [--views ...] [-- streamlit run options]
+
+``warm`` does what a cold first request would otherwise pay for: it writes
+the dataset snapshot, cube and pairplot files when they are missing or
+stale, loads the dataset, cube and filter index into this process's
+caches, imports the plotting libraries the dashboard defers, and
+optionally renders ``views`` headlessly to fill the figure cache.
+
+On its own the script leaves the files behind for the next process (e.g.
+in an image build step). With ``--serve`` it then starts ``streamlit run
+app.py`` in the same process, so the server's first sessions find
+everything loaded. ``PREWARM_VIEWS`` sets the default views, as the last
+sidebar choices separated by commas (e.g. ``Region,State``).
+"""
+import argparse
+import os
+import sys
+import time
+
+import aggregates
+import loader
+import pages
+import pairplots
+import ranking
+import streaming
+
+PREWARM_VIEWS = [view for view in os.environ.get('PREWARM_VIEWS', '').split(',') if view]
+
+
+def _build_pairplots(path):
+    try:
+        pairplots.build(path=path)
+    except Exception:
+        # Build the others one by one and skip the failing ones: the app
+        # renders a missing asset on first view.
+        for hue in pairplots.PAIRPLOTS:
+            try:
+                pairplots.build([hue], workers=1, path=path)
+            except Exception as exc:
+                print(f'pairplot {hue!r} skipped: {exc!r}', file=sys.stderr)
+
+
+def warm(path=loader.DATA_PATH, views=PREWARM_VIEWS, imports=True):
+    """Fill this process's caches for ``path``; returns seconds per step."""
+    steps = {}
+
+    def step(name, func):
+        start = time.perf_counter()
+        func()
+        steps[name] = time.perf_counter() - start
+
+    if imports:
+        import app
+        step('imports', lambda: [module.load() for module in app.PLOTTING_MODULES])
+    if not streaming.out_of_core(path):
+        # The full frame answers every page's columns; it writes a stale snapshot.
+        step('dataset', lambda: loader.load_dataset(path))
+    step('cube', lambda: aggregates.get_cube(path))
+    step('filters', lambda: pages.filter_options(path))
+    step('ranking', lambda: ranking.get_ranking(path))
+    if loader.has_dates(path):
+        step('trends', lambda: pages.order_trends(path))
+    # Files: missing pairplot assets are rendered, the others are left alone.
+    step('pairplots', lambda: _build_pairplots(path))
+    if views:
+        import report
+        for choices in report.views():
+            if choices[-1] in views:
+                step(choices[-1], lambda: report.render_view(choices, shutdown=False))
+    return steps
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Pre-warm the dashboard before its first request.')
+    parser.add_argument('--views', nargs='+', default=PREWARM_VIEWS,
+                        help='last sidebar choice of the views to render, e.g. "State" (default: none)')
+    parser.add_argument('--serve', action='store_true', help='then run the dashboard in this process')
+    parser.add_argument('streamlit_args', nargs='*', help='options for "streamlit run", after --')
+    args = parser.parse_args(argv)
+    start = time.perf_counter()
+    for name, seconds in warm(loader.DATA_PATH, args.views).items():
+        print(f'{name:>24} {seconds:8.3f} s')
+    print(f'{"warm":>24} {time.perf_counter() - start:8.3f} s')
+    if args.serve:
+        from streamlit.web import cli
+        app_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+        sys.argv = ['streamlit', 'run', app_path] + args.streamlit_args
+        sys.exit(cli.main())
+
+
+if __name__ == '__main__':
+    main()